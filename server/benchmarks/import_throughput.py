@@ -0,0 +1,174 @@
+"""
+数据导入吞吐量基准
+
+生成一份各表行数按比例分配的备份数据，经 DataImporter 导入到真实表结构的数据库中，报告每分钟导入的行数
+和 finish() 持有主库写锁的时间：
+    ndjson：gzip 压缩的 NDJSON 请求体按 64KB 分块交给 NDJSONParser，解析结果经 add_many 写入
+            （与 POST /api/settings/import-data/stream 的路径相同）
+    json：完整的备份字典经 add_export 写入（与 POST /api/settings/import-data 的路径相同，不含请求体解析）
+
+运行（在项目根目录）：
+    python -m server.benchmarks.import_throughput [--rows 200000] [--chunk-size 5000]
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+from server.database import init_database
+from server.services.data_import_service import IMPORT_TABLES, DataImporter, NDJSONParser
+
+# 各表行数占比（与实际备份中以销售、采购记录为主的分布相近）
+_TABLE_SHARES = {
+    "suppliers": 0.005,
+    "customers": 0.02,
+    "employees": 0.005,
+    "products": 0.02,
+    "purchases": 0.25,
+    "sales": 0.5,
+    "returns": 0.05,
+    "income": 0.1,
+    "remittance": 0.05,
+}
+
+_PAYMENT_METHODS = ("现金", "微信转账", "银行卡")
+
+# 请求体分块大小（字节）
+_BODY_CHUNK_SIZE = 64 * 1024
+
+
+def _generate_export(rows: int) -> dict:
+    """生成备份数据（表名 -> 行列表）"""
+    counts = {table: max(1, int(rows * share)) for table, share in _TABLE_SHARES.items()}
+    suppliers, customers, employees = counts["suppliers"], counts["customers"], counts["employees"]
+
+    def date(i: int) -> str:
+        return f"2025-{i % 12 + 1:02d}-{i % 28 + 1:02d}T10:00:00"
+
+    return {
+        "suppliers": [{"id": i + 1, "name": f"供应商{i}", "note": None} for i in range(suppliers)],
+        "customers": [{"id": i + 1, "name": f"客户{i}", "note": "备注" if i % 3 == 0 else None} for i in range(customers)],
+        "employees": [{"id": i + 1, "name": f"员工{i}", "note": None} for i in range(employees)],
+        "products": [
+            {
+                "id": i + 1, "name": f"产品{i}", "description": None, "stock": i % 500,
+                "unit": "公斤", "supplierId": i % suppliers + 1
+            }
+            for i in range(counts["products"])
+        ],
+        "purchases": [
+            {
+                "productName": f"产品{i % 200}", "quantity": i % 50 + 1, "purchaseDate": date(i),
+                "supplierId": i % suppliers + 1, "totalPurchasePrice": round((i % 50 + 1) * 10.5, 2), "note": None
+            }
+            for i in range(counts["purchases"])
+        ],
+        "sales": [
+            {
+                "productName": f"产品{i % 200}", "quantity": i % 50 + 1, "saleDate": date(i),
+                "customerId": i % customers + 1, "totalSalePrice": round((i % 50 + 1) * 12.5, 2),
+                "note": "备注" if i % 5 == 0 else None
+            }
+            for i in range(counts["sales"])
+        ],
+        "returns": [
+            {
+                "productName": f"产品{i % 200}", "quantity": i % 5 + 1, "returnDate": date(i),
+                "customerId": i % customers + 1, "totalReturnPrice": round((i % 5 + 1) * 12.5, 2), "note": None
+            }
+            for i in range(counts["returns"])
+        ],
+        "income": [
+            {
+                "incomeDate": date(i), "customerId": i % customers + 1, "amount": 100 + i % 900, "discount": 0,
+                "employeeId": i % employees + 1, "paymentMethod": _PAYMENT_METHODS[i % 3], "note": None
+            }
+            for i in range(counts["income"])
+        ],
+        "remittance": [
+            {
+                "remittanceDate": date(i), "supplierId": i % suppliers + 1, "amount": 100 + i % 900,
+                "employeeId": i % employees + 1, "paymentMethod": _PAYMENT_METHODS[i % 3], "note": None
+            }
+            for i in range(counts["remittance"])
+        ],
+    }
+
+
+def _to_ndjson_gzip(data: dict) -> bytes:
+    """把备份数据编码为 gzip 压缩的 NDJSON 请求体"""
+    lines = [json.dumps({"exportInfo": {"version": "benchmark"}})]
+    for table in IMPORT_TABLES:
+        lines.extend(
+            json.dumps({"table": table, "data": record}, ensure_ascii=False)
+            for record in data[table]
+        )
+    return gzip.compress(("\n".join(lines) + "\n").encode("utf-8"), compresslevel=6)
+
+
+def _run(pool, user_id: int, mode: str, data: dict, body: bytes, chunk_size: int) -> dict:
+    """导入一次，返回总行数、耗时和持锁时间"""
+    with pool.get_connection() as conn:
+        importer = DataImporter(conn, user_id, chunk_size=chunk_size)
+        started = time.perf_counter()
+        importer.begin()
+        try:
+            if mode == "ndjson":
+                parser = NDJSONParser(gzip=True)
+                for offset in range(0, len(body), _BODY_CHUNK_SIZE):
+                    importer.add_many(parser.feed(body[offset:offset + _BODY_CHUNK_SIZE]))
+                importer.add_many(parser.close())
+            else:
+                importer.add_export(data)
+            counts = importer.finish()
+        except Exception:
+            importer.abort()
+            raise
+        elapsed = time.perf_counter() - started
+    return {"rows": sum(counts.values()), "seconds": elapsed, "lock_hold_ms": importer.lock_hold_ms}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="数据导入吞吐量基准")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    logging.getLogger("server").setLevel(logging.WARNING)
+    # 替换数据的 INSERT ... SELECT 会超过慢查询阈值，不输出这些日志
+    logging.getLogger("server.slow_query_log").setLevel(logging.ERROR)
+
+    data = _generate_export(args.rows)
+    body = _to_ndjson_gzip(data)
+    print(
+        f"行数: {sum(len(rows) for rows in data.values())}, 分块: {args.chunk_size}, 重复: {args.repeat}, "
+        f"NDJSON 请求体: {len(body) / 1024 / 1024:.1f}MB（gzip）"
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = init_database(str(Path(tmp) / "benchmark.db"))
+        with pool.get_connection() as conn:
+            user_id = conn.execute(
+                "INSERT INTO users (username, password) VALUES (?, ?)",
+                ("benchmark", "-")
+            ).lastrowid
+            conn.commit()
+
+        for mode in ("ndjson", "json"):
+            # 覆盖模式：每次导入先删除上一次导入的数据，重复导入的耗时可以比较
+            results = [_run(pool, user_id, mode, data, body, args.chunk_size) for _ in range(args.repeat)]
+            best = min(results, key=lambda result: result["seconds"])
+            print(
+                f"{mode}: 最快 {best['seconds']:.2f}秒（{best['rows'] / best['seconds'] * 60 / 1e6:.2f}M 行/分钟），"
+                f"最慢 {max(result['seconds'] for result in results):.2f}秒，持锁 {best['lock_hold_ms']}毫秒"
+            )
+        pool.close_all()
+
+
+if __name__ == "__main__":
+    main()
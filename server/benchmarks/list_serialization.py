@@ -0,0 +1,145 @@
+"""
+列表接口序列化基准
+
+对比 10000 行销售记录的两种序列化方式：
+    原路径：逐行 SaleResponse(...).model_dump() → PaginatedResponse → BaseResponse → JSONResponse
+    快速路径：server.serialization.paginated_response（行直接编码为 JSON 字节）
+
+运行（在项目根目录）：
+    python -m server.benchmarks.list_serialization [--rows 10000] [--repeat 20]
+"""
+
+import argparse
+import sqlite3
+import statistics
+import time
+
+from fastapi.responses import JSONResponse
+from fastapi.encoders import jsonable_encoder
+
+from server.models import BaseResponse, PaginatedResponse, SaleResponse
+from server.serialization import orjson, paginated_response
+
+_QUERY = """
+    SELECT id, userId, productName, quantity, customerId, saleDate,
+           totalSalePrice, note, created_at
+    FROM sales
+    WHERE userId = ?
+    ORDER BY saleDate DESC, id DESC
+    LIMIT ? OFFSET 0
+"""
+
+
+def _create_database(rows: int) -> sqlite3.Connection:
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute("""
+        CREATE TABLE sales (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            userId INTEGER NOT NULL,
+            productName TEXT NOT NULL,
+            quantity REAL NOT NULL,
+            customerId INTEGER,
+            saleDate TEXT,
+            totalSalePrice REAL,
+            note TEXT,
+            created_at TEXT DEFAULT (datetime('now'))
+        )
+    """)
+    conn.executemany(
+        "INSERT INTO sales (userId, productName, quantity, customerId, saleDate, totalSalePrice, note) "
+        "VALUES (1, ?, ?, ?, ?, ?, ?)",
+        [
+            (
+                f"产品{i % 200}",
+                i % 50 + 1,
+                i % 30 or None,
+                f"2025-{i % 12 + 1:02d}-{i % 28 + 1:02d}T10:00:00",
+                round((i % 50 + 1) * 12.5, 2),
+                "备注" if i % 5 == 0 else None,
+            )
+            for i in range(rows)
+        ]
+    )
+    return conn
+
+
+def _current_path(conn: sqlite3.Connection, rows: int) -> bytes:
+    cursor = conn.execute(_QUERY, (1, rows))
+    sales = []
+    for row in cursor.fetchall():
+        sale = SaleResponse(
+            id=row[0],
+            userId=row[1],
+            productName=row[2],
+            quantity=row[3],
+            customerId=row[4],
+            saleDate=row[5],
+            totalSalePrice=row[6],
+            note=row[7],
+            created_at=row[8]
+        )
+        sales.append(sale.model_dump())
+    paginated_data = PaginatedResponse(
+        items=sales,
+        total=rows,
+        page=1,
+        page_size=rows,
+        total_pages=1
+    )
+    response = BaseResponse(
+        success=True,
+        message="获取销售记录列表成功",
+        data=paginated_data.model_dump()
+    )
+    # FastAPI 对 response_model=BaseResponse 的处理：再次校验并序列化
+    content = jsonable_encoder(BaseResponse.model_validate(response.model_dump()))
+    return JSONResponse(content).body
+
+
+def _fast_path(conn: sqlite3.Connection, rows: int) -> bytes:
+    cursor = conn.execute(_QUERY, (1, rows))
+    return paginated_response(
+        cursor,
+        SaleResponse,
+        total=rows,
+        page=1,
+        page_size=rows,
+        message="获取销售记录列表成功"
+    ).body
+
+
+def _measure(func, conn, rows: int, repeat: int) -> list:
+    func(conn, rows)  # 预热
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(conn, rows)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="列表接口序列化基准")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    conn = _create_database(args.rows)
+
+    assert _current_path(conn, args.rows) == _fast_path(conn, args.rows), "快速路径的输出与原路径不一致"
+
+    print(f"行数: {args.rows}, 重复: {args.repeat}, 编码器: {'orjson' if orjson else 'json'}")
+    results = {}
+    for name, func in (("原路径", _current_path), ("快速路径", _fast_path)):
+        timings = _measure(func, conn, args.rows, args.repeat)
+        results[name] = statistics.median(timings)
+        print(
+            f"{name}: 中位数 {results[name]:.1f}ms, 最小 {min(timings):.1f}ms, "
+            f"最大 {max(timings):.1f}ms, 响应 {len(func(conn, args.rows))} 字节"
+        )
+    print(f"加速: {results['原路径'] / results['快速路径']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+大分页响应内存基准
+
+对比一次返回 100000 行销售记录时的峰值内存（RSS）：
+    pydantic：原路径（逐行 SaleResponse → PaginatedResponse → BaseResponse → JSONResponse）
+    full：快速路径一次性编码（server.serialization.paginated_response）
+    stream：流式响应（server.serialization.iter_paginated_chunks，逐块丢弃以模拟发送）
+
+每种方式在独立的子进程中运行，报告峰值 RSS 相对于准备完成时的增量。
+
+运行（在项目根目录，仅支持 Linux/macOS）：
+    python -m server.benchmarks.list_streaming_memory [--rows 100000]
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+_QUERY = """
+    SELECT id, userId, productName, quantity, customerId, saleDate,
+           totalSalePrice, note, created_at
+    FROM sales
+    WHERE userId = ?
+    ORDER BY saleDate DESC, id DESC
+    LIMIT ? OFFSET 0
+"""
+
+MODES = ("pydantic", "full", "stream")
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def _prepare(db_path: str, rows: int):
+    from server.database import SQLiteConnectionPool
+
+    pool = SQLiteConnectionPool(db_path)
+    with pool.get_connection() as conn:
+        conn.execute("INSERT INTO users (username, password) VALUES ('bench', 'x')")
+        conn.executemany(
+            "INSERT INTO sales (userId, productName, quantity, customerId, saleDate, totalSalePrice, note) "
+            "VALUES (1, ?, ?, NULL, ?, ?, ?)",
+            [
+                (
+                    f"产品{i % 200}",
+                    i % 50 + 1,
+                    f"2025-{i % 12 + 1:02d}-{i % 28 + 1:02d}T10:00:00",
+                    round((i % 50 + 1) * 12.5, 2),
+                    "备注" if i % 5 == 0 else None,
+                )
+                for i in range(rows)
+            ]
+        )
+    pool.close_all()
+
+
+def _run_mode(db_path: str, rows: int, mode: str):
+    """子进程：执行一种序列化方式并输出峰值内存增量和响应大小"""
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    from server.database import SQLiteConnectionPool
+    from server.models import BaseResponse, PaginatedResponse, SaleResponse
+    from server.serialization import iter_paginated_chunks, paginated_response
+
+    pool = SQLiteConnectionPool(db_path)
+    with pool.get_connection() as conn:
+        conn.execute("SELECT COUNT(*) FROM sales").fetchone()
+    baseline = _peak_rss_mb()
+
+    size = 0
+    if mode == "stream":
+        for chunk in iter_paginated_chunks(pool, _QUERY, (1, rows), SaleResponse, rows, 1, rows):
+            size += len(chunk)
+    else:
+        with pool.get_connection() as conn:
+            cursor = conn.execute(_QUERY, (1, rows))
+            if mode == "full":
+                body = paginated_response(cursor, SaleResponse, rows, 1, rows).body
+            else:
+                items = [SaleResponse(**dict(row)).model_dump() for row in cursor.fetchall()]
+                data = PaginatedResponse(items=items, total=rows, page=1, page_size=rows, total_pages=1)
+                response = BaseResponse(data=data.model_dump())
+                body = JSONResponse(jsonable_encoder(BaseResponse.model_validate(response.model_dump()))).body
+            size = len(body)
+
+    print(f"{_peak_rss_mb() - baseline:.1f} {size}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="大分页响应内存基准")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        _run_mode(args.db, args.rows, args.mode)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        _prepare(db_path, args.rows)
+
+        print(f"行数: {args.rows}")
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, "-m", "server.benchmarks.list_streaming_memory",
+                 "--rows", str(args.rows), "--mode", mode, "--db", db_path],
+                check=True, capture_output=True, text=True
+            ).stdout.split()
+            peak_mb, size = float(output[-2]), int(output[-1])
+            print(f"{mode:>8}: 峰值内存增量 {peak_mb:.1f} MB, 响应 {size / 1024 / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
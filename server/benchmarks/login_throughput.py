@@ -0,0 +1,218 @@
+"""
+登录吞吐量与心跳延迟基准
+
+并发登录（bcrypt 校验密码）的同时，另一个客户端按固定间隔发送心跳，对比两种密码校验方式：
+    事件循环中计算：原路径，登录接口直接调用 verify_password，bcrypt 计算期间事件循环被阻塞
+    有界线程池：server.middleware.verify_password_async（PASSWORD_HASH_WORKERS 个工作线程，
+               排队超过 PASSWORD_HASH_MAX_PENDING 时返回 503，基准中的客户端稍后重试）
+
+报告每秒完成的登录数、被拒绝（503）的次数，以及登录突发期间心跳的 p50/p99/最大延迟；
+空闲时的心跳延迟作为参照。
+
+服务端是在后台线程中运行的 uvicorn（本机回环地址），客户端经 TCP 连接发送请求；
+登录和心跳在服务端的同一个事件循环中处理，事件循环被阻塞时心跳同样要等待。
+bcrypt 计算时释放 GIL，线程池的吞吐量随 CPU 核数增加（单核机器上只改善心跳延迟）
+
+运行（在项目根目录）：
+    python -m server.benchmarks.login_throughput [--logins 40] [--concurrency 8]
+"""
+
+import argparse
+import asyncio
+import logging
+import socket
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+from server.database import init_database
+from server.middleware import (
+    PASSWORD_HASH_MAX_PENDING,
+    PASSWORD_HASH_WORKERS,
+    create_access_token,
+    get_password_hash,
+    verify_password,
+    verify_password_async,
+)
+from server.routers import auth, users
+
+_USERNAME = "benchmark"
+_PASSWORD = "Benchmark123!"
+
+# 收到 503 后重试前的等待时间（秒）
+_RETRY_DELAY = 0.05
+
+
+async def _verify_on_event_loop(plain_password: str, hashed_password: str) -> bool:
+    """原路径：在事件循环中直接计算 bcrypt"""
+    return verify_password(plain_password, hashed_password)
+
+
+def _create_app() -> FastAPI:
+    app = FastAPI()
+    app.include_router(auth.router)
+    app.include_router(users.router)
+    return app
+
+
+class _Server:
+    """在后台线程中运行的 uvicorn"""
+
+    def __init__(self, app: FastAPI):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self._server = uvicorn.Server(
+            uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning", access_log=False)
+        )
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.should_exit = True
+        self._thread.join()
+
+
+def _percentile(values, percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+async def _heartbeat(client: httpx.AsyncClient, headers: dict) -> float:
+    """发送一次心跳，返回延迟（毫秒）"""
+    started = time.perf_counter()
+    response = await client.post("/api/users/heartbeat", headers=headers, json={"device_id": "benchmark"})
+    assert response.status_code == 200, response.text
+    return (time.perf_counter() - started) * 1000
+
+
+async def _measure_idle(url: str, token: str, heartbeats: int, interval: float) -> list:
+    """空闲时的心跳延迟"""
+    headers = {"Authorization": f"Bearer {token}"}
+    async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+        await _heartbeat(client, headers)  # 预热（填充认证缓存）
+        latencies = []
+        for _ in range(heartbeats):
+            latencies.append(await _heartbeat(client, headers))
+            await asyncio.sleep(interval)
+        return latencies
+
+
+async def _measure_burst(url: str, token: str, logins: int, concurrency: int, interval: float) -> dict:
+    """并发登录期间的登录吞吐量和心跳延迟"""
+    headers = {"Authorization": f"Bearer {token}"}
+    async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+        await _heartbeat(client, headers)  # 预热
+
+        remaining = logins
+        rejected = 0
+        latencies = []
+        finished = asyncio.Event()
+
+        async def login_worker():
+            nonlocal remaining, rejected
+            while remaining > 0:
+                remaining -= 1
+                while True:
+                    response = await client.post(
+                        "/api/auth/login",
+                        json={"username": _USERNAME, "password": _PASSWORD}
+                    )
+                    if response.status_code != 503:
+                        break
+                    rejected += 1
+                    await asyncio.sleep(_RETRY_DELAY)
+                assert response.status_code == 200, response.text
+
+        async def heartbeat_worker():
+            while not finished.is_set():
+                latencies.append(await _heartbeat(client, headers))
+                await asyncio.sleep(interval)
+
+        heartbeat_task = asyncio.create_task(heartbeat_worker())
+        started = time.perf_counter()
+        await asyncio.gather(*(login_worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        finished.set()
+        await heartbeat_task
+
+        return {"rate": logins / elapsed, "rejected": rejected, "latencies": latencies}
+
+
+def _format_latencies(latencies: list) -> str:
+    return (
+        f"p50 {statistics.median(latencies):.1f}ms, p99 {_percentile(latencies, 99):.1f}ms, "
+        f"最大 {max(latencies):.1f}ms（{len(latencies)} 次）"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="登录吞吐量与心跳延迟基准")
+    parser.add_argument("--logins", type=int, default=40, help="每种方式的登录次数")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发登录的客户端数")
+    parser.add_argument("--interval", type=float, default=0.02, help="心跳间隔（秒）")
+    args = parser.parse_args()
+
+    logging.getLogger("server").setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = init_database(str(Path(tmp) / "benchmark.db"))
+        with pool.get_connection() as conn:
+            cursor = conn.execute(
+                "INSERT INTO users (username, password) VALUES (?, ?)",
+                (_USERNAME, get_password_hash(_PASSWORD))
+            )
+            user_id = cursor.lastrowid
+            conn.commit()
+        token = create_access_token({"user_id": user_id, "username": _USERNAME})
+        server = _Server(_create_app())
+
+        print(
+            f"登录: {args.logins}, 并发: {args.concurrency}, 心跳间隔: {args.interval * 1000:.0f}ms, "
+            f"线程池: {PASSWORD_HASH_WORKERS} 个工作线程，最多 {PASSWORD_HASH_MAX_PENDING} 个任务"
+        )
+        results = {}
+        with server:
+            idle = asyncio.run(_measure_idle(server.url, token, 100, args.interval))
+            print(f"空闲时心跳: {_format_latencies(idle)}")
+
+            for name, verify in (("事件循环中计算", _verify_on_event_loop), ("有界线程池", verify_password_async)):
+                auth.verify_password_async = verify
+                try:
+                    results[name] = asyncio.run(
+                        _measure_burst(server.url, token, args.logins, args.concurrency, args.interval)
+                    )
+                finally:
+                    auth.verify_password_async = verify_password_async
+                result = results[name]
+                print(
+                    f"{name}: 登录 {result['rate']:.1f} 次/秒（503 重试 {result['rejected']} 次），"
+                    f"心跳 {_format_latencies(result['latencies'])}"
+                )
+
+        legacy, bounded = results["事件循环中计算"], results["有界线程池"]
+        print(
+            f"登录吞吐量: {bounded['rate'] / legacy['rate']:.2f}x，"
+            f"心跳 p99: {_percentile(legacy['latencies'], 99):.1f}ms → {_percentile(bounded['latencies'], 99):.1f}ms"
+        )
+        pool.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+中间件栈吞吐量基准
+
+对比一个需要认证的简单接口在两种中间件栈下的每秒请求数：
+    原中间件栈：@app.middleware("http") 注册的 CORS、错误处理、日志中间件（BaseHTTPMiddleware）
+               + CORSMiddleware + GZipMiddleware（CORS 处理两次）
+    纯 ASGI 中间件栈：server.middleware.setup_middleware + GZipMiddleware
+
+另外对比纯 ASGI 中间件栈开启请求耗时记录（ServerTimingMiddleware + TimedGZipMiddleware，
+即 SERVER_TIMING=true 时的配置，采样率为 0）与关闭时的每秒请求数
+
+请求在进程内经 httpx 的 ASGITransport 发送（不经过网络），测得的是中间件和路由本身的开销；
+请求日志在两种中间件栈下都关闭
+
+运行（在项目根目录）：
+    python -m server.benchmarks.middleware_throughput [--requests 5000] [--concurrency 10]
+"""
+
+import argparse
+import asyncio
+import logging
+import tempfile
+import time
+import traceback
+from pathlib import Path
+
+import httpx
+from fastapi import Depends, FastAPI, Request, status
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
+
+from server.database import ConnectionTimeoutError, DatabaseBusyError, init_database
+from server.middleware import create_access_token, get_current_user, logger, setup_middleware
+from server.models import ErrorResponse
+from server.tracing import ServerTimingMiddleware, TimedGZipMiddleware, init_trace_buffer
+
+
+# ==================== 原中间件栈 ====================
+
+async def _legacy_logging_middleware(request: Request, call_next):
+    start_time = time.time()
+    logger.info(
+        f"请求: {request.method} {request.url.path} - "
+        f"客户端: {request.client.host if request.client else 'unknown'}"
+    )
+    response = await call_next(request)
+    process_time = time.time() - start_time
+    logger.info(
+        f"响应: {request.method} {request.url.path} - "
+        f"状态码: {response.status_code} - "
+        f"耗时: {process_time:.3f}秒"
+    )
+    response.headers["X-Process-Time"] = str(process_time)
+    return response
+
+
+async def _legacy_error_handler_middleware(request: Request, call_next):
+    try:
+        return await call_next(request)
+    except (DatabaseBusyError, ConnectionTimeoutError):
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content=ErrorResponse(success=False, message="数据库暂时繁忙，请稍后重试").model_dump()
+        )
+    except Exception as e:
+        logger.error(f"未处理的异常: {e}\n{traceback.format_exc()}")
+        return JSONResponse(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content=ErrorResponse(success=False, message="服务器内部错误").model_dump()
+        )
+
+
+async def _legacy_cors_middleware(request: Request, call_next):
+    if request.method == "OPTIONS":
+        response = JSONResponse(content={})
+    else:
+        response = await call_next(request)
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS, PATCH"
+    response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization, X-Requested-With"
+    response.headers["Access-Control-Allow-Credentials"] = "true"
+    response.headers["Access-Control-Max-Age"] = "3600"
+    if request.method == "GET":
+        response.headers["Cache-Control"] = "private, max-age=300"
+        response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+def _legacy_middleware(app: FastAPI):
+    app.middleware("http")(_legacy_cors_middleware)
+    app.middleware("http")(_legacy_error_handler_middleware)
+    app.middleware("http")(_legacy_logging_middleware)
+    app.add_middleware(GZipMiddleware, minimum_size=1000)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+
+def _asgi_middleware(app: FastAPI):
+    setup_middleware(app)
+    app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+
+def _traced_middleware(app: FastAPI):
+    setup_middleware(app)
+    app.add_middleware(TimedGZipMiddleware, minimum_size=1000)
+    app.add_middleware(ServerTimingMiddleware)
+
+
+# ==================== 基准 ====================
+
+def _create_app(configure) -> FastAPI:
+    app = FastAPI()
+    configure(app)
+
+    @app.get("/ping")
+    async def ping(current_user: dict = Depends(get_current_user)):
+        return {"success": True, "message": "pong", "data": {"user_id": current_user["user_id"]}}
+
+    return app
+
+
+async def _measure(app: FastAPI, token: str, requests: int, concurrency: int) -> float:
+    """发送请求，返回每秒请求数"""
+    transport = httpx.ASGITransport(app=app)
+    headers = {"Authorization": f"Bearer {token}", "Origin": "http://localhost"}
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        response = await client.get("/ping", headers=headers)  # 预热（填充认证缓存）
+        assert response.status_code == 200, response.text
+
+        remaining = requests
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                response = await client.get("/ping", headers=headers)
+                assert response.status_code == 200
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return requests / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="中间件栈吞吐量基准")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    logging.getLogger("server").setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = init_database(str(Path(tmp) / "benchmark.db"))
+        with pool.get_connection() as conn:
+            cursor = conn.execute(
+                "INSERT INTO users (username, password) VALUES (?, ?)",
+                ("benchmark", "-")
+            )
+            user_id = cursor.lastrowid
+        token = create_access_token({"user_id": user_id, "username": "benchmark"})
+
+        init_trace_buffer(sample_rate=0)
+
+        print(f"请求: {args.requests}, 并发: {args.concurrency}, 重复: {args.repeat}")
+        apps = {
+            name: _create_app(configure)
+            for name, configure in (
+                ("原中间件栈", _legacy_middleware),
+                ("纯 ASGI 中间件栈", _asgi_middleware),
+                ("纯 ASGI 中间件栈 + 请求耗时记录", _traced_middleware),
+            )
+        }
+        # 各中间件栈轮流测量，机器负载的波动对各方的影响相近
+        rates = {name: [] for name in apps}
+        for _ in range(args.repeat):
+            for name, app in apps.items():
+                rates[name].append(asyncio.run(_measure(app, token, args.requests, args.concurrency)))
+        results = {}
+        for name, values in rates.items():
+            results[name] = max(values)
+            print(f"{name}: 最高 {results[name]:.0f} 请求/秒, 最低 {min(values):.0f} 请求/秒")
+        print(f"纯 ASGI 中间件栈相对原中间件栈: {results['纯 ASGI 中间件栈'] / results['原中间件栈']:.2f}x")
+        print(
+            f"请求耗时记录的开销: "
+            f"{(1 - results['纯 ASGI 中间件栈 + 请求耗时记录'] / results['纯 ASGI 中间件栈']) * 100:.1f}%"
+        )
+        pool.close_all()
+
+
+if __name__ == "__main__":
+    main()
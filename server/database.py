@@ -3,21 +3,179 @@
 支持 SQLite 多连接并发访问，确保数据一致性和高可用性
 """
 
+import re
 import sqlite3
 import threading
 import time
 import logging
 from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
 from queue import Queue, Empty
-from typing import Optional, Callable, Any
+from typing import Optional, Callable, Any, Dict, Iterable, Set, Tuple
 from pathlib import Path
 import os
 import sys
 
+from server.slow_query_log import get_slow_query_log
+from server.tracing import current_trace, record_span
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 当前数据库结构版本（PRAGMA user_version）
+DB_VERSION = 19
+
+# 写语句（INSERT/REPLACE/UPDATE/DELETE）及其目标表
+_WRITE_STATEMENT_PATTERN = re.compile(
+    r"^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+"
+    r"(?:[\"`\[]?(\w+)[\"`\]]?\.)?[\"`\[]?(\w+)",
+    re.IGNORECASE
+)
+
+
+@lru_cache(maxsize=1024)
+def _written_table(sql: str) -> Optional[str]:
+    """写语句的目标表名（只识别主库中的表，不是写语句时返回 None）"""
+    match = _WRITE_STATEMENT_PATTERN.match(sql)
+    if not match:
+        return None
+    schema, table = match.groups()
+    if schema and schema.lower() != "main":
+        return None
+    return table.lower()
+
+
+# 只读快照中使用的连接（见 SQLiteConnectionPool.read_snapshot）
+_snapshot_connection: ContextVar[Optional[sqlite3.Connection]] = ContextVar("snapshot_connection", default=None)
+
+
+def in_read_snapshot() -> bool:
+    """当前上下文是否处于只读快照中（见 SQLiteConnectionPool.read_snapshot）"""
+    return _snapshot_connection.get() is not None
+
+
+class TrackedCursor(sqlite3.Cursor):
+    """
+    累计语句耗时和行数的游标（见 server.slow_query_log）
+
+    查询的耗时为执行和读取结果的耗时之和：读取完（fetchall、fetchone/fetchmany 取尽）、
+    关闭或被释放时交给慢查询日志；写语句在执行后立即交给慢查询日志，行数为影响的行数
+    """
+
+    __slots__ = ("_sql", "_parameters", "_elapsed", "_rows", "_pending")
+
+    def _begin(self, sql, parameters, elapsed: float):
+        if self.description is None:
+            get_slow_query_log().observe(sql, parameters, elapsed, self.rowcount if self.rowcount >= 0 else None)
+            self._pending = False
+            return
+        self._sql = sql
+        self._parameters = parameters
+        self._elapsed = elapsed
+        self._rows = 0
+        self._pending = True
+
+    def _finish(self):
+        if getattr(self, "_pending", False):
+            self._pending = False
+            get_slow_query_log().observe(self._sql, self._parameters, self._elapsed, self._rows)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        if getattr(self, "_pending", False):
+            self._elapsed += time.perf_counter() - start
+            self._rows += len(rows)
+            self._finish()
+        return rows
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        if getattr(self, "_pending", False):
+            self._elapsed += time.perf_counter() - start
+            self._rows += len(rows)
+            if not rows:
+                self._finish()
+        return rows
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        if getattr(self, "_pending", False):
+            self._elapsed += time.perf_counter() - start
+            if row is None:
+                self._finish()
+            else:
+                self._rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+
+class TrackingConnection(sqlite3.Connection):
+    """
+    记录写入过哪些表的连接
+
+    连接归还到连接池时，连接池据此递增这些表的数据版本号（见 SQLiteConnectionPool.get_data_versions）；
+    在请求中执行的语句同时计入请求耗时（见 server.tracing）；
+    启用慢查询日志时每条语句都计时，超过阈值的记录到慢查询日志（见 server.slow_query_log）
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.written_tables: Set[str] = set()
+
+    def execute(self, sql, parameters=(), /):
+        table = _written_table(sql)
+        if table:
+            self.written_tables.add(table)
+        trace = current_trace()
+        slow_log_enabled = get_slow_query_log().enabled
+        if trace is None and not slow_log_enabled:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            if slow_log_enabled:
+                cursor = self.cursor(TrackedCursor)
+                cursor.execute(sql, parameters)
+            else:
+                cursor = super().execute(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - start
+            if trace is not None:
+                trace.add_statement(sql, elapsed)
+        if slow_log_enabled:
+            cursor._begin(sql, parameters, elapsed)
+        return cursor
+
+    def executemany(self, sql, parameters, /):
+        table = _written_table(sql)
+        if table:
+            self.written_tables.add(table)
+        trace = current_trace()
+        slow_log = get_slow_query_log()
+        if trace is None and not slow_log.enabled:
+            return super().executemany(sql, parameters)
+        start = time.perf_counter()
+        try:
+            cursor = super().executemany(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - start
+            if trace is not None:
+                trace.add_statement(sql, elapsed)
+        if slow_log.enabled:
+            # 参数可能是已被取尽的生成器，只记录语句和影响的行数（不获取查询计划）
+            slow_log.observe(sql, None, elapsed, cursor.rowcount if cursor.rowcount >= 0 else None)
+        return cursor
+
 
 class SQLiteConnectionPool:
     """
@@ -64,9 +222,17 @@ class SQLiteConnectionPool:
             'active_connections': 0,
             'pool_size': 0,
             'retry_count': 0,
-            'busy_errors': 0
+            'busy_errors': 0,
+            'acquire_count': 0,
+            'acquire_timeouts': 0,
+            'acquire_wait_seconds': 0.0,
+            'acquire_wait_max_seconds': 0.0
         }
         
+        # 各表的数据版本号（表被写入并提交后递增），以及外键级联关系
+        self._data_versions: Dict[str, int] = {}
+        self._dependent_tables: Dict[str, Set[str]] = {}
+        
         # 确保数据库目录存在
         db_dir = os.path.dirname(db_path)
         if db_dir and not os.path.exists(db_dir):
@@ -99,7 +265,8 @@ class SQLiteConnectionPool:
             conn = sqlite3.connect(
                 self.db_path,
                 timeout=self.busy_timeout / 1000.0,  # 转换为秒
-                check_same_thread=False  # 允许多线程使用
+                check_same_thread=False,  # 允许多线程使用
+                factory=TrackingConnection  # 记录写入的表，用于数据版本号
             )
             
             # 配置连接
@@ -128,13 +295,15 @@ class SQLiteConnectionPool:
                     # 首次创建数据库
                     logger.info("首次创建数据库，执行初始化脚本...")
                     self._create_tables(conn)
-                    self._set_version(conn, 17)
+                    self._set_version(conn, DB_VERSION)
                 else:
                     # 升级数据库
                     logger.info(f"数据库版本: {version}, 检查是否需要升级...")
-                    self._upgrade_database(conn, version, 17)
+                    self._upgrade_database(conn, version, DB_VERSION)
                     # 无论版本如何，都检查并修复 user_settings 表的列（兼容性修复）
                     self._ensure_user_settings_columns(conn)
+                
+                self._load_table_dependencies(conn)
         except Exception as e:
             logger.error(f"数据库初始化失败: {e}")
             raise
@@ -353,6 +522,9 @@ class SQLiteConnectionPool:
             )
         ''')
         
+        # 操作日志变更字段表（按变更字段筛选 UPDATE 日志）
+        self._create_log_fields_table(conn)
+        
         # 创建索引以提高查询性能
         conn.execute('CREATE INDEX IF NOT EXISTS idx_products_userId ON products(userId)')
         conn.execute('CREATE INDEX IF NOT EXISTS idx_purchases_userId ON purchases(userId)')
@@ -361,12 +533,25 @@ class SQLiteConnectionPool:
         conn.execute('CREATE INDEX IF NOT EXISTS idx_income_userId ON income(userId)')
         conn.execute('CREATE INDEX IF NOT EXISTS idx_remittance_userId ON remittance(userId)')
         conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_userId_time ON operation_logs(userId, operation_time DESC)')
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_entity ON operation_logs(entity_type, entity_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_user_entity_time ON operation_logs(userId, entity_type, entity_id, operation_time DESC)')
         conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_type ON operation_logs(operation_type)')
         
         conn.commit()
         logger.info("数据库表创建完成")
     
+    def _create_log_fields_table(self, conn: sqlite3.Connection):
+        """创建操作日志变更字段表（每条 UPDATE 日志的每个变更字段一行）"""
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS operation_log_fields (
+                log_id INTEGER NOT NULL,
+                userId INTEGER NOT NULL,
+                field TEXT NOT NULL,
+                PRIMARY KEY (log_id, field),
+                FOREIGN KEY (log_id) REFERENCES operation_logs (id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_log_fields_user_field ON operation_log_fields(userId, field, log_id)')
+    
     def _set_version(self, conn: sqlite3.Connection, version: int):
         """设置数据库版本"""
         conn.execute(f"PRAGMA user_version = {version}")
@@ -635,6 +820,37 @@ class SQLiteConnectionPool:
                 logger.error(f"升级 online_users 表失败: {e}", exc_info=True)
                 raise
         
+        # 版本 18: 操作日志改为紧凑存储（UPDATE 只保存变更字段，较大内容压缩）
+        if old_version < 18:
+            logger.info("升级到版本 18: 转换操作日志为紧凑存储格式")
+            try:
+                from server.services.audit_log_service import compact_existing_logs
+                stats = compact_existing_logs(conn)
+                logger.info(
+                    f"已转换 {stats['updated']}/{stats['rows']} 条操作日志，"
+                    f"内容大小 {stats['bytes_before']} -> {stats['bytes_after']} 字节"
+                    "（执行 VACUUM 后释放磁盘空间）"
+                )
+            except Exception as e:
+                logger.error(f"升级到版本 18 失败: {e}", exc_info=True)
+                raise
+        
+        # 版本 19: 操作日志按实体查询的复合索引，以及变更字段表
+        if old_version < 19:
+            logger.info("升级到版本 19: 添加操作日志复合索引和变更字段表")
+            try:
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_user_entity_time ON operation_logs(userId, entity_type, entity_id, operation_time DESC)')
+                # 被 (userId, entity_type, entity_id, operation_time) 索引取代
+                conn.execute('DROP INDEX IF EXISTS idx_logs_entity')
+                self._create_log_fields_table(conn)
+                
+                from server.services.audit_log_service import rebuild_log_fields
+                field_count = rebuild_log_fields(conn)
+                logger.info(f"已为已有的 UPDATE 日志写入 {field_count} 条变更字段记录")
+            except Exception as e:
+                logger.error(f"升级到版本 19 失败: {e}", exc_info=True)
+                raise
+        
         # 创建索引
         conn.execute('CREATE INDEX IF NOT EXISTS idx_products_userId ON products(userId)')
         conn.execute('CREATE INDEX IF NOT EXISTS idx_purchases_userId ON purchases(userId)')
@@ -663,7 +879,7 @@ class SQLiteConnectionPool:
             cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='operation_logs'")
             if cursor.fetchone():
                 conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_userId_time ON operation_logs(userId, operation_time DESC)')
-                conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_entity ON operation_logs(entity_type, entity_id)')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_user_entity_time ON operation_logs(userId, entity_type, entity_id, operation_time DESC)')
                 conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_type ON operation_logs(operation_type)')
         except Exception as e:
             logger.debug(f"创建操作日志索引时出错（可能表不存在）: {e}")
@@ -682,10 +898,19 @@ class SQLiteConnectionPool:
             with pool.get_connection() as conn:
                 cursor = conn.execute("SELECT * FROM users")
                 results = cursor.fetchall()
+        
+        处于只读快照中（read_snapshot）时返回快照的连接，不提交也不归还
         """
+        snapshot = _snapshot_connection.get()
+        if snapshot is not None:
+            yield snapshot
+            return
+        
         conn = None
         try:
+            acquire_start = time.perf_counter()
             conn = self._acquire_connection()
+            record_span("db-acquire", time.perf_counter() - acquire_start)
             yield conn
             conn.commit()  # 自动提交事务
         except sqlite3.OperationalError as e:
@@ -707,8 +932,94 @@ class SQLiteConnectionPool:
             raise
         finally:
             if conn:
+                # 提交（或回滚）之后再递增版本号：在此之前读到旧数据的缓存都使用旧版本号
+                if conn.written_tables:
+                    self._bump_data_versions(conn.written_tables)
+                    conn.written_tables.clear()
                 self._release_connection(conn)
     
+    @contextmanager
+    def read_snapshot(self):
+        """
+        只读快照的上下文管理器
+        
+        块内（包括在线程池中执行的同步函数，上下文变量会随之传递）通过本连接池获取的连接
+        都是同一个连接，处在同一个读事务中，看到的是同一时刻的数据；WAL 模式下不阻塞写入。
+        块内不能写入（PRAGMA query_only），不能提交或回滚（会结束读事务，之后读到的不再是同一快照），
+        也不能并发使用连接
+        
+        Usage:
+            with pool.read_snapshot():
+                ...  # 多次 pool.get_connection() 读取的数据一致
+        """
+        with self.get_connection() as conn:
+            conn.execute("PRAGMA query_only = ON")
+            conn.execute("BEGIN")
+            try:
+                # 读取一次以立即开始读事务，固定快照
+                conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone()
+                token = _snapshot_connection.set(conn)
+                try:
+                    yield conn
+                finally:
+                    _snapshot_connection.reset(token)
+            finally:
+                conn.rollback()
+                conn.execute("PRAGMA query_only = OFF")
+    
+    def get_data_versions(self, tables: Iterable[str]) -> Tuple[int, ...]:
+        """
+        获取表的数据版本号（用于响应缓存的键）
+        
+        通过本连接池的连接写入某表并归还连接后，该表（以及通过外键级联受影响的表）的版本号递增。
+        只反映本进程内的写入
+        
+        Args:
+            tables: 表名
+        
+        Returns:
+            各表的版本号
+        """
+        versions = self._data_versions
+        return tuple(versions.get(table, 0) for table in tables)
+    
+    def _bump_data_versions(self, tables: Set[str]):
+        affected = set(tables)
+        for table in tables:
+            affected.update(self._dependent_tables.get(table, ()))
+        with self._lock:
+            for table in affected:
+                self._data_versions[table] = self._data_versions.get(table, 0) + 1
+    
+    def _load_table_dependencies(self, conn: sqlite3.Connection):
+        """
+        根据外键的 ON DELETE/ON UPDATE 动作计算级联关系：
+        写入父表可能修改的子表（CASCADE/SET NULL/SET DEFAULT），包含间接级联
+        """
+        direct: Dict[str, Set[str]] = {}
+        tables = [
+            row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+            )
+        ]
+        for table in tables:
+            for row in conn.execute(f"PRAGMA foreign_key_list({table})"):
+                parent, on_update, on_delete = row[2], row[5], row[6]
+                if on_update not in ("NO ACTION", "RESTRICT") or on_delete not in ("NO ACTION", "RESTRICT"):
+                    direct.setdefault(parent.lower(), set()).add(table.lower())
+        
+        dependents: Dict[str, Set[str]] = {}
+        for parent in direct:
+            seen: Set[str] = set()
+            stack = list(direct[parent])
+            while stack:
+                child = stack.pop()
+                if child not in seen:
+                    seen.add(child)
+                    stack.extend(direct.get(child, ()))
+            dependents[parent] = seen
+        self._dependent_tables = dependents
+    
     def _acquire_connection(self) -> sqlite3.Connection:
         """
         从连接池获取连接
@@ -716,7 +1027,7 @@ class SQLiteConnectionPool:
         Returns:
             SQLite 连接对象
         """
-        start_time = time.time()
+        start_time = time.perf_counter()
         
         while True:
             # 尝试从池中获取连接
@@ -726,6 +1037,7 @@ class SQLiteConnectionPool:
                     self._active_connections += 1
                     self._stats['active_connections'] = self._active_connections
                     self._stats['pool_size'] = self._pool.qsize()
+                    self._record_acquire(start_time)
                 return conn
             except Empty:
                 # 池中没有可用连接
@@ -737,11 +1049,14 @@ class SQLiteConnectionPool:
                             self._active_connections += 1
                             self._stats['total_connections'] += 1
                             self._stats['active_connections'] = self._active_connections
+                            self._record_acquire(start_time)
                             return conn
                 
                 # 检查超时
-                elapsed = time.time() - start_time
+                elapsed = time.perf_counter() - start_time
                 if elapsed >= self.timeout:
+                    with self._lock:
+                        self._stats['acquire_timeouts'] += 1
                     raise ConnectionTimeoutError(
                         f"获取数据库连接超时 ({self.timeout}秒)，当前活跃连接: {self._active_connections}/{self.max_connections}"
                     )
@@ -749,6 +1064,14 @@ class SQLiteConnectionPool:
                 # 等待一小段时间后重试
                 time.sleep(0.05)
     
+    def _record_acquire(self, start_time: float):
+        """记录一次获取连接的等待时间（调用方需持有 self._lock）"""
+        wait = time.perf_counter() - start_time
+        self._stats['acquire_count'] += 1
+        self._stats['acquire_wait_seconds'] += wait
+        if wait > self._stats['acquire_wait_max_seconds']:
+            self._stats['acquire_wait_max_seconds'] = wait
+    
     def _release_connection(self, conn: sqlite3.Connection):
         """将连接归还到连接池"""
         try:
@@ -0,0 +1,296 @@
+"""
+日志配置
+所有日志经 QueueHandler 放入内存队列，由后台线程（QueueListener）格式化并写出，
+事件循环中记录日志只是一次入队，不会因写终端或文件而阻塞；队列满时丢弃并计数
+
+每条日志带有所在请求的请求ID（X-Request-ID，见 server.middleware.LoggingMiddleware），
+默认以 JSON 行输出（LOG_FORMAT=text 时为原来的文本格式）
+
+心跳、在线设备等高频接口按路由采样：未被采样的请求中 WARNING 以下的日志
+（请求/响应日志、uvicorn 访问日志、接口自身的日志）全部省略，并且每分钟最多记录若干个请求
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional, Tuple
+
+# 日志队列容量（条）
+LOG_QUEUE_SIZE = 10000
+
+# 默认的路由采样规则：路径前缀 -> (采样率, 每分钟最多记录的请求数)
+DEFAULT_SAMPLE_RULES = "/api/users/heartbeat=0.01:10,/api/users/online=0.05:30"
+
+# 与日志一起转交给后台线程的 uvicorn 日志器（默认直接写终端）
+_UVICORN_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+_TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+class RequestLogContext:
+    """当前请求的日志上下文"""
+
+    __slots__ = ("request_id", "sampled")
+
+    def __init__(self, request_id: str, sampled: bool):
+        self.request_id = request_id
+        self.sampled = sampled
+
+
+_request_context: ContextVar[Optional[RequestLogContext]] = ContextVar("request_log_context", default=None)
+
+
+def bind_request(request_id: str, sampled: bool = True):
+    """
+    设置当前请求的日志上下文
+
+    Returns:
+        用于 reset_request 的令牌
+    """
+    return _request_context.set(RequestLogContext(request_id, sampled))
+
+
+def reset_request(token):
+    """恢复设置之前的日志上下文"""
+    _request_context.reset(token)
+
+
+def current_request_id() -> Optional[str]:
+    """当前请求的请求ID（不在请求中时为 None）"""
+    context = _request_context.get()
+    return context.request_id if context is not None else None
+
+
+def new_request_id() -> str:
+    """生成请求ID（16 位十六进制）"""
+    return os.urandom(8).hex()
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    为日志加上请求ID，并省略未被采样的请求中 WARNING 以下的日志
+
+    在记录日志的线程中执行（入队之前），所以能读到请求的上下文变量
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _request_context.get()
+        if context is None:
+            record.request_id = None
+            return True
+        record.request_id = context.request_id
+        return context.sampled or record.levelno >= logging.WARNING
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    JSON 行格式
+
+    {"time", "level", "logger", "message", "request_id", "exc"}，
+    extra={"fields": {...}} 传入的字段合并到顶层
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            data["request_id"] = request_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            data.update(fields)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        if record.stack_info:
+            data["stack"] = record.stack_info
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """
+    入队不阻塞的 QueueHandler（队列满时丢弃并计数）
+
+    入队前只合并消息参数、把异常转换为文本（后台线程中异常对象可能已失效），
+    格式化留给后台线程
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._exception_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogSampler:
+    """
+    按路由采样请求日志
+
+    规则按路径前缀匹配：先按采样率抽样，再限制每分钟最多记录的请求数；
+    每分钟结束后记录一条被省略的请求数（有省略时）
+    """
+
+    def __init__(self, rules: Dict[str, Tuple[float, int]]):
+        """
+        Args:
+            rules: 路径前缀 -> (采样率, 每分钟最多记录的请求数，0 表示不限)
+        """
+        # 前缀长的规则优先
+        self._rules: List[Tuple[str, float, int]] = sorted(
+            ((prefix, rate, cap) for prefix, (rate, cap) in rules.items()),
+            key=lambda rule: len(rule[0]),
+            reverse=True
+        )
+        self._windows: Dict[str, list] = {prefix: [0.0, 0, 0] for prefix, _, _ in self._rules}  # 窗口开始、已记录、已省略
+        self._totals: Dict[str, list] = {prefix: [0, 0] for prefix, _, _ in self._rules}  # 累计记录、累计省略
+        self._lock = threading.Lock()
+
+    def should_log(self, path: str) -> bool:
+        """是否记录该请求的日志（没有匹配的规则时总是记录）"""
+        for prefix, rate, cap in self._rules:
+            if path.startswith(prefix):
+                break
+        else:
+            return True
+
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows[prefix]
+            if now - window[0] >= 60:
+                if window[2]:
+                    logging.getLogger(__name__).info(f"请求日志采样: {prefix} 在过去一分钟内省略了 {window[2]} 个请求的日志")
+                window[:] = [now, 0, 0]
+            logged = random.random() < rate and (not cap or window[1] < cap)
+            window[1 if logged else 2] += 1
+            self._totals[prefix][0 if logged else 1] += 1
+        return logged
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                prefix: {"rate": rate, "per_minute": cap, "logged": self._totals[prefix][0], "dropped": self._totals[prefix][1]}
+                for prefix, rate, cap in self._rules
+            }
+
+
+def parse_sample_rules(text: str) -> Dict[str, Tuple[float, int]]:
+    """
+    解析采样规则：逗号分隔的 路径前缀=采样率:每分钟上限（如 /api/users/heartbeat=0.01:10）
+
+    Raises:
+        ValueError: 格式无效
+    """
+    rules = {}
+    for item in text.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            prefix, spec = item.split("=", 1)
+            rate, _, cap = spec.partition(":")
+            rules[prefix.strip()] = (float(rate), int(cap) if cap else 0)
+        except ValueError:
+            raise ValueError(f"无效的日志采样规则: {item}（格式：路径前缀=采样率:每分钟上限）")
+    return rules
+
+
+# 全局实例
+_sampler = LogSampler(parse_sample_rules(DEFAULT_SAMPLE_RULES))
+_queue_handler: Optional[_NonBlockingQueueHandler] = None
+_listener: Optional[QueueListener] = None
+
+
+def get_log_sampler() -> LogSampler:
+    """获取全局请求日志采样器"""
+    return _sampler
+
+
+def setup_logging(
+    level: int = logging.INFO,
+    json_format: bool = True,
+    sample_rules: Optional[str] = None,
+    queue_size: int = LOG_QUEUE_SIZE
+):
+    """
+    配置根日志器（重复调用时只更新采样规则）
+
+    Args:
+        level: 日志级别
+        json_format: 是否以 JSON 行输出
+        sample_rules: 路由采样规则（见 parse_sample_rules，None 时使用默认规则）
+        queue_size: 日志队列容量
+    """
+    global _sampler, _queue_handler, _listener
+    if sample_rules is not None:
+        _sampler = LogSampler(parse_sample_rules(sample_rules))
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JSONFormatter() if json_format else logging.Formatter(_TEXT_FORMAT))
+
+    _queue_handler = _NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+    _queue_handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+
+    # uvicorn 的日志器不向上传递，单独转交给队列
+    for name in _UVICORN_LOGGERS:
+        uvicorn_logger = logging.getLogger(name)
+        if uvicorn_logger.propagate:
+            continue
+        for handler in list(uvicorn_logger.handlers):
+            uvicorn_logger.removeHandler(handler)
+        uvicorn_logger.addHandler(_queue_handler)
+
+    _listener = QueueListener(_queue_handler.queue, output)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """停止后台线程（写出队列中剩余的日志）"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logging_stats() -> dict:
+    """获取日志队列与采样统计"""
+    return {
+        "queued": _queue_handler.queue.qsize() if _queue_handler else 0,
+        "dropped": _queue_handler.dropped if _queue_handler else 0,
+        "sampling": _sampler.get_stats(),
+    }
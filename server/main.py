@@ -7,14 +7,17 @@ import logging
 import os
 import asyncio
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
-from fastapi.responses import JSONResponse
-from fastapi.middleware.gzip import GZipMiddleware
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 from server.database import init_database, get_pool
 from server.constants import APP_VERSION
-from server.middleware import setup_middleware
+from server.middleware import setup_middleware, require_admin_token, update_admin_token
+from server.services.metrics_service import MetricsMiddleware, render_metrics
+from server.logging_config import setup_logging, get_logging_stats, DEFAULT_SAMPLE_RULES
+from server.services.rate_limit_service import get_rate_limiter, shutdown_rate_limiter
+from server.slow_query_log import init_slow_query_log, get_slow_query_log
+from server.tracing import ServerTimingMiddleware, TimedGZipMiddleware, init_trace_buffer, get_trace_buffer
 from server.routers import (
     auth,
     users,
@@ -29,13 +32,18 @@ from server.routers import (
     remittance,
     settings,
     help,
-    audit_logs
+    audit_logs,
+    export,
+    backups,
+    batch
 )
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# 配置日志（经队列由后台线程写出，默认 JSON 行格式；LOG_FORMAT=text 为文本格式）
+# LOG_SAMPLE_RULES：高频接口的请求日志采样规则，逗号分隔的 路径前缀=采样率:每分钟上限
+setup_logging(
+    level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO),
+    json_format=os.getenv("LOG_FORMAT", "json").lower() != "text",
+    sample_rules=os.getenv("LOG_SAMPLE_RULES", DEFAULT_SAMPLE_RULES)
 )
 logger = logging.getLogger(__name__)
 
@@ -47,8 +55,51 @@ DB_PATH = os.getenv("DB_PATH", "data/agrisalecl.db")
 DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "10"))
 DB_BUSY_TIMEOUT = int(os.getenv("DB_BUSY_TIMEOUT", "5000"))
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-this-in-production")
+# 运维接口（/stats、/metrics）的管理令牌，未设置时这些接口不可访问
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", "8000"))
+# 在线状态快照到 SQLite 的间隔（秒），0 表示不写快照（在线状态仅保存在内存中）
+PRESENCE_SNAPSHOT_INTERVAL = int(os.getenv("PRESENCE_SNAPSHOT_INTERVAL", "0"))
+# 备份目录（为空时使用数据库所在目录下的 backups 目录）
+BACKUP_DIR = os.getenv("BACKUP_DIR", "")
+# 整库快照间隔（秒），0 表示不自动备份
+BACKUP_INTERVAL = int(os.getenv("BACKUP_INTERVAL", "0"))
+# 保留的整库快照数量
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+# 每个用户保留的服务器端备份数量
+USER_BACKUP_KEEP = int(os.getenv("USER_BACKUP_KEEP", "5"))
+# 是否 gzip 压缩整库快照
+BACKUP_COMPRESS = os.getenv("BACKUP_COMPRESS", "true").lower() in ("1", "true", "yes")
+# 操作日志是否由后台线程批量写入
+AUDIT_ASYNC = os.getenv("AUDIT_ASYNC", "true").lower() in ("1", "true", "yes")
+# 操作日志队列上限与队列已满时的策略（sync/drop_oldest/drop_newest）
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_OVERFLOW_POLICY = os.getenv("AUDIT_OVERFLOW_POLICY", "sync")
+# 操作日志归档库路径（为空时过期日志直接删除）
+AUDIT_ARCHIVE_PATH = os.getenv("AUDIT_ARCHIVE_PATH", "")
+# 操作日志保留天数，0 表示不自动清理；自动清理间隔（秒）
+AUDIT_RETENTION_DAYS = int(os.getenv("AUDIT_RETENTION_DAYS", "0"))
+AUDIT_RETENTION_INTERVAL = int(os.getenv("AUDIT_RETENTION_INTERVAL", "86400"))
+# 列表接口响应缓存的最大条目数与内存上限（MB），0 表示关闭缓存（多工作进程运行时应关闭）
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+RESPONSE_CACHE_MAX_MB = int(os.getenv("RESPONSE_CACHE_MAX_MB", "64"))
+# 是否返回 Server-Timing 响应头（认证、获取连接、SQL、序列化、操作日志、压缩各阶段耗时）
+SERVER_TIMING = os.getenv("SERVER_TIMING", "true").lower() in ("1", "true", "yes")
+# 保存完整耗时记录（含每条 SQL）的请求比例与保存条数，见 /stats/traces
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+# 慢查询阈值（毫秒，0 表示关闭），超过阈值的语句连同查询计划记录到日志，汇总见 /stats/slow-queries
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+# 速率限制（令牌桶，每个用户、每个 IP 各一个桶；大分页、导出、导入等重请求扣除更多令牌）
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "false").lower() in ("1", "true", "yes")
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "300"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "100"))
+RATE_LIMIT_IP_PER_MINUTE = float(os.getenv("RATE_LIMIT_IP_PER_MINUTE", "600"))
+RATE_LIMIT_IP_BURST = int(os.getenv("RATE_LIMIT_IP_BURST", "200"))
+# 速率限制后端：memory（单工作进程）或 sqlite（多个工作进程共享，默认文件为数据库目录下的 rate_limit.db）
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB_PATH", "")
 
 
 @asynccontextmanager
@@ -69,6 +120,7 @@ async def lifespan(app: FastAPI):
         )
         logger.info(f"数据库连接池初始化成功: {DB_PATH}")
         logger.info(f"最大连接数: {DB_MAX_CONNECTIONS}, 繁忙超时: {DB_BUSY_TIMEOUT}ms")
+        init_slow_query_log(db_path=pool.db_path, threshold_ms=SLOW_QUERY_MS)
     except Exception as e:
         logger.error(f"数据库初始化失败: {e}", exc_info=True)
         raise
@@ -81,21 +133,86 @@ async def lifespan(app: FastAPI):
     else:
         logger.warning("⚠️  警告: 使用默认 JWT 密钥，生产环境请设置 SECRET_KEY 环境变量")
     
-    # 启动后台任务：定期清理过期的在线用户
+    update_admin_token(ADMIN_TOKEN)
+    if not ADMIN_TOKEN:
+        logger.info("未设置 ADMIN_TOKEN，运维接口（/stats、/metrics）不可访问")
+    
+    # 启动操作日志后台写入
+    if AUDIT_ASYNC:
+        from server.services.audit_log_service import start_audit_writer
+        start_audit_writer(max_size=AUDIT_QUEUE_SIZE, overflow_policy=AUDIT_OVERFLOW_POLICY)
+    
+    # 初始化响应缓存
+    from server.services.response_cache_service import init_response_cache
+    init_response_cache(
+        max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+        max_bytes=RESPONSE_CACHE_MAX_MB * 1024 * 1024
+    )
+    
+    # 初始化速率限制器
+    if RATE_LIMIT_ENABLED:
+        from server.services.rate_limit_service import init_rate_limiter
+        init_rate_limiter(
+            backend=RATE_LIMIT_BACKEND,
+            db_path=RATE_LIMIT_DB_PATH or os.path.join(os.path.dirname(pool.db_path), "rate_limit.db"),
+            per_minute=RATE_LIMIT_PER_MINUTE,
+            burst=RATE_LIMIT_BURST,
+            ip_per_minute=RATE_LIMIT_IP_PER_MINUTE,
+            ip_burst=RATE_LIMIT_IP_BURST
+        )
+    
+    # 初始化请求耗时采样缓冲区
+    init_trace_buffer(sample_rate=TRACE_SAMPLE_RATE, size=TRACE_BUFFER_SIZE)
+    
+    # 初始化操作日志保留任务
+    from server.services.audit_log_service import init_audit_retention
+    audit_retention = init_audit_retention(archive_path=AUDIT_ARCHIVE_PATH)
+    
+    # 初始化备份管理器
+    from server.services.backup_service import init_backup_manager
+    backup_manager = init_backup_manager(
+        db_path=pool.db_path,
+        backup_dir=BACKUP_DIR or os.path.join(os.path.dirname(pool.db_path), "backups"),
+        keep_count=BACKUP_KEEP,
+        user_keep_count=USER_BACKUP_KEEP,
+        compress=BACKUP_COMPRESS
+    )
+    
+    # 恢复服务重启前的在线状态（仅加载未超时的记录）
+    from server.services.presence_service import get_presence_store
+    presence_store = get_presence_store()
+    try:
+        with pool.get_connection() as conn:
+            restored_count = presence_store.load(conn)
+            if restored_count > 0:
+                logger.info(f"已从快照恢复 {restored_count} 条在线记录")
+    except Exception as e:
+        logger.warning(f"恢复在线状态快照失败: {e}")
+    
+    # 启动后台任务：定期清理过期的在线用户（纯内存操作）和空闲的限流键，按需写入快照
     async def cleanup_task():
-        """后台任务：定期清理过期的在线用户"""
-        from server.routers.users import _cleanup_expired_users
+        """后台任务：定期清理过期的在线用户和空闲的限流键"""
         cleanup_interval = 15  # 每15秒清理一次
+        last_snapshot = asyncio.get_running_loop().time()
         
         while True:
             try:
                 await asyncio.sleep(cleanup_interval)
-                pool = get_pool()
-                if pool:
-                    with pool.get_connection() as conn:
-                        deleted_count = _cleanup_expired_users(conn)
-                        if deleted_count > 0:
-                            logger.debug(f"后台清理过期在线用户: 删除了 {deleted_count} 条记录")
+                deleted_count = presence_store.expire()
+                if deleted_count > 0:
+                    logger.debug(f"后台清理过期在线用户: 删除了 {deleted_count} 条记录")
+                
+                rate_limiter = get_rate_limiter()
+                if rate_limiter is not None:
+                    evicted = rate_limiter.evict_idle()
+                    if evicted > 0:
+                        logger.debug(f"后台清理空闲限流键: 删除了 {evicted} 个")
+                
+                now = asyncio.get_running_loop().time()
+                if PRESENCE_SNAPSHOT_INTERVAL > 0 and now - last_snapshot >= PRESENCE_SNAPSHOT_INTERVAL:
+                    last_snapshot = now
+                    with get_pool().get_connection() as conn:
+                        presence_store.snapshot(conn)
             except Exception as e:
                 logger.error(f"后台清理任务出错: {e}", exc_info=True)
                 # 出错后等待更长时间再重试
@@ -105,6 +222,23 @@ async def lifespan(app: FastAPI):
     cleanup_task_handle = asyncio.create_task(cleanup_task())
     logger.info("后台清理任务已启动（每15秒清理一次过期在线用户）")
     
+    # 启动定时整库备份
+    backup_task_handle = None
+    if BACKUP_INTERVAL > 0:
+        backup_task_handle = asyncio.create_task(backup_manager.run_scheduler(BACKUP_INTERVAL))
+        logger.info(f"定时备份已启动（每 {BACKUP_INTERVAL} 秒一次，保留 {BACKUP_KEEP} 份）: {backup_manager.backup_dir}")
+    
+    # 启动定时操作日志清理
+    retention_task_handle = None
+    if AUDIT_RETENTION_DAYS > 0:
+        retention_task_handle = asyncio.create_task(
+            audit_retention.run_scheduler(AUDIT_RETENTION_DAYS, AUDIT_RETENTION_INTERVAL)
+        )
+        logger.info(
+            f"定时日志清理已启动（每 {AUDIT_RETENTION_INTERVAL} 秒一次，保留 {AUDIT_RETENTION_DAYS} 天）"
+            + (f"，归档到: {AUDIT_ARCHIVE_PATH}" if AUDIT_ARCHIVE_PATH else "")
+        )
+    
     yield
     
     # 停止后台任务
@@ -114,8 +248,40 @@ async def lifespan(app: FastAPI):
     except asyncio.CancelledError:
         logger.info("后台清理任务已停止")
     
+    if backup_task_handle is not None:
+        backup_task_handle.cancel()
+        try:
+            await backup_task_handle
+        except asyncio.CancelledError:
+            logger.info("定时备份任务已停止")
+    
+    if retention_task_handle is not None:
+        retention_task_handle.cancel()
+        try:
+            await retention_task_handle
+        except asyncio.CancelledError:
+            logger.info("定时日志清理任务已停止")
+    
+    # 关闭前写入最后一次在线状态快照
+    if PRESENCE_SNAPSHOT_INTERVAL > 0:
+        try:
+            with get_pool().get_connection() as conn:
+                presence_store.snapshot(conn, force=True)
+        except Exception as e:
+            logger.error(f"写入在线状态快照失败: {e}")
+    
     # 关闭时执行
     logger.info("正在关闭应用...")
+    
+    # 写入队列中剩余的操作日志（必须在关闭连接池之前）
+    from server.services.audit_log_service import stop_audit_writer
+    stop_audit_writer()
+    
+    from server.middleware import shutdown_password_executor
+    shutdown_password_executor()
+    
+    shutdown_rate_limiter()
+    
     try:
         pool = get_pool()
         if pool:
@@ -123,6 +289,7 @@ async def lifespan(app: FastAPI):
             logger.info("数据库连接池已关闭")
     except Exception as e:
         logger.error(f"关闭数据库连接池时出错: {e}")
+    get_slow_query_log().close()
 
 
 # 创建 FastAPI 应用实例
@@ -136,19 +303,16 @@ app = FastAPI(
 )
 
 # 设置中间件
-setup_middleware(app)
+setup_middleware(app, rate_limit=RATE_LIMIT_ENABLED)
 
 # 添加响应压缩中间件（提高 Cloudflare Tunnel 传输效率）
-app.add_middleware(GZipMiddleware, minimum_size=1000)  # 只压缩大于 1KB 的响应
-
-# 添加 CORS 中间件（如果需要）
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # 生产环境应该限制具体域名
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+app.add_middleware(TimedGZipMiddleware, minimum_size=1000)  # 只压缩大于 1KB 的响应
+
+# 添加请求耗时中间件（Server-Timing 响应头；放在压缩中间件外层，压缩耗时才能计入）
+app.add_middleware(ServerTimingMiddleware, enabled=SERVER_TIMING)
+
+# 添加指标中间件（放在最外层：耗时包含其他中间件，响应大小为压缩后的字节数）
+app.add_middleware(MetricsMiddleware)
 
 # 注册路由
 app.include_router(auth.router)
@@ -165,6 +329,9 @@ app.include_router(remittance.router)
 app.include_router(settings.router)
 app.include_router(help.router)
 app.include_router(audit_logs.router)
+app.include_router(export.router)
+app.include_router(backups.router)
+app.include_router(batch.router)
 
 logger.info("所有路由已注册")
 
@@ -215,6 +382,87 @@ async def health_check():
         )
 
 
+@app.get("/stats", tags=["系统"], dependencies=[Depends(require_admin_token)])
+async def runtime_stats():
+    """
+    运行时统计信息（需要管理令牌）
+    包括认证缓存命中率与耗时、密码哈希线程池、在线状态存储规模、操作日志写入队列与清理记录、备份运行记录、响应缓存命中率、合并的并发请求数、请求耗时采样数、慢查询数、日志队列与采样、速率限制
+    """
+    from server.middleware import auth_cache, get_password_hash_stats
+    from server.services.presence_service import get_presence_store
+    from server.services.backup_service import get_backup_manager
+    from server.services.audit_log_service import get_audit_writer, get_audit_retention
+    from server.services.response_cache_service import get_response_cache
+    from server.services.request_coalescing_service import get_single_flight
+    
+    backup_manager = get_backup_manager()
+    audit_writer = get_audit_writer()
+    
+    return {
+        "auth_cache": auth_cache.get_stats(),
+        "password_hash": get_password_hash_stats(),
+        "presence": get_presence_store().get_stats(),
+        "audit_writer": audit_writer.get_stats() if audit_writer else None,
+        "audit_retention": get_audit_retention().get_stats(),
+        "response_cache": get_response_cache().get_stats(),
+        "request_coalescing": get_single_flight().get_stats(),
+        "tracing": get_trace_buffer().get_stats(),
+        "slow_queries": get_slow_query_log().get_stats(),
+        "logging": get_logging_stats(),
+        "rate_limit": get_rate_limiter().get_stats() if get_rate_limiter() else None,
+        "backup": {
+            **backup_manager.get_stats(),
+            "files": backup_manager.list_server_backups()
+        }
+    }
+
+
+@app.get("/stats/traces", tags=["系统"], dependencies=[Depends(require_admin_token)])
+async def trace_records(limit: int = 50):
+    """
+    最近采样的请求耗时记录（最新的在前，需要管理令牌）
+    每条记录包括路由、状态码、总耗时、各阶段耗时和每条 SQL 的耗时
+    """
+    buffer = get_trace_buffer()
+    return {
+        "stats": buffer.get_stats(),
+        "traces": buffer.get_records(max(limit, 0)),
+    }
+
+
+@app.get("/stats/slow-queries", tags=["系统"], dependencies=[Depends(require_admin_token)])
+async def slow_queries(limit: int = 20, order_by: str = "total"):
+    """
+    慢语句排行（按规范化 SQL 的指纹汇总，需要管理令牌）
+    每条记录包括规范化的 SQL、次数、累计/平均/最长耗时、行数、参数类型和最近一次的查询计划
+
+    Args:
+        limit: 返回条数
+        order_by: 排序依据（total 累计耗时、max 最长耗时、count 次数）
+    """
+    slow_log = get_slow_query_log()
+    try:
+        top = slow_log.get_top(max(limit, 0), order_by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "stats": slow_log.get_stats(),
+        "statements": top,
+    }
+
+
+@app.get("/metrics", tags=["系统"], response_class=PlainTextResponse, dependencies=[Depends(require_admin_token)])
+async def metrics():
+    """
+    Prometheus 格式的指标（需要管理令牌，抓取配置中使用 bearer token）
+    包括按路由模板统计的请求数、状态码分类、耗时与请求/响应大小分布、正在处理的请求数，以及连接池统计
+    """
+    return PlainTextResponse(
+        render_metrics(get_pool().get_stats()),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.get("/api/info", tags=["系统"])
 async def api_info():
     """
@@ -3,21 +3,33 @@
 包含认证、错误处理、CORS、请求日志等
 """
 
+import hmac
+import math
 import time
+import asyncio
 import logging
+import threading
 import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Annotated
 from datetime import datetime, timedelta
 from functools import wraps
 
 from fastapi import Request, HTTPException, status, Depends, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from starlette.datastructures import MutableHeaders
 
 from server.database import get_pool, DatabaseBusyError, ConnectionTimeoutError
+from server.logging_config import bind_request, reset_request, new_request_id, get_log_sampler
 from server.models import ErrorResponse
+from server.services.rate_limit_service import get_rate_limiter, request_cost
+from server.tracing import record_span
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -28,11 +40,23 @@ SECRET_KEY = "your-secret-key-change-this-in-production"  # 生产环境必须
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 小时
 
+# 认证缓存配置
+AUTH_CACHE_TTL_SECONDS = 60  # 缓存有效期（用户被删除后最长在此时间内仍可通过认证）
+AUTH_CACHE_MAX_ENTRIES = 4096  # 最大缓存条目数（超出后淘汰最久未使用的条目）
+
 # 密码加密上下文
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# 密码哈希线程池配置（bcrypt 计算时会释放 GIL，线程即可并行）
+PASSWORD_HASH_WORKERS = 2  # 工作线程数
+PASSWORD_HASH_MAX_PENDING = 8  # 最大排队+执行中任务数，超出直接返回 503
+
 # HTTP Bearer Token 安全方案
 security = HTTPBearer()
+admin_security = HTTPBearer(auto_error=False)
+
+# 管理令牌（/stats、/metrics 等运维接口使用；未设置时这些接口不可访问）
+ADMIN_TOKEN = ""
 
 
 # ==================== 密码加密 ====================
@@ -85,6 +109,102 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+# ==================== 密码哈希线程池 ====================
+
+_password_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash"
+)
+_password_pending = 0
+_password_lock = threading.Lock()
+_password_stats = {
+    'completed': 0,
+    'rejected': 0,
+    'max_pending': 0
+}
+
+
+async def _run_password_task(func, *args):
+    """
+    在密码哈希线程池中执行 bcrypt 计算，避免阻塞事件循环
+    
+    Args:
+        func: 要执行的函数
+        *args: 函数参数
+    
+    Returns:
+        函数返回值
+    
+    Raises:
+        HTTPException: 排队任务过多时返回 503
+    """
+    global _password_pending
+    
+    with _password_lock:
+        if _password_pending >= PASSWORD_HASH_MAX_PENDING:
+            _password_stats['rejected'] += 1
+            logger.warning(f"密码哈希任务过多，拒绝请求（当前: {_password_pending}）")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="服务器繁忙，请稍后重试",
+                headers={"Retry-After": "1"}
+            )
+        _password_pending += 1
+        if _password_pending > _password_stats['max_pending']:
+            _password_stats['max_pending'] = _password_pending
+    
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_password_executor, func, *args)
+    finally:
+        with _password_lock:
+            _password_pending -= 1
+            _password_stats['completed'] += 1
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """
+    验证密码（在线程池中执行）
+    
+    Args:
+        plain_password: 明文密码
+        hashed_password: 哈希密码
+    
+    Returns:
+        是否匹配
+    """
+    return await _run_password_task(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """
+    生成密码哈希（在线程池中执行）
+    
+    Args:
+        password: 明文密码
+    
+    Returns:
+        哈希密码
+    """
+    return await _run_password_task(get_password_hash, password)
+
+
+def get_password_hash_stats() -> dict:
+    """获取密码哈希线程池统计信息"""
+    with _password_lock:
+        return {
+            **_password_stats,
+            'pending': _password_pending,
+            'workers': PASSWORD_HASH_WORKERS,
+            'max_pending_limit': PASSWORD_HASH_MAX_PENDING
+        }
+
+
+def shutdown_password_executor():
+    """关闭密码哈希线程池（应用关闭时调用）"""
+    _password_executor.shutdown(wait=False)
+
+
 # ==================== JWT Token 管理 ====================
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -128,6 +248,167 @@ def decode_access_token(token: str) -> Optional[dict]:
         return None
 
 
+# ==================== 认证缓存 ====================
+
+class AuthCache:
+    """
+    认证结果缓存（有界 LRU + TTL）
+
+    缓存两类结果：
+        tokens: token -> (用户信息, 过期时间)，命中时无需再解码 JWT
+        users: user_id -> (username, 过期时间)，命中时无需查询数据库
+
+    token 条目的过期时间不会超过 JWT 自身的 exp；
+    token 命中时仍要求对应用户条目有效，因此失效用户条目即可让该用户的所有 token 重新校验
+    """
+
+    def __init__(self, ttl_seconds: float = AUTH_CACHE_TTL_SECONDS, max_entries: int = AUTH_CACHE_MAX_ENTRIES):
+        """
+        初始化认证缓存
+
+        Args:
+            ttl_seconds: 缓存有效期（秒）
+            max_entries: 每类缓存的最大条目数
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._tokens: OrderedDict = OrderedDict()
+        self._users: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'hit_time_total': 0.0,
+            'miss_time_total': 0.0,
+            'miss_time_max': 0.0,
+            'evictions': 0,
+            'invalidations': 0
+        }
+
+    def get(self, token: str) -> Optional[dict]:
+        """
+        查找缓存的认证结果
+
+        Args:
+            token: JWT Token 字符串
+
+        Returns:
+            用户信息字典，未命中返回 None
+        """
+        now = time.time()
+        with self._lock:
+            cached = self._tokens.get(token)
+            if cached is None:
+                return None
+            user, expires_at = cached
+            if expires_at <= now:
+                del self._tokens[token]
+                return None
+
+            user_cached = self._users.get(user["user_id"])
+            if user_cached is None or user_cached[1] <= now or user_cached[0] != user["username"]:
+                return None
+
+            self._tokens.move_to_end(token)
+            self._users.move_to_end(user["user_id"])
+            return user
+
+    def put(self, token: str, user: dict, token_exp: Optional[float] = None):
+        """
+        缓存一次成功的认证结果
+
+        Args:
+            token: JWT Token 字符串
+            user: 用户信息字典（包含 user_id 和 username）
+            token_exp: JWT 的过期时间戳（exp）
+        """
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._users[user["user_id"]] = (user["username"], expires_at)
+            self._users.move_to_end(user["user_id"])
+            if token_exp is not None:
+                expires_at = min(expires_at, token_exp)
+            self._tokens[token] = (user, expires_at)
+            self._tokens.move_to_end(token)
+            self._evict(self._tokens)
+            self._evict(self._users)
+
+    def invalidate_user(self, user_id: int):
+        """
+        失效指定用户的缓存（修改密码、删除用户后调用）
+
+        Args:
+            user_id: 用户ID
+        """
+        with self._lock:
+            if self._users.pop(user_id, None) is not None:
+                self._stats['invalidations'] += 1
+
+    def clear(self):
+        """清空所有缓存（例如更换 JWT 密钥后）"""
+        with self._lock:
+            self._tokens.clear()
+            self._users.clear()
+
+    def record(self, hit: bool, elapsed: float):
+        """
+        记录一次认证耗时
+
+        Args:
+            hit: 是否命中缓存
+            elapsed: 认证耗时（秒）
+        """
+        with self._lock:
+            if hit:
+                self._stats['hits'] += 1
+                self._stats['hit_time_total'] += elapsed
+            else:
+                self._stats['misses'] += 1
+                self._stats['miss_time_total'] += elapsed
+                if elapsed > self._stats['miss_time_max']:
+                    self._stats['miss_time_max'] = elapsed
+
+    def get_stats(self) -> dict:
+        """获取认证缓存统计信息"""
+        with self._lock:
+            hits = self._stats['hits']
+            misses = self._stats['misses']
+            total = hits + misses
+            return {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / total if total else 0.0,
+                'avg_hit_ms': self._stats['hit_time_total'] / hits * 1000 if hits else 0.0,
+                'avg_miss_ms': self._stats['miss_time_total'] / misses * 1000 if misses else 0.0,
+                'max_miss_ms': self._stats['miss_time_max'] * 1000,
+                'evictions': self._stats['evictions'],
+                'invalidations': self._stats['invalidations'],
+                'token_entries': len(self._tokens),
+                'user_entries': len(self._users),
+                'max_entries': self.max_entries
+            }
+
+    def _evict(self, cache: OrderedDict):
+        """淘汰超出容量的最久未使用条目（调用方需持有锁）"""
+        while len(cache) > self.max_entries:
+            cache.popitem(last=False)
+            self._stats['evictions'] += 1
+
+
+# 全局认证缓存实例
+auth_cache = AuthCache()
+
+
+def invalidate_user_auth_cache(user_id: int):
+    """
+    失效指定用户的认证缓存
+
+    Args:
+        user_id: 用户ID
+    """
+    auth_cache.invalidate_user(user_id)
+
+
 # ==================== 认证依赖 ====================
 
 async def get_current_user(
@@ -136,6 +417,8 @@ async def get_current_user(
     """
     从 Token 获取当前用户信息（依赖注入）
     
+    优先使用认证缓存，命中时既不解码 JWT 也不占用数据库连接
+    
     Args:
         credentials: HTTP Bearer Token 凭证
     
@@ -145,7 +428,16 @@ async def get_current_user(
     Raises:
         HTTPException: Token 无效或用户不存在
     """
+    start_time = time.perf_counter()
     token = credentials.credentials
+    
+    cached_user = auth_cache.get(token)
+    if cached_user is not None:
+        elapsed = time.perf_counter() - start_time
+        auth_cache.record(True, elapsed)
+        record_span("auth", elapsed)
+        return cached_user
+    
     payload = decode_access_token(token)
     
     if payload is None:
@@ -181,17 +473,24 @@ async def get_current_user(
                     detail="用户不存在或已被删除",
                     headers={"WWW-Authenticate": "Bearer"},
                 )
-            
-            return {
-                "user_id": user_id,
-                "username": username
-            }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"验证用户时出错: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="验证用户时发生错误"
         )
+    
+    current_user = {
+        "user_id": user_id,
+        "username": username
+    }
+    auth_cache.put(token, current_user, payload.get("exp"))
+    elapsed = time.perf_counter() - start_time
+    auth_cache.record(False, elapsed)
+    record_span("auth", elapsed)
+    return current_user
 
 
 async def get_current_user_optional(
@@ -233,81 +532,177 @@ async def get_current_user_optional(
         return None
 
 
-# ==================== 中间件 ====================
-
-async def logging_middleware(request: Request, call_next):
-    """
-    请求日志中间件
-    记录所有请求的详细信息
+async def require_admin_token(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(admin_security)
+) -> None:
     """
-    start_time = time.time()
+    验证管理令牌（依赖注入，用于 /stats、/metrics 等运维接口）
     
-    # 记录请求信息
-    logger.info(
-        f"请求: {request.method} {request.url.path} - "
-        f"客户端: {request.client.host if request.client else 'unknown'}"
-    )
+    请求头为 Authorization: Bearer <ADMIN_TOKEN>；
+    运维接口包含各接口耗时、SQL 语句与查询计划、备份文件名等，不对普通用户开放
     
-    # 处理请求
-    try:
-        response = await call_next(request)
-        
-        # 计算处理时间
-        process_time = time.time() - start_time
-        
-        # 记录响应信息
-        logger.info(
-            f"响应: {request.method} {request.url.path} - "
-            f"状态码: {response.status_code} - "
-            f"耗时: {process_time:.3f}秒"
+    Raises:
+        HTTPException: 未配置管理令牌或令牌不匹配
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="未配置管理令牌（ADMIN_TOKEN），运维接口不可访问",
         )
-        
-        # 添加处理时间到响应头
-        response.headers["X-Process-Time"] = str(process_time)
-        
-        return response
-    except Exception as e:
-        process_time = time.time() - start_time
-        logger.error(
-            f"请求处理异常: {request.method} {request.url.path} - "
-            f"错误: {str(e)} - 耗时: {process_time:.3f}秒"
+    if credentials is None or not hmac.compare_digest(credentials.credentials.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="无效的管理令牌",
+            headers={"WWW-Authenticate": "Bearer"},
         )
-        raise
 
 
-async def error_handler_middleware(request: Request, call_next):
+# ==================== 中间件 ====================
+#
+# 以下中间件均为纯 ASGI 中间件：直接包装 send，不像 @app.middleware("http")（BaseHTTPMiddleware）
+# 那样为每个请求另起任务、经内存流转发响应体
+
+# 请求ID的最大长度（客户端传入的 X-Request-ID 超长或包含其他字符时重新生成）
+_REQUEST_ID_MAX_LENGTH = 64
+
+
+def _request_id_from_scope(scope) -> str:
+    for name, value in scope["headers"]:
+        if name == b"x-request-id":
+            request_id = value.decode("latin-1")
+            if len(request_id) <= _REQUEST_ID_MAX_LENGTH and request_id.replace("-", "").replace("_", "").isalnum():
+                return request_id
+            break
+    return new_request_id()
+
+
+class LoggingMiddleware:
+    """
+    请求日志中间件
+    记录所有请求的详细信息，并在响应头中加上处理时间（X-Process-Time，秒）和请求ID（X-Request-ID）
+
+    请求ID取自请求头 X-Request-ID（没有时生成），处理请求期间的所有日志都带有该ID；
+    心跳等高频接口按路由采样（见 server.logging_config.LogSampler），
+    未被采样的请求只记录 WARNING 及以上的日志
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.time()
+        method = scope["method"]
+        path = scope["path"]
+        client = scope.get("client")
+        client_host = client[0] if client else "unknown"
+        request_id = _request_id_from_scope(scope)
+        token = bind_request(request_id, get_log_sampler().should_log(path))
+
+        # 记录请求信息
+        logger.info(f"请求: {method} {path} - 客户端: {client_host}")
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                # 计算处理时间（到响应开始为止）
+                process_time = time.time() - start_time
+
+                # 记录响应信息
+                logger.info(
+                    f"响应: {method} {path} - "
+                    f"状态码: {message['status']} - "
+                    f"耗时: {process_time:.3f}秒",
+                    extra={"fields": {
+                        "method": method,
+                        "path": path,
+                        "status": message["status"],
+                        "duration_ms": round(process_time * 1000, 3),
+                        "client": client_host,
+                    }}
+                )
+
+                # 添加处理时间和请求ID到响应头
+                headers = MutableHeaders(scope=message)
+                headers["X-Process-Time"] = str(process_time)
+                headers["X-Request-ID"] = request_id
+            await send(message)
+
+        # 处理请求
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            process_time = time.time() - start_time
+            logger.error(
+                f"请求处理异常: {method} {path} - "
+                f"错误: {str(e)} - 耗时: {process_time:.3f}秒"
+            )
+            raise
+        finally:
+            reset_request(token)
+
+
+class ErrorHandlerMiddleware:
     """
     全局错误处理中间件
-    捕获所有异常并返回统一的错误响应
+    捕获所有异常并返回统一的错误响应（响应已开始发送时无法替换，异常继续向外抛出）
     """
-    try:
-        response = await call_next(request)
-        return response
-    except DatabaseBusyError as e:
-        logger.warning(f"数据库繁忙: {e}")
-        return JSONResponse(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            content=ErrorResponse(
-                success=False,
-                message="数据库暂时繁忙，请稍后重试",
-                error_code="DATABASE_BUSY",
-                details={"retry_after": 1}
-            ).model_dump()
-        )
-    except ConnectionTimeoutError as e:
-        logger.error(f"连接超时: {e}")
-        return JSONResponse(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            content=ErrorResponse(
-                success=False,
-                message="数据库连接超时，请稍后重试",
-                error_code="CONNECTION_TIMEOUT"
-            ).model_dump()
-        )
-    except HTTPException as e:
-        # FastAPI 的 HTTPException 直接返回
-        raise e
-    except Exception as e:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        response_started = False
+
+        async def send_wrapper(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            if response_started:
+                raise
+            response = self._error_response(e)
+            if response is None:
+                raise
+            await response(scope, receive, send)
+
+    @staticmethod
+    def _error_response(e: Exception) -> Optional[JSONResponse]:
+        """把异常转换为错误响应（HTTPException 返回 None，交给 FastAPI 处理）"""
+        if isinstance(e, DatabaseBusyError):
+            logger.warning(f"数据库繁忙: {e}")
+            return JSONResponse(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                content=ErrorResponse(
+                    success=False,
+                    message="数据库暂时繁忙，请稍后重试",
+                    error_code="DATABASE_BUSY",
+                    details={"retry_after": 1}
+                ).model_dump()
+            )
+        if isinstance(e, ConnectionTimeoutError):
+            logger.error(f"连接超时: {e}")
+            return JSONResponse(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                content=ErrorResponse(
+                    success=False,
+                    message="数据库连接超时，请稍后重试",
+                    error_code="CONNECTION_TIMEOUT"
+                ).model_dump()
+            )
+        if isinstance(e, HTTPException):
+            # FastAPI 的 HTTPException 直接抛出
+            return None
         # 其他未预期的异常
         logger.error(f"未处理的异常: {e}\n{traceback.format_exc()}")
         return JSONResponse(
@@ -321,32 +716,38 @@ async def error_handler_middleware(request: Request, call_next):
         )
 
 
-async def cors_middleware(request: Request, call_next):
+class CacheHeadersMiddleware:
     """
-    CORS 中间件
-    处理跨域请求
+    响应头中间件
+    OPTIONS 请求（CORS 预检之外的）直接返回空对象；GET 响应加上缓存控制头
+    （CORS 由 CORSMiddleware 统一处理）
     """
-    # 处理预检请求
-    if request.method == "OPTIONS":
-        response = JSONResponse(content={})
-    else:
-        response = await call_next(request)
-    
-    # 添加 CORS 头
-    response.headers["Access-Control-Allow-Origin"] = "*"  # 生产环境应该限制具体域名
-    response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS, PATCH"
-    response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization, X-Requested-With"
-    response.headers["Access-Control-Allow-Credentials"] = "true"
-    response.headers["Access-Control-Max-Age"] = "3600"
-    
-    # 添加性能优化响应头
-    # 对于 GET 请求，添加缓存控制（可根据需要调整）
-    if request.method == "GET":
-        # 对于 API 数据，使用较短的缓存时间（5分钟），避免数据不一致
-        response.headers["Cache-Control"] = "private, max-age=300"
-        response.headers["Vary"] = "Accept-Encoding"
-    
-    return response
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        if method == "OPTIONS":
+            await JSONResponse(content={})(scope, receive, send)
+            return
+        if method != "GET":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                # 对于 API 数据，使用较短的缓存时间（5分钟），避免数据不一致
+                headers = MutableHeaders(scope=message)
+                headers["Cache-Control"] = "private, max-age=300"
+                headers["Vary"] = "Accept-Encoding"
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
 
 
 # ==================== 用户 ID 提取辅助函数 ====================
@@ -395,85 +796,103 @@ def require_auth(func):
 
 # ==================== 速率限制（可选） ====================
 
-from collections import defaultdict
-from datetime import datetime, timedelta
-
-_rate_limit_store = defaultdict(list)
-_rate_limit_window = timedelta(minutes=1)
-_rate_limit_max_requests = 60
-
-
-def check_rate_limit(identifier: str) -> bool:
-    """
-    检查速率限制
-    
-    Args:
-        identifier: 标识符（通常是 IP 地址或用户 ID）
-    
-    Returns:
-        是否允许请求
-    """
-    now = datetime.utcnow()
-    
-    # 清理过期记录
-    _rate_limit_store[identifier] = [
-        timestamp for timestamp in _rate_limit_store[identifier]
-        if now - timestamp < _rate_limit_window
-    ]
-    
-    # 检查是否超过限制
-    if len(_rate_limit_store[identifier]) >= _rate_limit_max_requests:
-        return False
-    
-    # 记录本次请求
-    _rate_limit_store[identifier].append(now)
-    return True
-
-
-async def rate_limit_middleware(request: Request, call_next):
+class RateLimitMiddleware:
     """
     速率限制中间件（可选，根据需要启用）
+    按用户和客户端 IP 各一个令牌桶限流，请求开销见 server.services.rate_limit_service.request_cost；
+    只限制 /api/ 下的接口，速率限制器未初始化时直接放行
     """
-    # 获取客户端标识符
-    client_ip = request.client.host if request.client else "unknown"
-    
-    # 检查速率限制
-    if not check_rate_limit(client_ip):
-        logger.warning(f"速率限制: {client_ip} 请求过于频繁")
-        return JSONResponse(
-            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-            content=ErrorResponse(
-                success=False,
-                message="请求过于频繁，请稍后再试",
-                error_code="RATE_LIMIT_EXCEEDED"
-            ).model_dump()
-        )
-    
-    return await call_next(request)
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+        limiter = get_rate_limiter()
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        # 获取客户端标识符
+        client = scope.get("client")
+        client_ip = client[0] if client else "unknown"
+        user_id = _user_id_from_scope(scope)
+
+        # 检查速率限制（sqlite 后端的检查会写文件，放到线程池中执行）
+        cost = request_cost(scope["method"], scope["path"], scope["query_string"])
+        if limiter.blocking:
+            retry_after = await run_in_threadpool(limiter.check, user_id, client_ip, cost)
+        else:
+            retry_after = limiter.check(user_id, client_ip, cost)
+        if retry_after:
+            retry_after = max(1, math.ceil(retry_after))
+            logger.warning(f"速率限制: 用户 {user_id} / {client_ip} 请求过于频繁（{scope['method']} {scope['path']}）")
+            response = JSONResponse(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                content=ErrorResponse(
+                    success=False,
+                    message="请求过于频繁，请稍后再试",
+                    error_code="RATE_LIMIT_EXCEEDED",
+                    details={"retry_after": retry_after}
+                ).model_dump(),
+                headers={"Retry-After": str(retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+
+        await self.app(scope, receive, send)
+
+
+def _user_id_from_scope(scope) -> Optional[int]:
+    """从 Authorization 头获取用户ID（优先使用认证缓存；令牌无效时为 None）"""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer" or not token:
+                return None
+            cached_user = auth_cache.get(token)
+            if cached_user is not None:
+                return cached_user["user_id"]
+            payload = decode_access_token(token)
+            return payload.get("user_id") if payload else None
+    return None
 
 
 # ==================== 配置函数 ====================
 
-def setup_middleware(app):
+def setup_middleware(app, rate_limit: bool = False):
     """
     设置所有中间件到 FastAPI 应用
     
     Args:
         app: FastAPI 应用实例
+        rate_limit: 是否启用速率限制（速率限制器由 init_rate_limiter 初始化）
     """
-    # 注意：中间件的顺序很重要，后添加的中间件会先执行
+    # 注意：中间件的顺序很重要，后添加的中间件在外层、先执行
     
-    # 1. CORS 中间件（最外层）
-    app.middleware("http")(cors_middleware)
+    # 1. 响应头中间件（最内层）
+    app.add_middleware(CacheHeadersMiddleware)
     
     # 2. 错误处理中间件
-    app.middleware("http")(error_handler_middleware)
+    app.add_middleware(ErrorHandlerMiddleware)
     
     # 3. 日志中间件
-    app.middleware("http")(logging_middleware)
+    app.add_middleware(LoggingMiddleware)
     
     # 4. 速率限制中间件（可选，根据需要启用）
-    # app.middleware("http")(rate_limit_middleware)
+    if rate_limit:
+        app.add_middleware(RateLimitMiddleware)
+    
+    # 5. CORS 中间件（预检请求在此直接返回）
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # 生产环境应该限制具体域名
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
     
     logger.info("中间件设置完成")
 
@@ -487,5 +906,17 @@ def update_secret_key(new_secret_key: str):
     """
     global SECRET_KEY
     SECRET_KEY = new_secret_key
+    # 旧密钥签发的 Token 不再有效
+    auth_cache.clear()
     logger.info("JWT 密钥已更新")
 
+
+def update_admin_token(admin_token: str):
+    """
+    设置管理令牌（用于 /stats、/metrics 等运维接口）
+    
+    Args:
+        admin_token: 管理令牌，为空时运维接口不可访问
+    """
+    global ADMIN_TOKEN
+    ADMIN_TOKEN = admin_token
@@ -284,6 +284,11 @@ class PurchaseResponse(BaseModel):
     model_config = {"from_attributes": True}
 
 
+class PurchaseBatchCreate(BaseModel):
+    """批量创建采购记录请求（所有行在同一事务中创建）"""
+    items: List[PurchaseCreate] = Field(..., min_length=1, max_length=200, description="采购记录行（最多 200 行）")
+
+
 # ==================== 销售相关模型 ====================
 
 class SaleCreate(BaseModel):
@@ -339,6 +344,11 @@ class SaleResponse(BaseModel):
     model_config = {"from_attributes": True}
 
 
+class SaleBatchCreate(BaseModel):
+    """批量创建销售记录请求（所有行在同一事务中创建）"""
+    items: List[SaleCreate] = Field(..., min_length=1, max_length=200, description="销售记录行（最多 200 行）")
+
+
 # ==================== 退货相关模型 ====================
 
 class ReturnCreate(BaseModel):
@@ -394,6 +404,11 @@ class ReturnResponse(BaseModel):
     model_config = {"from_attributes": True}
 
 
+class ReturnBatchCreate(BaseModel):
+    """批量创建退货记录请求（所有行在同一事务中创建）"""
+    items: List[ReturnCreate] = Field(..., min_length=1, max_length=200, description="退货记录行（最多 200 行）")
+
+
 # ==================== 进账相关模型 ====================
 
 class IncomeCreate(BaseModel):
@@ -716,13 +731,36 @@ class AuditLogFilter(BaseModel):
     start_time: Optional[str] = Field(None, description="开始时间（ISO8601格式）")
     end_time: Optional[str] = Field(None, description="结束时间（ISO8601格式）")
     search: Optional[str] = Field(None, description="搜索关键词（实体名称、备注）")
+    entity_id: Optional[int] = Field(None, description="实体ID筛选")
+    changed_fields: Optional[List[str]] = Field(None, description="变更字段筛选")
 
 
 class AuditLogListResponse(BaseModel):
     """操作日志列表响应"""
     logs: List[AuditLogResponse]
-    total: int
+    total: Optional[int] = Field(None, description="总数（with_total=false 时不返回）")
     page: int
     page_size: int
-    total_pages: int
+    total_pages: Optional[int] = None
+    next_cursor: Optional[str] = Field(None, description="下一页游标，没有更多数据时为空")
+
+
+# ==================== 批量请求模型 ====================
+
+class BatchSubRequest(BaseModel):
+    """批量请求中的子请求（只支持 GET 接口）"""
+    id: Optional[str] = Field(None, max_length=100, description="客户端自定义标识，原样返回")
+    path: str = Field(..., min_length=1, max_length=2000, description="接口路径，可带查询字符串（如：/api/sales?page=1）")
+    params: Optional[Dict[str, Any]] = Field(None, description="查询参数（与路径中的查询字符串合并）")
+
+
+class BatchRequest(BaseModel):
+    """批量请求（所有子请求在同一个只读快照中执行）"""
+    requests: List[BatchSubRequest] = Field(..., min_length=1, max_length=20, description="子请求（最多 20 个）")
+    stream: bool = Field(False, description="以 NDJSON 逐条返回（每个子请求完成后立即发送）")
+
 
+class BulkIdsRequest(BaseModel):
+    """按ID批量查询请求（ID 较多、不便放在查询字符串中时使用）"""
+    ids: List[int] = Field(..., min_length=1, max_length=1000, description="ID 列表（最多 1000 个）")
+    fields: Optional[str] = Field(None, description="只返回指定字段，逗号分隔（如：id,name）")
@@ -6,6 +6,7 @@
 import logging
 from typing import Optional
 from fastapi import APIRouter, HTTPException, status, Depends, Query
+from fastapi.concurrency import run_in_threadpool
 from math import ceil
 
 from server.database import get_pool
@@ -17,7 +18,12 @@ from server.models import (
     AuditLogListResponse,
     OperationType
 )
-from server.services.audit_log_service import AuditLogService
+from server.services.audit_log_service import (
+    AuditLogService,
+    AuditRetentionBusyError,
+    get_audit_retention
+)
+from server.services.request_coalescing_service import coalesce_requests
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -27,7 +33,8 @@ router = APIRouter(prefix="/api/audit-logs", tags=["操作日志"])
 
 
 @router.get("", response_model=BaseResponse)
-async def get_audit_logs(
+@coalesce_requests("operation_logs", "operation_log_fields")
+def get_audit_logs(
     page: int = Query(1, ge=1, description="页码，从1开始"),
     page_size: int = Query(20, ge=1, le=100, description="每页数量（最大100）"),
     operation_type: Optional[str] = Query(None, description="操作类型筛选（CREATE/UPDATE/DELETE）"),
@@ -35,6 +42,11 @@ async def get_audit_logs(
     start_time: Optional[str] = Query(None, description="开始时间（ISO8601格式，如：2025-01-01T00:00:00）"),
     end_time: Optional[str] = Query(None, description="结束时间（ISO8601格式，如：2025-01-31T23:59:59）"),
     search: Optional[str] = Query(None, description="搜索关键词（实体名称、备注）"),
+    entity_id: Optional[int] = Query(None, description="实体ID筛选（需同时指定实体类型时效率最高）"),
+    changed_fields: Optional[str] = Query(None, description="变更字段筛选，逗号分隔（如：price,quantity）"),
+    cursor: Optional[str] = Query(None, description="分页游标（上一页返回的 next_cursor），指定时忽略页码"),
+    with_total: bool = Query(True, description="是否返回总数（深翻页时可关闭以省去计数）"),
+    archived: bool = Query(False, description="是否查询已归档的日志"),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -48,10 +60,15 @@ async def get_audit_logs(
         start_time: 开始时间
         end_time: 结束时间
         search: 搜索关键词
+        entity_id: 实体ID筛选
+        changed_fields: 变更字段筛选
+        cursor: 分页游标
+        with_total: 是否返回总数
+        archived: 是否查询已归档的日志
         current_user: 当前用户信息
     
     Returns:
-        操作日志列表（分页）
+        操作日志列表（分页，next_cursor 用于获取下一页）
     """
     try:
         user_id = current_user["user_id"]
@@ -63,23 +80,36 @@ async def get_audit_logs(
                 detail="无效的操作类型，必须是 CREATE、UPDATE 或 DELETE"
             )
         
+        fields = [field.strip() for field in changed_fields.split(",") if field.strip()] if changed_fields else None
+        
         # 查询日志
-        logs, total = AuditLogService.get_logs(
-            user_id=user_id,
-            page=page,
-            page_size=page_size,
-            operation_type=operation_type,
-            entity_type=entity_type,
-            start_time=start_time,
-            end_time=end_time,
-            search=search
-        )
+        try:
+            logs, total, next_cursor = AuditLogService.get_logs(
+                user_id=user_id,
+                page=page,
+                page_size=page_size,
+                operation_type=operation_type,
+                entity_type=entity_type,
+                start_time=start_time,
+                end_time=end_time,
+                search=search,
+                entity_id=entity_id,
+                changed_fields=fields,
+                cursor=cursor,
+                with_total=with_total,
+                archived=archived
+            )
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
         
         # 转换为响应模型
         log_responses = [AuditLogResponse(**log) for log in logs]
         
         # 计算总页数
-        total_pages = ceil(total / page_size) if page_size > 0 else 0
+        total_pages = ceil(total / page_size) if total is not None and page_size > 0 else None
         
         return BaseResponse(
             success=True,
@@ -89,7 +119,8 @@ async def get_audit_logs(
                 total=total,
                 page=page,
                 page_size=page_size,
-                total_pages=total_pages
+                total_pages=total_pages,
+                next_cursor=next_cursor
             ).model_dump()
         )
     except HTTPException:
@@ -105,6 +136,7 @@ async def get_audit_logs(
 @router.get("/{log_id}", response_model=BaseResponse)
 async def get_audit_log_detail(
     log_id: int,
+    archived: bool = Query(False, description="是否查询已归档的日志"),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -112,6 +144,7 @@ async def get_audit_log_detail(
     
     Args:
         log_id: 日志ID
+        archived: 是否查询已归档的日志
         current_user: 当前用户信息
     
     Returns:
@@ -120,7 +153,13 @@ async def get_audit_log_detail(
     try:
         user_id = current_user["user_id"]
         
-        log_detail = AuditLogService.get_log_detail(log_id, user_id)
+        try:
+            log_detail = AuditLogService.get_log_detail(log_id, user_id, archived=archived)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
         
         if not log_detail:
             raise HTTPException(
@@ -151,6 +190,8 @@ async def cleanup_old_logs(
     """
     清理指定天数之前的旧日志（可选功能，用于管理员维护）
     
+    按 ID 范围分批删除，批次之间让出写锁；配置了归档库（AUDIT_ARCHIVE_PATH）时先归档再删除
+    
     Args:
         days: 保留天数
         current_user: 当前用户信息
@@ -162,12 +203,18 @@ async def cleanup_old_logs(
         # 注意：这里可以根据需要添加管理员权限检查
         # 目前允许所有用户清理自己的日志
         
-        deleted_count = AuditLogService.cleanup_old_logs(days=days)
+        result = await run_in_threadpool(get_audit_retention().run, days)
+        deleted_count = result["deleted"]
         
         return BaseResponse(
             success=True,
             message=f"清理完成，删除了 {deleted_count} 条 {days} 天前的日志",
-            data={"deleted_count": deleted_count}
+            data={"deleted_count": deleted_count, **result}
+        )
+    except AuditRetentionBusyError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
         )
     except Exception as e:
         logger.error(f"清理旧日志失败: {e}", exc_info=True)
@@ -4,6 +4,7 @@
 """
 
 import logging
+import sqlite3
 from datetime import datetime
 from typing import Optional
 from fastapi import APIRouter, HTTPException, status, Depends
@@ -11,10 +12,11 @@ from fastapi.security import HTTPAuthorizationCredentials
 
 from server.database import get_pool
 from server.middleware import (
-    get_password_hash,
-    verify_password,
+    get_password_hash_async,
+    verify_password_async,
     create_access_token,
     get_current_user,
+    invalidate_user_auth_cache,
     security
 )
 from server.models import (
@@ -27,6 +29,7 @@ from server.models import (
     BaseResponse,
     ErrorResponse
 )
+from server.services.presence_service import get_presence_store
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -56,24 +59,31 @@ async def register(user_data: UserCreate):
                 (user_data.username,)
             )
             existing_user = cursor.fetchone()
-            
-            if existing_user:
+        
+        if existing_user:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="用户名已存在，请选择其他用户名"
+            )
+        
+        # 加密密码（在线程池中执行，不占用数据库连接）
+        hashed_password = await get_password_hash_async(user_data.password)
+        
+        with pool.get_connection() as conn:
+            # 创建用户（哈希期间用户名可能已被占用，由唯一约束兜底）
+            try:
+                cursor = conn.execute(
+                    """
+                    INSERT INTO users (username, password, created_at)
+                    VALUES (?, ?, datetime('now'))
+                    """,
+                    (user_data.username, hashed_password)
+                )
+            except sqlite3.IntegrityError:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="用户名已存在，请选择其他用户名"
                 )
-            
-            # 加密密码
-            hashed_password = get_password_hash(user_data.password)
-            
-            # 创建用户
-            cursor = conn.execute(
-                """
-                INSERT INTO users (username, password, created_at)
-                VALUES (?, ?, datetime('now'))
-                """,
-                (user_data.username, hashed_password)
-            )
             user_id = cursor.lastrowid
             
             # 创建用户设置记录
@@ -149,36 +159,34 @@ async def login(login_data: UserLogin):
                 (login_data.username,)
             )
             user = cursor.fetchone()
-            
-            if user is None:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="用户名或密码错误"
-                )
-            
-            user_id, username, hashed_password = user
-            
-            # 验证密码
-            if not verify_password(login_data.password, hashed_password):
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="用户名或密码错误"
-                )
-            
+        
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="用户名或密码错误"
+            )
+        
+        user_id, username, hashed_password = user
+        
+        # 验证密码（在线程池中执行，不占用数据库连接）
+        if not await verify_password_async(login_data.password, hashed_password):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="用户名或密码错误"
+            )
+        
+        with pool.get_connection() as conn:
             # 更新最后登录时间
             conn.execute(
                 "UPDATE users SET last_login_at = datetime('now') WHERE id = ?",
                 (user_id,)
             )
             
+            conn.commit()
+            
             # 不在这里创建在线用户记录，让客户端在心跳时创建（避免出现默认设备）
             # 同时清理可能存在的旧默认设备记录
-            conn.execute(
-                "DELETE FROM online_users WHERE userId = ? AND deviceId = 'default'",
-                (user_id,)
-            )
-            
-            conn.commit()
+            get_presence_store().remove(user_id, "default")
             
             # 生成 Token
             token_data = {
@@ -233,7 +241,6 @@ async def logout(
     Returns:
         登出成功响应
     """
-    pool = get_pool()
     user_id = current_user["user_id"]
     username = current_user["username"]
     
@@ -241,26 +248,20 @@ async def logout(
     device_id = logout_data.device_id if logout_data and logout_data.device_id else None
     
     try:
-        with pool.get_connection() as conn:
-            if device_id:
-                # 只删除当前设备的记录
-                conn.execute(
-                    "DELETE FROM online_users WHERE userId = ? AND deviceId = ?",
-                    (user_id, device_id)
-                )
-                logger.info(f"用户登出: {username} (ID: {user_id}), 设备: {device_id}")
-            else:
-                # 如果没有提供设备ID，不删除任何记录（让心跳超时自动清理）
-                # 这样可以避免误删其他设备的记录
-                logger.info(f"用户登出: {username} (ID: {user_id}), 未提供设备ID，等待心跳超时")
-            
-            conn.commit()
-            
-            return BaseResponse(
-                success=True,
-                message="登出成功"
-            )
-            
+        if device_id:
+            # 只删除当前设备的记录
+            get_presence_store().remove(user_id, device_id)
+            logger.info(f"用户登出: {username} (ID: {user_id}), 设备: {device_id}")
+        else:
+            # 如果没有提供设备ID，不删除任何记录（让心跳超时自动清理）
+            # 这样可以避免误删其他设备的记录
+            logger.info(f"用户登出: {username} (ID: {user_id}), 未提供设备ID，等待心跳超时")
+        
+        return BaseResponse(
+            success=True,
+            message="登出成功"
+        )
+        
     except Exception as e:
         logger.error(f"用户登出失败: {e}", exc_info=True)
         raise HTTPException(
@@ -384,30 +385,35 @@ async def change_password(
                 (user_id,)
             )
             user = cursor.fetchone()
-            
-            if user is None:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="用户不存在"
-                )
-            
-            hashed_password = user[0]
-            
-            # 验证旧密码
-            if not verify_password(password_data.old_password, hashed_password):
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="当前密码不正确"
-                )
-            
+        
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="用户不存在"
+            )
+        
+        hashed_password = user[0]
+        
+        # 验证旧密码（在线程池中执行，不占用数据库连接）
+        if not await verify_password_async(password_data.old_password, hashed_password):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="当前密码不正确"
+            )
+        
+        new_hashed_password = await get_password_hash_async(password_data.new_password)
+        
+        with pool.get_connection() as conn:
             # 更新密码
-            new_hashed_password = get_password_hash(password_data.new_password)
             conn.execute(
                 "UPDATE users SET password = ? WHERE id = ?",
                 (new_hashed_password, user_id)
             )
             conn.commit()
             
+            # 失效认证缓存，下一次请求重新校验用户
+            invalidate_user_auth_cache(user_id)
+            
             logger.info(f"用户修改密码成功: {current_user['username']} (ID: {user_id})")
             
             return BaseResponse(
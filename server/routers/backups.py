@@ -0,0 +1,235 @@
+"""
+备份管理路由
+用户逻辑备份的创建、列表、下载和删除；整库快照的列表、下载和立即执行（需要管理令牌）
+"""
+
+import logging
+from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+
+from server.database import get_pool
+from server.middleware import get_current_user, require_admin_token
+from server.models import BaseResponse
+from server.services.backup_service import BackupError, BackupInProgressError, get_backup_manager
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 创建路由
+router = APIRouter(prefix="/api/backups", tags=["备份管理"])
+
+
+def _create_user_backup(user_id: int, username: str) -> dict:
+    """在线程中创建用户备份（导出期间占用一个连接）"""
+    with get_pool().get_connection() as conn:
+        return get_backup_manager().create_user_backup(conn, user_id, username)
+
+
+@router.post("", response_model=BaseResponse, status_code=status.HTTP_201_CREATED)
+async def create_backup(
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    创建当前用户的服务器端备份（NDJSON，gzip 压缩）
+    
+    备份文件与 GET /api/export 的输出格式相同，可直接用于流式导入
+    
+    Args:
+        current_user: 当前用户信息
+    
+    Returns:
+        备份文件信息
+    """
+    user_id = current_user["user_id"]
+    
+    try:
+        backup = await run_in_threadpool(
+            _create_user_backup,
+            user_id,
+            current_user.get("username", "unknown")
+        )
+        logger.info(f"创建用户备份成功: {backup['name']} (用户: {user_id}, 行数: {backup['rows']})")
+        
+        return BaseResponse(
+            success=True,
+            message="创建备份成功",
+            data=backup
+        )
+        
+    except Exception as e:
+        logger.error(f"创建用户备份失败: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"创建备份失败: {str(e)}"
+        )
+
+
+@router.get("", response_model=BaseResponse)
+async def list_backups(
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    获取当前用户的备份列表（按时间倒序）
+    
+    Args:
+        current_user: 当前用户信息
+    
+    Returns:
+        备份文件列表
+    """
+    backups = get_backup_manager().list_user_backups(current_user["user_id"])
+    
+    return BaseResponse(
+        success=True,
+        message="获取备份列表成功",
+        data={
+            "items": backups,
+            "total": len(backups)
+        }
+    )
+
+
+# ==================== 整库快照（需要管理令牌） ====================
+# 须在 /{name} 之前注册，否则 server 会被当作用户备份的文件名
+
+@router.get("/server", response_model=BaseResponse, dependencies=[Depends(require_admin_token)])
+async def list_server_backups():
+    """
+    获取整库快照列表（按时间倒序）
+    
+    Returns:
+        快照文件列表和最近的运行记录
+    """
+    manager = get_backup_manager()
+    backups = manager.list_server_backups()
+    
+    return BaseResponse(
+        success=True,
+        message="获取整库快照列表成功",
+        data={
+            "items": backups,
+            "total": len(backups),
+            "stats": manager.get_stats()
+        }
+    )
+
+
+@router.post(
+    "/server",
+    response_model=BaseResponse,
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(require_admin_token)]
+)
+async def create_server_backup():
+    """
+    立即执行一次整库快照（在线程中执行，完成后返回）
+    
+    Returns:
+        本次运行记录
+    """
+    try:
+        record = await run_in_threadpool(get_backup_manager().run_backup)
+    except BackupInProgressError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+    except BackupError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+    
+    return BaseResponse(
+        success=True,
+        message="整库快照完成",
+        data=record
+    )
+
+
+@router.get("/server/{name}", dependencies=[Depends(require_admin_token)])
+async def download_server_backup(name: str):
+    """
+    下载整库快照（支持 Range 断点续传）
+    
+    Args:
+        name: 快照文件名
+    
+    Returns:
+        快照文件
+    """
+    path = get_backup_manager().get_server_backup_path(name)
+    
+    if path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="快照文件不存在"
+        )
+    
+    return FileResponse(
+        path,
+        media_type="application/gzip" if name.endswith(".gz") else "application/vnd.sqlite3",
+        filename=name
+    )
+
+
+# ==================== 用户逻辑备份 ====================
+
+@router.get("/{name}")
+async def download_backup(
+    name: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    下载备份文件（支持 Range 断点续传）
+    
+    Args:
+        name: 备份文件名
+        current_user: 当前用户信息
+    
+    Returns:
+        备份文件
+    """
+    path = get_backup_manager().get_user_backup_path(current_user["user_id"], name)
+    
+    if path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="备份文件不存在"
+        )
+    
+    return FileResponse(
+        path,
+        media_type="application/gzip",
+        filename=name
+    )
+
+
+@router.delete("/{name}", response_model=BaseResponse)
+async def delete_backup(
+    name: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    删除备份文件
+    
+    Args:
+        name: 备份文件名
+        current_user: 当前用户信息
+    
+    Returns:
+        删除结果
+    """
+    if not get_backup_manager().delete_user_backup(current_user["user_id"], name):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="备份文件不存在"
+        )
+    
+    logger.info(f"删除用户备份成功: {name} (用户: {current_user['user_id']})")
+    
+    return BaseResponse(
+        success=True,
+        message="删除备份成功"
+    )
@@ -0,0 +1,196 @@
+"""
+批量请求路由
+把多个 GET 请求合并为一次 HTTP 请求，节省经 Cloudflare Tunnel 的往返和 TLS 开销；
+所有子请求在同一个只读快照中执行，看到的是同一时刻的数据
+"""
+
+import asyncio
+import logging
+from typing import AsyncIterator, Tuple
+from urllib.parse import parse_qs, quote, urlencode, urlsplit
+
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import StreamingResponse
+
+from server.database import get_pool
+from server.middleware import get_current_user
+from server.models import BatchRequest, BatchSubRequest
+from server.serialization import JSONBytesResponse, dumps
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 创建路由
+router = APIRouter(prefix="/api/batch", tags=["批量请求"])
+
+# 不允许在批量请求中调用的接口（自身、数据导出和备份文件下载，
+# 以及会写入或结束读事务、不能在只读快照中执行的接口：设置接口首次读取时写入默认设置）
+_EXCLUDED_PREFIXES = ("/api/batch", "/api/export", "/api/backups", "/api/settings")
+
+# 查询归档日志需要附加归档库（必须在事务之外），不能在只读快照中执行
+_ARCHIVE_PREFIX = "/api/audit-logs"
+_TRUE_VALUES = ("1", "true", "on", "yes")
+
+# 转发给子请求的请求头（不转发 Accept-Encoding：子响应不压缩，由外层响应统一压缩）
+_FORWARDED_HEADERS = (b"authorization", b"user-agent", b"x-forwarded-for", b"cf-connecting-ip")
+
+
+def _sub_request_target(sub_request: BatchSubRequest) -> Tuple[str, bytes]:
+    """
+    解析子请求的路径和查询字符串
+
+    Returns:
+        (路径, 查询字符串)
+
+    Raises:
+        ValueError: 路径无效或不允许在批量请求中调用
+    """
+    parts = urlsplit(sub_request.path)
+    path = parts.path
+    if parts.scheme or parts.netloc or not path.startswith("/api/"):
+        raise ValueError("子请求路径必须以 /api/ 开头")
+    if path.startswith(_EXCLUDED_PREFIXES):
+        raise ValueError(f"不支持在批量请求中调用: {path}")
+
+    query = parts.query
+    if sub_request.params:
+        extra = urlencode(
+            {key: value for key, value in sub_request.params.items() if value is not None},
+            doseq=True
+        )
+        query = f"{query}&{extra}" if query else extra
+    if path.startswith(_ARCHIVE_PREFIX) and any(
+        value.lower() in _TRUE_VALUES for value in parse_qs(query).get("archived", [])
+    ):
+        raise ValueError("不支持在批量请求中查询归档日志")
+    # 路径中的查询字符串可能包含未编码的中文
+    return path, quote(query, safe="=&+%,:").encode("ascii")
+
+
+async def _dispatch(request: Request, path: str, query_string: bytes) -> Tuple[int, bytes, str]:
+    """
+    在应用内执行一个 GET 子请求（经过与普通请求相同的中间件、认证和路由）
+
+    Returns:
+        (状态码, 响应体, Content-Type)
+    """
+    scope = {
+        "type": "http",
+        "asgi": request.scope.get("asgi", {"version": "3.0"}),
+        "http_version": request.scope.get("http_version", "1.1"),
+        "method": "GET",
+        "scheme": request.scope.get("scheme", "http"),
+        "server": request.scope.get("server"),
+        "client": request.scope.get("client"),
+        "root_path": request.scope.get("root_path", ""),
+        "path": path,
+        "raw_path": path.encode("utf-8"),
+        "query_string": query_string,
+        "headers": [
+            (name, value) for name, value in request.scope["headers"]
+            if name in _FORWARDED_HEADERS
+        ],
+    }
+    if "state" in request.scope:
+        scope["state"] = dict(request.scope["state"])
+
+    response = {"status": 500, "content_type": "", "body": []}
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # 子请求没有更多请求体，也不会断开；等待方在响应发送完后会被取消
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            for name, value in message.get("headers", []):
+                if name.lower() == b"content-type":
+                    response["content_type"] = value.decode("latin-1")
+        elif message["type"] == "http.response.body":
+            response["body"].append(message.get("body", b""))
+
+    await request.app(scope, receive, send)
+    return response["status"], b"".join(response["body"]), response["content_type"]
+
+
+def _encode_result(index: int, sub_request: BatchSubRequest, status_code: int, body: bytes, content_type: str) -> bytes:
+    """编码一个子请求的结果（JSON 响应体原样嵌入，不重新解析）"""
+    if not (body and content_type.startswith("application/json")):
+        body = dumps(body.decode("utf-8", errors="replace"))
+    return (
+        b'{"index":' + dumps(index)
+        + b',"id":' + dumps(sub_request.id)
+        + b',"path":' + dumps(sub_request.path)
+        + b',"status":' + dumps(status_code)
+        + b',"body":' + body
+        + b'}'
+    )
+
+
+async def _run_batch(request: Request, batch: BatchRequest) -> AsyncIterator[bytes]:
+    """
+    在同一个只读快照中依次执行子请求，每完成一个生成一条结果
+
+    快照只能由一个连接持有，连接不能并发使用，所以子请求按顺序执行（完成顺序即请求顺序）。
+    每个子请求执行后检查读事务是否仍在进行：子请求意外结束了读事务时，
+    之后的子请求不再执行（返回 500），不会在没有一致快照的情况下读取数据
+    """
+    with get_pool().read_snapshot() as conn:
+        snapshot_lost = False
+        for index, sub_request in enumerate(batch.requests):
+            if snapshot_lost:
+                yield _encode_result(index, sub_request, 500, dumps({"detail": "只读快照已失效，子请求未执行"}), "application/json")
+                continue
+            try:
+                path, query_string = _sub_request_target(sub_request)
+            except ValueError as e:
+                yield _encode_result(index, sub_request, 400, dumps({"detail": str(e)}), "application/json")
+                continue
+            status_code, body, content_type = await _dispatch(request, path, query_string)
+            yield _encode_result(index, sub_request, status_code, body, content_type)
+            if not conn.in_transaction:
+                snapshot_lost = True
+                logger.error(f"批量请求的子请求 {sub_request.path} 结束了只读快照的读事务，其余子请求不再执行")
+
+
+@router.post("")
+async def batch_requests(
+    batch: BatchRequest,
+    request: Request,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    批量执行 GET 请求
+
+    每个子请求的结果为 {"index", "id", "path", "status", "body"}，body 为子请求的原始响应。
+    stream=false 时返回 {"success": true, "data": {"results": [...]}}；
+    stream=true 时以 NDJSON 逐行返回，每个子请求完成后立即发送。
+    子请求各自认证（与本请求使用同一个令牌）和处理错误，单个子请求失败不影响其他子请求
+
+    Args:
+        batch: 批量请求（子请求路径、查询参数）
+        request: 原始请求（用于转发请求头）
+        current_user: 当前用户信息
+
+    Returns:
+        批量请求结果
+    """
+    logger.debug(f"用户 {current_user['user_id']} 批量请求 {len(batch.requests)} 个接口")
+
+    if batch.stream:
+        return StreamingResponse(
+            (line + b"\n" async for line in _run_batch(request, batch)),
+            media_type="application/x-ndjson"
+        )
+
+    results = [line async for line in _run_batch(request, batch)]
+    return JSONBytesResponse(
+        b'{"success":true,"message":' + dumps("批量请求完成") + b',"data":{"results":['
+        + b",".join(results)
+        + b"]}}"
+    )
@@ -14,10 +14,12 @@ from server.models import (
     EmployeeUpdate,
     EmployeeResponse,
     BaseResponse,
-    PaginationParams,
-    PaginatedResponse
+    PaginationParams
 )
+from server.serialization import paginated_response, streaming_paginated_response, project_columns
 from server.services.audit_log_service import AuditLogService
+from server.services.bulk_fetch_service import register_by_ids
+from server.services.response_cache_service import cached_response
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -27,10 +29,14 @@ router = APIRouter(prefix="/api/employees", tags=["员工管理"])
 
 
 @router.get("", response_model=BaseResponse)
-async def get_employees(
+@cached_response("employees")
+def get_employees(
     page: int = Query(1, ge=1, description="页码"),
     page_size: int = Query(20, ge=1, le=10000, description="每页数量（最大 10000）"),
     search: Optional[str] = Query(None, description="搜索关键词（员工名称或备注）"),
+    stream: bool = Query(False, description="流式返回（大分页时内存占用恒定，响应结构不变）"),
+    fields: Optional[str] = Query(None, description="只返回指定字段，逗号分隔（如：id,name）"),
+    response_format: str = Query("objects", alias="format", pattern="^(objects|columnar)$", description="响应格式：objects（对象数组）或 columnar（列名 + 值数组）"),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -40,6 +46,9 @@ async def get_employees(
         page: 页码
         page_size: 每页数量
         search: 搜索关键词
+        stream: 是否流式返回
+        fields: 只返回的字段
+        response_format: 响应格式
         current_user: 当前用户信息
     
     Returns:
@@ -47,6 +56,16 @@ async def get_employees(
     """
     pool = get_pool()
     user_id = current_user["user_id"]
+    columnar = response_format == "columnar"
+    
+    # 只查询需要的列
+    try:
+        columns = project_columns(fields, EmployeeResponse)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     
     try:
         with pool.get_connection() as conn:
@@ -71,46 +90,40 @@ async def get_employees(
             
             # 计算分页
             offset = (page - 1) * page_size
-            total_pages = (total + page_size - 1) // page_size
             
             # 获取员工列表
-            cursor = conn.execute(
-                f"""
-                SELECT id, userId, name, note, created_at, updated_at
+            query = f"""
+                SELECT {', '.join(columns)}
                 FROM employees
                 WHERE {where_clause}
                 ORDER BY updated_at DESC, name ASC
                 LIMIT ? OFFSET ?
-                """,
-                tuple(params) + (page_size, offset)
-            )
-            rows = cursor.fetchall()
-            
-            # 转换为响应模型
-            employees = []
-            for row in rows:
-                employee = EmployeeResponse(
-                    id=row[0],
-                    userId=row[1],
-                    name=row[2],
-                    note=row[3],
-                    created_at=row[4],
-                    updated_at=row[5]
+            """
+            query_params = tuple(params) + (page_size, offset)
+            
+            if stream:
+                # 流式返回：生成响应体时再获取连接，按批读取编码
+                return streaming_paginated_response(
+                    pool,
+                    query,
+                    query_params,
+                    EmployeeResponse,
+                    total=total,
+                    page=page,
+                    page_size=page_size,
+                    message="获取员工列表成功",
+                    columnar=columnar
                 )
-                employees.append(employee.model_dump())
             
-            paginated_data = PaginatedResponse(
-                items=employees,
+            # 直接编码为 JSON 响应体（跳过逐行的 Pydantic 校验）
+            return paginated_response(
+                conn.execute(query, query_params),
+                EmployeeResponse,
                 total=total,
                 page=page,
                 page_size=page_size,
-                total_pages=total_pages
-            )
-            
-            return BaseResponse(
-                success=True,
                 message="获取员工列表成功",
-                data=paginated_data.model_dump()
+                columnar=columnar
             )
             
     except Exception as e:
@@ -122,7 +135,8 @@ async def get_employees(
 
 
 @router.get("/all", response_model=BaseResponse)
-async def get_all_employees(
+@cached_response("employees")
+def get_all_employees(
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -176,6 +190,10 @@ async def get_all_employees(
         )
 
 
+# GET/POST /by-ids（须在 /{employee_id} 之前注册）
+register_by_ids(router, "employees", EmployeeResponse, "员工")
+
+
 @router.get("/{employee_id}", response_model=BaseResponse)
 async def get_employee(
     employee_id: int,
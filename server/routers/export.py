@@ -0,0 +1,58 @@
+"""
+数据导出路由
+以 NDJSON 流的形式导出用户的全部业务数据
+"""
+
+import logging
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, Query
+from fastapi.responses import StreamingResponse
+
+from server.database import get_pool
+from server.middleware import get_current_user
+from server.services.data_export_service import export_user_data
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 创建路由
+router = APIRouter(prefix="/api/export", tags=["数据导出"])
+
+
+@router.get("")
+async def export_data(
+    compress: bool = Query(True, description="是否 gzip 压缩（Content-Encoding: gzip，客户端的 Accept-Encoding 包含 gzip 时才压缩）"),
+    accept_encoding: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    导出当前用户的全部业务数据（NDJSON 流）
+
+    第一行为 {"exportInfo": {...}}，之后每行一条记录 {"table": "...", "data": {...}}，
+    最后一行为 {"exportEnd": {"counts": {...}}}。
+    表的顺序与导入顺序一致，响应体可直接提交给 POST /api/settings/import-data/stream。
+
+    Args:
+        compress: 是否 gzip 压缩
+        accept_encoding: 客户端接受的编码（不包含 gzip 时不压缩）
+        current_user: 当前用户信息
+
+    Returns:
+        NDJSON 流式响应
+    """
+    user_id = current_user["user_id"]
+    username = current_user.get("username", "unknown")
+
+    filename = f"export_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    # 与 GZipMiddleware 相同，按 Accept-Encoding 是否包含 gzip 判断
+    compress = compress and "gzip" in (accept_encoding or "")
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+
+    return StreamingResponse(
+        export_user_data(get_pool(), user_id, username, compress=compress),
+        media_type="application/x-ndjson",
+        headers=headers
+    )
@@ -15,10 +15,12 @@ from server.models import (
     IncomeResponse,
     BaseResponse,
     PaginationParams,
-    PaginatedResponse,
     DateRangeFilter
 )
+from server.serialization import paginated_response, streaming_paginated_response, project_columns
 from server.services.audit_log_service import AuditLogService
+from server.services.bulk_fetch_service import register_by_ids
+from server.services.response_cache_service import cached_response
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -28,13 +30,17 @@ router = APIRouter(prefix="/api/income", tags=["进账管理"])
 
 
 @router.get("", response_model=BaseResponse)
-async def get_income_records(
+@cached_response("income")
+def get_income_records(
     page: int = Query(1, ge=1, description="页码"),
     page_size: int = Query(20, ge=1, le=10000, description="每页数量（最大 10000）"),
     search: Optional[str] = Query(None, description="搜索关键词（备注）"),
     start_date: Optional[str] = Query(None, description="开始日期（ISO8601格式）"),
     end_date: Optional[str] = Query(None, description="结束日期（ISO8601格式）"),
     customer_id: Optional[int] = Query(None, description="客户ID筛选"),
+    stream: bool = Query(False, description="流式返回（大分页时内存占用恒定，响应结构不变）"),
+    fields: Optional[str] = Query(None, description="只返回指定字段，逗号分隔（如：id,name）"),
+    response_format: str = Query("objects", alias="format", pattern="^(objects|columnar)$", description="响应格式：objects（对象数组）或 columnar（列名 + 值数组）"),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -47,6 +53,9 @@ async def get_income_records(
         start_date: 开始日期
         end_date: 结束日期
         customer_id: 客户ID筛选
+        stream: 是否流式返回
+        fields: 只返回的字段
+        response_format: 响应格式
         current_user: 当前用户信息
     
     Returns:
@@ -54,6 +63,16 @@ async def get_income_records(
     """
     pool = get_pool()
     user_id = current_user["user_id"]
+    columnar = response_format == "columnar"
+    
+    # 只查询需要的列
+    try:
+        columns = project_columns(fields, IncomeResponse)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     
     try:
         with pool.get_connection() as conn:
@@ -94,51 +113,40 @@ async def get_income_records(
             
             # 计算分页
             offset = (page - 1) * page_size
-            total_pages = (total + page_size - 1) // page_size
             
             # 获取进账记录列表
-            cursor = conn.execute(
-                f"""
-                SELECT id, userId, incomeDate, customerId, amount, discount, employeeId,
-                       paymentMethod, note, created_at
+            query = f"""
+                SELECT {', '.join(columns)}
                 FROM income
                 WHERE {where_clause}
                 ORDER BY incomeDate DESC, id DESC
                 LIMIT ? OFFSET ?
-                """,
-                tuple(params) + (page_size, offset)
-            )
-            rows = cursor.fetchall()
-            
-            # 转换为响应模型
-            income_records = []
-            for row in rows:
-                income = IncomeResponse(
-                    id=row[0],
-                    userId=row[1],
-                    incomeDate=row[2],
-                    customerId=row[3],
-                    amount=row[4],
-                    discount=row[5] if row[5] else 0.0,
-                    employeeId=row[6],
-                    paymentMethod=row[7],
-                    note=row[8],
-                    created_at=row[9]
+            """
+            query_params = tuple(params) + (page_size, offset)
+            
+            if stream:
+                # 流式返回：生成响应体时再获取连接，按批读取编码
+                return streaming_paginated_response(
+                    pool,
+                    query,
+                    query_params,
+                    IncomeResponse,
+                    total=total,
+                    page=page,
+                    page_size=page_size,
+                    message="获取进账记录列表成功",
+                    columnar=columnar
                 )
-                income_records.append(income.model_dump())
             
-            paginated_data = PaginatedResponse(
-                items=income_records,
+            # 直接编码为 JSON 响应体（跳过逐行的 Pydantic 校验）
+            return paginated_response(
+                conn.execute(query, query_params),
+                IncomeResponse,
                 total=total,
                 page=page,
                 page_size=page_size,
-                total_pages=total_pages
-            )
-            
-            return BaseResponse(
-                success=True,
                 message="获取进账记录列表成功",
-                data=paginated_data.model_dump()
+                columnar=columnar
             )
             
     except Exception as e:
@@ -149,6 +157,10 @@ async def get_income_records(
         )
 
 
+# GET/POST /by-ids（须在 /{income_id} 之前注册）
+register_by_ids(router, "income", IncomeResponse, "进账记录")
+
+
 @router.get("/{income_id}", response_model=BaseResponse)
 async def get_income_record(
     income_id: int,
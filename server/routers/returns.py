@@ -13,12 +13,20 @@ from server.models import (
     ReturnCreate,
     ReturnUpdate,
     ReturnResponse,
+    ReturnBatchCreate,
     BaseResponse,
     PaginationParams,
-    PaginatedResponse,
     DateRangeFilter
 )
+from server.serialization import paginated_response, streaming_paginated_response, project_columns
 from server.services.audit_log_service import AuditLogService
+from server.services.bulk_fetch_service import register_by_ids
+from server.services.response_cache_service import cached_response
+from server.services.stock_batch_service import (
+    create_stock_records,
+    BatchValidationError,
+    BatchConflictError
+)
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -28,13 +36,17 @@ router = APIRouter(prefix="/api/returns", tags=["退货管理"])
 
 
 @router.get("", response_model=BaseResponse)
-async def get_returns(
+@cached_response("returns")
+def get_returns(
     page: int = Query(1, ge=1, description="页码"),
     page_size: int = Query(20, ge=1, le=10000, description="每页数量（最大 10000）"),
     search: Optional[str] = Query(None, description="搜索关键词（产品名称）"),
     start_date: Optional[str] = Query(None, description="开始日期（ISO8601格式）"),
     end_date: Optional[str] = Query(None, description="结束日期（ISO8601格式）"),
     customer_id: Optional[int] = Query(None, description="客户ID筛选"),
+    stream: bool = Query(False, description="流式返回（大分页时内存占用恒定，响应结构不变）"),
+    fields: Optional[str] = Query(None, description="只返回指定字段，逗号分隔（如：id,name）"),
+    response_format: str = Query("objects", alias="format", pattern="^(objects|columnar)$", description="响应格式：objects（对象数组）或 columnar（列名 + 值数组）"),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -47,6 +59,9 @@ async def get_returns(
         start_date: 开始日期
         end_date: 结束日期
         customer_id: 客户ID筛选
+        stream: 是否流式返回
+        fields: 只返回的字段
+        response_format: 响应格式
         current_user: 当前用户信息
     
     Returns:
@@ -54,6 +69,16 @@ async def get_returns(
     """
     pool = get_pool()
     user_id = current_user["user_id"]
+    columnar = response_format == "columnar"
+    
+    # 只查询需要的列
+    try:
+        columns = project_columns(fields, ReturnResponse)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     
     try:
         with pool.get_connection() as conn:
@@ -94,50 +119,40 @@ async def get_returns(
             
             # 计算分页
             offset = (page - 1) * page_size
-            total_pages = (total + page_size - 1) // page_size
             
             # 获取退货记录列表
-            cursor = conn.execute(
-                f"""
-                SELECT id, userId, productName, quantity, customerId, returnDate,
-                       totalReturnPrice, note, created_at
+            query = f"""
+                SELECT {', '.join(columns)}
                 FROM returns
                 WHERE {where_clause}
                 ORDER BY returnDate DESC, id DESC
                 LIMIT ? OFFSET ?
-                """,
-                tuple(params) + (page_size, offset)
-            )
-            rows = cursor.fetchall()
-            
-            # 转换为响应模型
-            returns = []
-            for row in rows:
-                return_record = ReturnResponse(
-                    id=row[0],
-                    userId=row[1],
-                    productName=row[2],
-                    quantity=row[3],
-                    customerId=row[4],
-                    returnDate=row[5],
-                    totalReturnPrice=row[6],
-                    note=row[7],
-                    created_at=row[8]
+            """
+            query_params = tuple(params) + (page_size, offset)
+            
+            if stream:
+                # 流式返回：生成响应体时再获取连接，按批读取编码
+                return streaming_paginated_response(
+                    pool,
+                    query,
+                    query_params,
+                    ReturnResponse,
+                    total=total,
+                    page=page,
+                    page_size=page_size,
+                    message="获取退货记录列表成功",
+                    columnar=columnar
                 )
-                returns.append(return_record.model_dump())
             
-            paginated_data = PaginatedResponse(
-                items=returns,
+            # 直接编码为 JSON 响应体（跳过逐行的 Pydantic 校验）
+            return paginated_response(
+                conn.execute(query, query_params),
+                ReturnResponse,
                 total=total,
                 page=page,
                 page_size=page_size,
-                total_pages=total_pages
-            )
-            
-            return BaseResponse(
-                success=True,
                 message="获取退货记录列表成功",
-                data=paginated_data.model_dump()
+                columnar=columnar
             )
             
     except Exception as e:
@@ -148,6 +163,10 @@ async def get_returns(
         )
 
 
+# GET/POST /by-ids（须在 /{return_id} 之前注册）
+register_by_ids(router, "returns", ReturnResponse, "退货记录")
+
+
 @router.get("/{return_id}", response_model=BaseResponse)
 async def get_return(
     return_id: int,
@@ -378,6 +397,91 @@ async def create_return(
         )
 
 
+@router.post("/batch", response_model=BaseResponse, status_code=status.HTTP_201_CREATED)
+async def create_returns_batch(
+    batch_data: ReturnBatchCreate,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    批量创建退货记录（全部成功或全部失败）
+    
+    退货时会自动增加产品库存。
+    所有行在同一个事务中校验、插入并更新库存，任意一行失败则整批回滚，
+    并返回每一行的错误信息（index 为请求中的行号，从 0 开始）
+    
+    Args:
+        batch_data: 批量退货数据
+        current_user: 当前用户信息
+    
+    Returns:
+        创建的退货记录列表
+    """
+    pool = get_pool()
+    user_id = current_user["user_id"]
+    
+    try:
+        with pool.get_connection() as conn:
+            created = create_stock_records(
+                conn,
+                user_id,
+                "return",
+                [item.model_dump() for item in batch_data.items]
+            )
+        
+        returns = [ReturnResponse(**row).model_dump() for row in created]
+        
+        # 记录操作日志（一次写入所有行）
+        try:
+            AuditLogService.log_create_many(
+                user_id=user_id,
+                username=current_user.get("username", "unknown"),
+                entity_type="return",
+                records=[
+                    (item["id"], f"{item['productName']} (数量: {item['quantity']})", item)
+                    for item in returns
+                ]
+            )
+        except Exception as e:
+            logger.warning(f"记录退货批量创建日志失败: {e}")
+        
+        return BaseResponse(
+            success=True,
+            message=f"批量创建退货记录成功，共 {len(returns)} 条",
+            data={
+                "items": returns,
+                "count": len(returns)
+            }
+        )
+        
+    except BatchValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={
+                "message": f"批量创建退货记录失败，{len(e.errors)} 行校验未通过",
+                "errors": e.errors
+            }
+        )
+    except BatchConflictError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+    except HTTPException:
+        raise
+    except DatabaseBusyError as e:
+        logger.warning(f"批量创建退货记录时数据库繁忙: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="数据库暂时繁忙，请稍后重试"
+        )
+    except Exception as e:
+        logger.error(f"批量创建退货记录失败: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"批量创建退货记录失败: {str(e)}"
+        )
+
+
 @router.put("/{return_id}", response_model=BaseResponse)
 async def update_return(
     return_id: int,
@@ -4,7 +4,8 @@
 """
 
 import logging
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request
+from fastapi.concurrency import run_in_threadpool
 
 from server.database import get_pool
 from server.middleware import get_current_user
@@ -14,6 +15,15 @@ from server.models import (
     BaseResponse,
     ImportDataRequest
 )
+from server.services.data_import_service import (
+    DataImporter,
+    DataImportError,
+    NDJSONParser,
+    DEFAULT_CHUNK_SIZE,
+    start_import_progress,
+    finish_import_progress,
+    get_import_progress
+)
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -272,6 +282,31 @@ async def update_user_settings(
         )
 
 
+def _import_result(user_id: int, counts: dict) -> BaseResponse:
+    """生成导入成功的响应（包含各表行数与导入耗时）"""
+    progress = get_import_progress(user_id) or {}
+    
+    logger.info(
+        f"数据导入成功: 用户 {user_id}, 供应商: {counts['suppliers']}, 客户: {counts['customers']}, "
+        f"员工: {counts['employees']}, 产品: {counts['products']}, 采购: {counts['purchases']}, "
+        f"销售: {counts['sales']}, 退货: {counts['returns']}, 进账: {counts['income']}, "
+        f"汇款: {counts['remittance']}, 耗时: {progress.get('elapsed_seconds')}秒, "
+        f"持锁: {progress.get('lock_hold_ms')}毫秒"
+    )
+    
+    return BaseResponse(
+        success=True,
+        message="数据导入成功",
+        data={
+            "counts": counts,
+            "rows": sum(counts.values()),
+            "elapsed_seconds": progress.get("elapsed_seconds"),
+            "rows_per_second": progress.get("rows_per_second"),
+            "lock_hold_ms": progress.get("lock_hold_ms")
+        }
+    )
+
+
 @router.post("/import-data", response_model=BaseResponse)
 async def import_data(
     import_request: ImportDataRequest,
@@ -292,323 +327,136 @@ async def import_data(
     """
     pool = get_pool()
     user_id = current_user["user_id"]
+    progress = start_import_progress(user_id)
     
     try:
         with pool.get_connection() as conn:
-            # 在事务中执行数据导入
-            conn.execute("BEGIN")
+            importer = DataImporter(conn, user_id, progress=progress)
+            # 数据库写入放到线程池中执行，避免阻塞事件循环
+            await run_in_threadpool(importer.begin)
             
             try:
-                # 1. 删除当前用户的所有业务数据（不包括 user_settings）
-                conn.execute("DELETE FROM remittance WHERE userId = ?", (user_id,))
-                conn.execute("DELETE FROM income WHERE userId = ?", (user_id,))
-                conn.execute("DELETE FROM returns WHERE userId = ?", (user_id,))
-                conn.execute("DELETE FROM sales WHERE userId = ?", (user_id,))
-                conn.execute("DELETE FROM purchases WHERE userId = ?", (user_id,))
-                conn.execute("DELETE FROM products WHERE userId = ?", (user_id,))
-                conn.execute("DELETE FROM employees WHERE userId = ?", (user_id,))
-                conn.execute("DELETE FROM customers WHERE userId = ?", (user_id,))
-                conn.execute("DELETE FROM suppliers WHERE userId = ?", (user_id,))
-                
-                # 2. 创建 ID 映射表（旧ID -> 新ID）
-                supplier_id_map = {}
-                customer_id_map = {}
-                employee_id_map = {}
-                product_id_map = {}
-                
-                data = import_request.data
-                
-                # 3. 导入 suppliers
-                supplier_count = 0
-                if 'suppliers' in data and data['suppliers']:
-                    for supplier_data in data['suppliers']:
-                        original_id = supplier_data.get('id')
-                        supplier_dict = {
-                            'name': supplier_data.get('name', ''),
-                            'note': supplier_data.get('note')
-                        }
-                        cursor = conn.execute(
-                            """
-                            INSERT INTO suppliers (userId, name, note, created_at, updated_at)
-                            VALUES (?, ?, ?, datetime('now'), datetime('now'))
-                            """,
-                            (user_id, supplier_dict['name'], supplier_dict['note'])
-                        )
-                        new_id = cursor.lastrowid
-                        if original_id:
-                            supplier_id_map[original_id] = new_id
-                        supplier_count += 1
-                
-                # 4. 导入 customers
-                customer_count = 0
-                if 'customers' in data and data['customers']:
-                    for customer_data in data['customers']:
-                        original_id = customer_data.get('id')
-                        customer_dict = {
-                            'name': customer_data.get('name', ''),
-                            'note': customer_data.get('note')
-                        }
-                        cursor = conn.execute(
-                            """
-                            INSERT INTO customers (userId, name, note, created_at, updated_at)
-                            VALUES (?, ?, ?, datetime('now'), datetime('now'))
-                            """,
-                            (user_id, customer_dict['name'], customer_dict['note'])
-                        )
-                        new_id = cursor.lastrowid
-                        if original_id:
-                            customer_id_map[original_id] = new_id
-                        customer_count += 1
-                
-                # 5. 导入 employees
-                employee_count = 0
-                if 'employees' in data and data['employees']:
-                    for employee_data in data['employees']:
-                        original_id = employee_data.get('id')
-                        employee_dict = {
-                            'name': employee_data.get('name', ''),
-                            'note': employee_data.get('note')
-                        }
-                        cursor = conn.execute(
-                            """
-                            INSERT INTO employees (userId, name, note, created_at, updated_at)
-                            VALUES (?, ?, ?, datetime('now'), datetime('now'))
-                            """,
-                            (user_id, employee_dict['name'], employee_dict['note'])
-                        )
-                        new_id = cursor.lastrowid
-                        if original_id:
-                            employee_id_map[original_id] = new_id
-                        employee_count += 1
-                
-                # 6. 导入 products
-                product_count = 0
-                if 'products' in data and data['products']:
-                    for product_data in data['products']:
-                        original_id = product_data.get('id')
-                        # 处理 supplierId 映射
-                        supplier_id = product_data.get('supplierId')
-                        if supplier_id and supplier_id in supplier_id_map:
-                            supplier_id = supplier_id_map[supplier_id]
-                        elif supplier_id and supplier_id not in supplier_id_map:
-                            supplier_id = None
-                        
-                        # 处理 unit（可能是字符串或已经是正确的值）
-                        unit = product_data.get('unit', '公斤')
-                        if isinstance(unit, str):
-                            # 确保单位值正确
-                            if unit not in ['斤', '公斤', '袋']:
-                                unit = '公斤'
-                        
-                        cursor = conn.execute(
-                            """
-                            INSERT INTO products (userId, name, description, stock, unit, supplierId, version, created_at, updated_at)
-                            VALUES (?, ?, ?, ?, ?, ?, 1, datetime('now'), datetime('now'))
-                            """,
-                            (
-                                user_id,
-                                product_data.get('name', ''),
-                                product_data.get('description'),
-                                product_data.get('stock', 0),
-                                unit,
-                                supplier_id
-                            )
-                        )
-                        new_id = cursor.lastrowid
-                        if original_id:
-                            product_id_map[original_id] = new_id
-                        product_count += 1
-                
-                # 7. 导入 purchases
-                purchase_count = 0
-                if 'purchases' in data and data['purchases']:
-                    for purchase_data in data['purchases']:
-                        # 处理 supplierId 映射
-                        # 如果 supplierId 为 0 或 None，表示未分配供应商，设置为 None
-                        supplier_id = purchase_data.get('supplierId')
-                        if supplier_id == 0:
-                            supplier_id = None
-                        elif supplier_id and supplier_id in supplier_id_map:
-                            supplier_id = supplier_id_map[supplier_id]
-                        elif supplier_id and supplier_id not in supplier_id_map:
-                            supplier_id = None
-                        
-                        cursor = conn.execute(
-                            """
-                            INSERT INTO purchases (userId, productName, quantity, purchaseDate, supplierId, totalPurchasePrice, note, created_at)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'))
-                            """,
-                            (
-                                user_id,
-                                purchase_data.get('productName', ''),
-                                purchase_data.get('quantity', 0),
-                                purchase_data.get('purchaseDate'),
-                                supplier_id,
-                                purchase_data.get('totalPurchasePrice'),
-                                purchase_data.get('note')
-                            )
-                        )
-                        purchase_count += 1
-                
-                # 8. 导入 sales
-                sale_count = 0
-                if 'sales' in data and data['sales']:
-                    for sale_data in data['sales']:
-                        # 处理 customerId 映射
-                        customer_id = sale_data.get('customerId')
-                        if customer_id and customer_id in customer_id_map:
-                            customer_id = customer_id_map[customer_id]
-                        elif customer_id and customer_id not in customer_id_map:
-                            customer_id = None
-                        
-                        cursor = conn.execute(
-                            """
-                            INSERT INTO sales (userId, productName, quantity, saleDate, customerId, totalSalePrice, note, created_at)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'))
-                            """,
-                            (
-                                user_id,
-                                sale_data.get('productName', ''),
-                                sale_data.get('quantity', 0),
-                                sale_data.get('saleDate'),
-                                customer_id,
-                                sale_data.get('totalSalePrice'),
-                                sale_data.get('note')
-                            )
-                        )
-                        sale_count += 1
-                
-                # 9. 导入 returns
-                return_count = 0
-                if 'returns' in data and data['returns']:
-                    for return_data in data['returns']:
-                        # 处理 customerId 映射
-                        customer_id = return_data.get('customerId')
-                        if customer_id and customer_id in customer_id_map:
-                            customer_id = customer_id_map[customer_id]
-                        elif customer_id and customer_id not in customer_id_map:
-                            customer_id = None
-                        
-                        cursor = conn.execute(
-                            """
-                            INSERT INTO returns (userId, productName, quantity, returnDate, customerId, totalReturnPrice, note, created_at)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'))
-                            """,
-                            (
-                                user_id,
-                                return_data.get('productName', ''),
-                                return_data.get('quantity', 0),
-                                return_data.get('returnDate'),
-                                customer_id,
-                                return_data.get('totalReturnPrice'),
-                                return_data.get('note')
-                            )
-                        )
-                        return_count += 1
-                
-                # 10. 导入 income
-                income_count = 0
-                if 'income' in data and data['income']:
-                    for income_data in data['income']:
-                        # 处理 customerId 和 employeeId 映射
-                        customer_id = income_data.get('customerId')
-                        if customer_id and customer_id in customer_id_map:
-                            customer_id = customer_id_map[customer_id]
-                        elif customer_id and customer_id not in customer_id_map:
-                            customer_id = None
-                        
-                        employee_id = income_data.get('employeeId')
-                        if employee_id and employee_id in employee_id_map:
-                            employee_id = employee_id_map[employee_id]
-                        elif employee_id and employee_id not in employee_id_map:
-                            employee_id = None
-                        
-                        cursor = conn.execute(
-                            """
-                            INSERT INTO income (userId, incomeDate, customerId, amount, discount, employeeId, paymentMethod, note, created_at)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))
-                            """,
-                            (
-                                user_id,
-                                income_data.get('incomeDate'),
-                                customer_id,
-                                income_data.get('amount', 0),
-                                income_data.get('discount', 0),
-                                employee_id,
-                                income_data.get('paymentMethod', '现金'),
-                                income_data.get('note')
-                            )
-                        )
-                        income_count += 1
-                
-                # 11. 导入 remittance
-                remittance_count = 0
-                if 'remittance' in data and data['remittance']:
-                    for remittance_data in data['remittance']:
-                        # 处理 supplierId 和 employeeId 映射
-                        supplier_id = remittance_data.get('supplierId')
-                        if supplier_id and supplier_id in supplier_id_map:
-                            supplier_id = supplier_id_map[supplier_id]
-                        elif supplier_id and supplier_id not in supplier_id_map:
-                            supplier_id = None
-                        
-                        employee_id = remittance_data.get('employeeId')
-                        if employee_id and employee_id in employee_id_map:
-                            employee_id = employee_id_map[employee_id]
-                        elif employee_id and employee_id not in employee_id_map:
-                            employee_id = None
-                        
-                        cursor = conn.execute(
-                            """
-                            INSERT INTO remittance (userId, remittanceDate, supplierId, amount, employeeId, paymentMethod, note, created_at)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'))
-                            """,
-                            (
-                                user_id,
-                                remittance_data.get('remittanceDate'),
-                                supplier_id,
-                                remittance_data.get('amount', 0),
-                                employee_id,
-                                remittance_data.get('paymentMethod', '现金'),
-                                remittance_data.get('note')
-                            )
-                        )
-                        remittance_count += 1
-                
-                # 提交事务
-                conn.execute("COMMIT")
-                
-                logger.info(f"数据导入成功: 用户 {user_id}, 供应商: {supplier_count}, 客户: {customer_count}, 员工: {employee_count}, 产品: {product_count}, 采购: {purchase_count}, 销售: {sale_count}, 退货: {return_count}, 进账: {income_count}, 汇款: {remittance_count}")
-                
-                return BaseResponse(
-                    success=True,
-                    message="数据导入成功",
-                    data={
-                        "counts": {
-                            "suppliers": supplier_count,
-                            "customers": customer_count,
-                            "employees": employee_count,
-                            "products": product_count,
-                            "purchases": purchase_count,
-                            "sales": sale_count,
-                            "returns": return_count,
-                            "income": income_count,
-                            "remittance": remittance_count
-                        }
-                    }
-                )
-                
+                await run_in_threadpool(importer.add_export, import_request.data)
+                counts = await run_in_threadpool(importer.finish)
             except Exception as e:
                 # 回滚事务
-                conn.execute("ROLLBACK")
+                importer.abort()
                 raise e
-                
+        
+        finish_import_progress(progress)
+        return _import_result(user_id, counts)
+        
+    except DataImportError as e:
+        finish_import_progress(progress, str(e))
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"数据导入失败: {str(e)}"
+        )
     except HTTPException:
         raise
     except Exception as e:
+        finish_import_progress(progress, str(e))
         logger.error(f"数据导入失败: {e}", exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"数据导入失败: {str(e)}"
         )
 
+
+@router.post("/import-data/stream", response_model=BaseResponse)
+async def import_data_stream(
+    request: Request,
+    chunk_size: int = Query(DEFAULT_CHUNK_SIZE, ge=100, le=50000, description="每次批量写入的行数"),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    流式批量导入数据（覆盖模式）
+    
+    请求体为 NDJSON（application/x-ndjson，可使用 Content-Encoding: gzip），
+    每行一条记录：{"table": "suppliers", "data": {...}}，可选首行 {"exportInfo": {...}}。
+    表必须按 suppliers、customers、employees、products、purchases、sales、returns、
+    income、remittance 的顺序出现，以便完成 ID 映射。
+    
+    请求体边接收边解析，按 chunk_size 分块写入临时暂存库（不占用主库写锁），
+    全部接收并校验后再用一个短事务替换旧数据，导入进度可通过
+    GET /api/settings/import-data/progress 查询。
+    
+    Args:
+        request: 请求对象（读取原始请求体）
+        chunk_size: 每次批量写入的行数
+        current_user: 当前用户信息
+    
+    Returns:
+        导入结果统计
+    """
+    pool = get_pool()
+    user_id = current_user["user_id"]
+    progress = start_import_progress(user_id)
+    parser = NDJSONParser(gzip=request.headers.get("content-encoding", "").lower() == "gzip")
+    
+    try:
+        with pool.get_connection() as conn:
+            importer = DataImporter(conn, user_id, chunk_size=chunk_size, progress=progress)
+            await run_in_threadpool(importer.begin)
+            
+            try:
+                async for chunk in request.stream():
+                    progress["bytes_received"] += len(chunk)
+                    items = parser.feed(chunk)
+                    if items:
+                        # 数据库写入放到线程池中执行，避免阻塞事件循环
+                        await run_in_threadpool(importer.add_many, items)
+                
+                await run_in_threadpool(importer.add_many, parser.close())
+                counts = await run_in_threadpool(importer.finish)
+            except Exception as e:
+                # 回滚事务
+                importer.abort()
+                raise e
+        
+        finish_import_progress(progress)
+        return _import_result(user_id, counts)
+        
+    except DataImportError as e:
+        finish_import_progress(progress, str(e))
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"数据导入失败: {str(e)}"
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        finish_import_progress(progress, str(e))
+        logger.error(f"流式数据导入失败: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"数据导入失败: {str(e)}"
+        )
+
+
+@router.get("/import-data/progress", response_model=BaseResponse)
+async def get_import_data_progress(
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    获取最近一次数据导入的进度
+    
+    Args:
+        current_user: 当前用户信息
+    
+    Returns:
+        导入进度（状态、当前表、已导入行数、各表行数、耗时、速度）
+    """
+    progress = get_import_progress(current_user["user_id"])
+    
+    if progress is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="没有导入记录"
+        )
+    
+    return BaseResponse(
+        success=True,
+        message="获取导入进度成功",
+        data=progress
+    )
@@ -0,0 +1,323 @@
+"""
+列表响应序列化
+列表接口的快速路径：把 sqlite3 查询结果直接编码为 JSON 响应体，
+不再为每一行构建 Pydantic 模型、model_dump()，再由 PaginatedResponse/BaseResponse 校验一遍。
+数据来自数据库，只按响应模型做类型对齐（整数值的 float 字段转为 float、空值使用默认值），
+输出与原来的 BaseResponse(PaginatedResponse(...)) 完全一致。
+
+大分页可使用流式响应：按 fetchmany 分批读取并编码，响应体分块发送，
+内存占用与行数无关，响应结构与普通分页响应相同
+
+列表接口支持 fields= 只查询部分列，以及列式格式（format=columnar）：
+data 中以 columns（列名）和 rows（每行一个值数组）代替 items，不再逐行重复键名
+
+安装了 orjson 时使用 orjson 编码，否则使用标准库 json（C 加速的编码器）
+"""
+
+import json
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, Optional, Sequence, Tuple, Type
+
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel
+
+from server.tracing import span
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson 为可选依赖
+    orjson = None
+
+# 流式响应每次 fetchmany 读取的行数
+STREAM_FETCH_SIZE = 1000
+
+# 流式响应的输出块大小（字节），攒够后再交给响应发送
+STREAM_FLUSH_BYTES = 64 * 1024
+
+
+def dumps(obj: Any) -> bytes:
+    """编码为 UTF-8 JSON（紧凑格式，不转义非 ASCII 字符）"""
+    with span("serialize"):
+        if orjson is not None:
+            return orjson.dumps(obj)
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class JSONBytesResponse(Response):
+    """内容已编码为 JSON 字节的响应（content 为 bytes 时原样发送）"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
+
+
+def _is_float_field(annotation) -> bool:
+    if annotation is float:
+        return True
+    return float in getattr(annotation, "__args__", ())
+
+
+class RowEncoder:
+    """
+    将查询结果行转换为与响应模型 model_dump() 一致的字典（或值数组）
+
+    只处理数据库值与模型类型不一致的两种情况：
+    float 字段中以整数保存的值（Pydantic 会转为 float），以及空值字段的默认值
+    """
+
+    def __init__(self, model: Type[BaseModel], columns: Sequence[str]):
+        self.columns = tuple(columns)
+        fields = model.model_fields
+        self.float_indexes = tuple(
+            index for index, column in enumerate(self.columns)
+            if column in fields and _is_float_field(fields[column].annotation)
+        )
+        self.defaults = tuple(
+            (index, fields[column].default)
+            for index, column in enumerate(self.columns)
+            if column in fields and fields[column].default is not None
+            and not fields[column].is_required()
+        )
+
+    def values(self, row) -> list:
+        """按列顺序返回一行的值"""
+        values = list(row)
+        for index, default in self.defaults:
+            if not values[index]:
+                values[index] = default
+        for index in self.float_indexes:
+            if type(values[index]) is int:
+                values[index] = float(values[index])
+        return values
+
+    def __call__(self, row) -> Dict[str, Any]:
+        return dict(zip(self.columns, self.values(row)))
+
+
+@lru_cache(maxsize=128)
+def get_row_encoder(model: Type[BaseModel], columns: Tuple[str, ...]) -> RowEncoder:
+    """获取（缓存的）行编码器"""
+    return RowEncoder(model, columns)
+
+
+def project_columns(fields: Optional[str], model: Type[BaseModel]) -> Tuple[str, ...]:
+    """
+    解析 fields 参数，返回要查询的列
+
+    Args:
+        fields: 逗号分隔的字段名（为空时返回模型的全部字段）
+        model: 列表项的响应模型（字段与表的列同名）
+
+    Returns:
+        列名元组（按请求的顺序，已去重）
+
+    Raises:
+        ValueError: 包含模型中不存在的字段
+    """
+    all_columns = tuple(model.model_fields)
+    if not fields:
+        return all_columns
+
+    columns = []
+    for name in fields.split(","):
+        name = name.strip()
+        if not name or name in columns:
+            continue
+        if name not in model.model_fields:
+            raise ValueError(f"无效的字段: {name}，可选字段: {', '.join(all_columns)}")
+        columns.append(name)
+    return tuple(columns) or all_columns
+
+
+def cursor_columns(cursor) -> Tuple[str, ...]:
+    """查询结果的列名"""
+    return tuple(column[0] for column in cursor.description)
+
+
+def encode_rows(cursor, model: Type[BaseModel], rows: Optional[Iterable] = None) -> list:
+    """
+    将查询结果转换为字典列表
+
+    Args:
+        cursor: 已执行查询的游标
+        model: 响应模型（用于类型对齐）
+        rows: 已读取的行（为 None 时从游标读取全部）
+    """
+    encoder = get_row_encoder(model, cursor_columns(cursor))
+    if rows is None:
+        rows = cursor.fetchall()
+    with span("serialize"):
+        return [encoder(row) for row in rows]
+
+
+def paginated_response(
+    cursor,
+    model: Type[BaseModel],
+    total: int,
+    page: int,
+    page_size: int,
+    message: str = "操作成功",
+    columnar: bool = False
+) -> JSONBytesResponse:
+    """
+    构建分页列表响应（结构与 BaseResponse(data=PaginatedResponse) 相同）
+
+    Args:
+        cursor: 已执行分页查询的游标
+        model: 列表项的响应模型
+        total: 总数
+        page: 页码
+        page_size: 每页数量
+        message: 响应消息
+        columnar: 是否使用列式格式（columns + rows 代替 items）
+    """
+    if columnar:
+        encoder = get_row_encoder(model, cursor_columns(cursor))
+        rows = cursor.fetchall()
+        with span("serialize"):
+            data = {
+                "columns": list(encoder.columns),
+                "rows": [encoder.values(row) for row in rows],
+            }
+    else:
+        data = {"items": encode_rows(cursor, model)}
+    data.update({
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "total_pages": (total + page_size - 1) // page_size,
+    })
+    body = {
+        "success": True,
+        "message": message,
+        "data": data,
+    }
+    return JSONBytesResponse(dumps(body))
+
+
+def _paginated_envelope(
+    total: int,
+    page: int,
+    page_size: int,
+    message: str,
+    columns: Optional[Sequence[str]] = None
+) -> Tuple[bytes, bytes]:
+    """
+    分页响应在列表数组前后的部分（键顺序与 BaseResponse/PaginatedResponse 一致）
+
+    Args:
+        columns: 列式格式的列名（为 None 时使用 items 格式）
+    """
+    prefix = b'{"success":true,"message":' + dumps(message) + b',"data":{'
+    if columns is None:
+        prefix += b'"items":['
+    else:
+        prefix += b'"columns":' + dumps(list(columns)) + b',"rows":['
+    suffix = (
+        b'],"total":' + dumps(total)
+        + b',"page":' + dumps(page)
+        + b',"page_size":' + dumps(page_size)
+        + b',"total_pages":' + dumps((total + page_size - 1) // page_size)
+        + b'}}'
+    )
+    return prefix, suffix
+
+
+def iter_paginated_chunks(
+    pool,
+    query: str,
+    params: tuple,
+    model: Type[BaseModel],
+    total: int,
+    page: int,
+    page_size: int,
+    message: str = "操作成功",
+    columnar: bool = False,
+    fetch_size: int = STREAM_FETCH_SIZE
+) -> Iterator[bytes]:
+    """
+    按批读取查询结果并逐块生成分页响应体
+
+    连接在开始读取时才从连接池获取，最后一批读完立即归还（不等待响应发送完毕）
+
+    Args:
+        pool: 数据库连接池
+        query: 分页查询 SQL
+        params: 查询参数
+        model: 列表项的响应模型
+        total: 总数
+        page: 页码
+        page_size: 每页数量
+        message: 响应消息
+        columnar: 是否使用列式格式
+        fetch_size: 每次 fetchmany 读取的行数
+
+    Yields:
+        响应体字节块
+    """
+    first = True
+
+    with pool.get_connection() as conn:
+        cursor = conn.execute(query, params)
+        try:
+            encoder = get_row_encoder(model, cursor_columns(cursor))
+            encode = encoder.values if columnar else encoder
+            prefix, suffix = _paginated_envelope(
+                total, page, page_size, message, encoder.columns if columnar else None
+            )
+            buffer = [prefix]
+            size = len(prefix)
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                # 整批编码后去掉数组的方括号，批次之间用逗号连接
+                block = dumps([encode(row) for row in rows])[1:-1]
+                if not first:
+                    block = b"," + block
+                first = False
+                buffer.append(block)
+                size += len(block)
+                if size >= STREAM_FLUSH_BYTES:
+                    yield b"".join(buffer)
+                    buffer = []
+                    size = 0
+        finally:
+            # 客户端中途断开时也要结束语句，避免归还的连接仍持有读快照
+            cursor.close()
+
+    buffer.append(suffix)
+    yield b"".join(buffer)
+
+
+def streaming_paginated_response(
+    pool,
+    query: str,
+    params: tuple,
+    model: Type[BaseModel],
+    total: int,
+    page: int,
+    page_size: int,
+    message: str = "操作成功",
+    columnar: bool = False
+) -> StreamingResponse:
+    """
+    构建流式分页列表响应（响应体与 paginated_response 相同）
+
+    Args:
+        pool: 数据库连接池
+        query: 分页查询 SQL
+        params: 查询参数
+        model: 列表项的响应模型
+        total: 总数
+        page: 页码
+        page_size: 每页数量
+        message: 响应消息
+        columnar: 是否使用列式格式
+    """
+    return StreamingResponse(
+        iter_paginated_chunks(pool, query, params, model, total, page, page_size, message, columnar),
+        media_type="application/json"
+    )
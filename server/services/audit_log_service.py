@@ -3,13 +3,21 @@
 提供日志记录、查询、对比等功能
 """
 
+import asyncio
+import base64
 import json
 import logging
-from typing import Optional, Dict, Any, List, Tuple
+import threading
+import time
+import zlib
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Tuple, Union
 from datetime import datetime, timedelta
 import sqlite3
 
-from server.database import get_pool
+from server.database import get_pool, in_read_snapshot, DatabaseBusyError
+from server.tracing import traced
 
 logger = logging.getLogger(__name__)
 
@@ -92,10 +100,925 @@ def convert_time_fields_in_data(data: Optional[Dict[str, Any]]) -> Optional[Dict
     return converted_data
 
 
+# ==================== 日志内容编码 ====================
+
+# 超过此长度（字节）的日志内容使用 zlib 压缩后以 BLOB 存储
+AUDIT_COMPRESS_THRESHOLD = 256
+
+
+def encode_log_payload(value: Optional[Dict[str, Any]]) -> Optional[Union[str, bytes]]:
+    """
+    编码日志内容（old_data/new_data/changes）
+    
+    使用紧凑 JSON，较大的内容压缩为 zlib BLOB（仅在确实变小时）
+    
+    Args:
+        value: 日志内容字典
+    
+    Returns:
+        JSON 字符串、压缩后的字节串或 None
+    """
+    if not value:
+        return None
+    
+    text = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    data = text.encode("utf-8")
+    if len(data) >= AUDIT_COMPRESS_THRESHOLD:
+        compressed = zlib.compress(data, 6)
+        if len(compressed) < len(data):
+            return compressed
+    return text
+
+
+def decode_log_payload(value: Optional[Union[str, bytes]]) -> Optional[Dict[str, Any]]:
+    """
+    解码日志内容（兼容 JSON 文本和 zlib 压缩的 BLOB）
+    
+    Args:
+        value: 数据库中存储的值
+    
+    Returns:
+        日志内容字典，为空或无法解析时返回 None
+    """
+    if not value:
+        return None
+    
+    try:
+        if isinstance(value, bytes):
+            value = zlib.decompress(value).decode("utf-8")
+        return json.loads(value)
+    except (zlib.error, UnicodeDecodeError, json.JSONDecodeError, TypeError):
+        return None
+
+
+def decode_log_row(row) -> Dict[str, Any]:
+    """
+    将 operation_logs 行转换为字典并解码日志内容
+    
+    UPDATE 日志只保存 changes，old_data/new_data 由变更字段还原
+    
+    Args:
+        row: 数据库行
+    
+    Returns:
+        日志字典
+    """
+    log_dict = dict(row)
+    log_dict['old_data'] = decode_log_payload(log_dict.get('old_data'))
+    log_dict['new_data'] = decode_log_payload(log_dict.get('new_data'))
+    log_dict['changes'] = decode_log_payload(log_dict.get('changes'))
+    
+    changes = log_dict['changes']
+    if (log_dict.get('operation_type') == 'UPDATE' and changes
+            and log_dict['old_data'] is None and log_dict['new_data'] is None):
+        log_dict['old_data'] = {
+            key: info.get('old') for key, info in changes.items() if isinstance(info, dict)
+        }
+        log_dict['new_data'] = {
+            key: info.get('new') for key, info in changes.items() if isinstance(info, dict)
+        }
+    
+    return log_dict
+
+
+def _payload_size(value: Optional[Union[str, bytes]]) -> int:
+    """日志内容的存储字节数"""
+    if not value:
+        return 0
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    return len(value)
+
+
+def compact_existing_logs(conn, batch_size: int = 1000) -> Dict[str, int]:
+    """
+    将已有的操作日志转换为紧凑格式（数据库升级时调用）
+    
+    UPDATE 日志在有 changes 时去掉完整的 old_data/new_data，
+    所有日志内容改为紧凑 JSON，较大的内容压缩为 BLOB
+    
+    Args:
+        conn: 数据库连接
+        batch_size: 每批处理的行数
+    
+    Returns:
+        统计信息（处理行数、更新行数、转换前后的内容字节数）
+    """
+    stats = {"rows": 0, "updated": 0, "bytes_before": 0, "bytes_after": 0}
+    last_id = 0
+    
+    while True:
+        rows = conn.execute(
+            """
+            SELECT id, operation_type, old_data, new_data, changes
+            FROM operation_logs
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+            """,
+            (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        
+        updates = []
+        for log_id, operation_type, old_raw, new_raw, changes_raw in rows:
+            old_data = decode_log_payload(old_raw)
+            new_data = decode_log_payload(new_raw)
+            changes = decode_log_payload(changes_raw)
+            if operation_type == 'UPDATE' and changes:
+                old_data = new_data = None
+            
+            encoded = (
+                encode_log_payload(old_data),
+                encode_log_payload(new_data),
+                encode_log_payload(changes)
+            )
+            before = sum(_payload_size(value) for value in (old_raw, new_raw, changes_raw))
+            after = sum(_payload_size(value) for value in encoded)
+            stats["bytes_before"] += before
+            stats["bytes_after"] += after
+            if encoded != (old_raw, new_raw, changes_raw):
+                updates.append((*encoded, log_id))
+        
+        if updates:
+            conn.executemany(
+                "UPDATE operation_logs SET old_data = ?, new_data = ?, changes = ? WHERE id = ?",
+                updates
+            )
+        stats["rows"] += len(rows)
+        stats["updated"] += len(updates)
+        last_id = rows[-1][0]
+    
+    return stats
+
+
+_INSERT_LOG_SQL = """
+    INSERT INTO operation_logs 
+    (userId, username, operation_type, entity_type, entity_id, entity_name,
+     old_data, new_data, changes, ip_address, device_info, operation_time, note)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_INSERT_LOG_FIELD_SQL = "INSERT OR IGNORE INTO operation_log_fields (log_id, userId, field) VALUES (?, ?, ?)"
+
+
+def _changed_fields(args: tuple) -> List[str]:
+    """UPDATE 日志的变更字段名（args 与 _build_log_row 的位置参数一致）"""
+    operation_type, changes = args[2], args[8]
+    if operation_type != 'UPDATE' or not changes:
+        return []
+    return [str(key) for key in changes.keys()]
+
+
+def _insert_logs(conn, rows: List[tuple], fields_list: List[List[str]]) -> int:
+    """
+    写入一批日志及其变更字段，返回最后一条日志的ID
+    
+    写事务内的 executemany 按顺序分配连续的自增ID，
+    因此由 last_insert_rowid() 即可推算每条日志的ID
+    """
+    conn.executemany(_INSERT_LOG_SQL, rows)
+    last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+    first_id = last_id - len(rows) + 1
+    field_rows = [
+        (first_id + index, row[0], field)
+        for index, (row, fields) in enumerate(zip(rows, fields_list))
+        for field in fields
+    ]
+    if field_rows:
+        conn.executemany(_INSERT_LOG_FIELD_SQL, field_rows)
+    return last_id
+
+
+def rebuild_log_fields(conn, batch_size: int = 1000) -> int:
+    """
+    根据已有 UPDATE 日志的 changes 重建变更字段表（数据库升级时调用）
+    
+    Args:
+        conn: 数据库连接
+        batch_size: 每批处理的行数
+    
+    Returns:
+        写入的变更字段记录数
+    """
+    written = 0
+    last_id = 0
+    
+    while True:
+        rows = conn.execute(
+            """
+            SELECT id, userId, changes
+            FROM operation_logs
+            WHERE id > ? AND operation_type = 'UPDATE' AND changes IS NOT NULL
+            ORDER BY id
+            LIMIT ?
+            """,
+            (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        
+        field_rows = []
+        for log_id, user_id, changes_raw in rows:
+            changes = decode_log_payload(changes_raw)
+            if isinstance(changes, dict):
+                field_rows.extend((log_id, user_id, str(key)) for key in changes.keys())
+        if field_rows:
+            conn.executemany(_INSERT_LOG_FIELD_SQL, field_rows)
+            written += len(field_rows)
+        last_id = rows[-1][0]
+    
+    return written
+
+
+def encode_log_cursor(operation_time: str, log_id: int) -> str:
+    """将分页位置（最后一条日志的操作时间和ID）编码为不透明的游标"""
+    raw = json.dumps([operation_time, log_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_log_cursor(cursor: str) -> Tuple[str, int]:
+    """
+    解码分页游标
+    
+    Raises:
+        ValueError: 游标无效
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        operation_time, log_id = json.loads(raw.decode("utf-8"))
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise ValueError("无效的分页游标")
+    if not isinstance(operation_time, str) or not isinstance(log_id, int):
+        raise ValueError("无效的分页游标")
+    return operation_time, log_id
+
+
+def _build_log_row(
+    user_id: int,
+    username: str,
+    operation_type: str,
+    entity_type: str,
+    entity_id: Optional[int],
+    entity_name: Optional[str],
+    old_data: Optional[Dict[str, Any]],
+    new_data: Optional[Dict[str, Any]],
+    changes: Optional[Dict[str, Any]],
+    ip_address: Optional[str],
+    device_info: Optional[str],
+    note: Optional[str],
+    operation_time: Optional[str] = None
+) -> tuple:
+    """
+    构建一行 operation_logs 插入参数（时间字段转换 + JSON 编码）
+    
+    Args:
+        operation_time: 操作时间（本地时间字符串，为 None 时使用当前时间）
+    
+    Returns:
+        与 _INSERT_LOG_SQL 对应的参数元组
+    """
+    # 转换时间字段从 UTC 到本地时间
+    old_data_converted = convert_time_fields_in_data(old_data)
+    new_data_converted = convert_time_fields_in_data(new_data)
+    
+    # 如果 changes 中包含时间字段，也需要转换
+    changes_converted = None
+    if changes:
+        changes_converted = {}
+        for key, change_info in changes.items():
+            if isinstance(change_info, dict):
+                change_info_copy = change_info.copy()
+                # 转换 old 和 new 值中的时间字段
+                if 'old' in change_info_copy and isinstance(change_info_copy['old'], str):
+                    if any(time_field in key.lower() for time_field in ['created_at', 'updated_at', 'time', 'date']):
+                        change_info_copy['old'] = convert_utc_to_local_time_str(change_info_copy['old'])
+                if 'new' in change_info_copy and isinstance(change_info_copy['new'], str):
+                    if any(time_field in key.lower() for time_field in ['created_at', 'updated_at', 'time', 'date']):
+                        change_info_copy['new'] = convert_utc_to_local_time_str(change_info_copy['new'])
+                changes_converted[key] = change_info_copy
+            else:
+                changes_converted[key] = change_info
+    
+    # UPDATE 日志只保存变更字段（读取时由 changes 还原 old_data/new_data）
+    if operation_type == 'UPDATE' and changes_converted:
+        old_data_converted = None
+        new_data_converted = None
+    
+    # 编码为紧凑 JSON（较大的内容压缩存储）
+    old_data_json = encode_log_payload(old_data_converted)
+    new_data_json = encode_log_payload(new_data_converted)
+    changes_json = encode_log_payload(changes_converted)
+    
+    # 使用本地时间（CST，UTC+8）而不是 SQLite 的 datetime('now')（UTC）
+    local_time = operation_time or get_local_time_str()
+    
+    return (
+        user_id,
+        username,
+        operation_type,
+        entity_type,
+        entity_id,
+        entity_name,
+        old_data_json,
+        new_data_json,
+        changes_json,
+        ip_address,
+        device_info,
+        local_time,
+        note
+    )
+
+
+# ==================== 异步日志写入 ====================
+
+# 队列最大长度
+AUDIT_QUEUE_MAX_SIZE = 10000
+
+# 每次 executemany 写入的最大条数
+AUDIT_FLUSH_BATCH_SIZE = 500
+
+# 后台写入间隔（秒），队列达到批量大小时立即写入
+AUDIT_FLUSH_INTERVAL = 0.5
+
+# 队列已满时的处理策略：
+#   sync        - 在调用方线程中直接写入（不丢日志，但该请求变慢）
+#   drop_oldest - 丢弃队列中最早的日志
+#   drop_newest - 丢弃当前日志
+AUDIT_OVERFLOW_POLICIES = ("sync", "drop_oldest", "drop_newest")
+
+# 写入失败（数据库繁忙）时的重试次数
+_AUDIT_WRITE_RETRIES = 3
+
+
+class AuditLogWriter:
+    """
+    异步操作日志写入器
+    
+    业务请求只把日志参数放入内存队列，由后台线程批量转换、编码，
+    并在一个事务中用 executemany 写入，避免每次操作都额外占用连接和提交事务
+    """
+    
+    def __init__(
+        self,
+        max_size: int = AUDIT_QUEUE_MAX_SIZE,
+        batch_size: int = AUDIT_FLUSH_BATCH_SIZE,
+        flush_interval: float = AUDIT_FLUSH_INTERVAL,
+        overflow_policy: str = "sync"
+    ):
+        """
+        初始化写入器
+        
+        Args:
+            max_size: 队列最大长度
+            batch_size: 每批写入的最大条数
+            flush_interval: 后台写入间隔（秒）
+            overflow_policy: 队列已满时的处理策略（见 AUDIT_OVERFLOW_POLICIES）
+        """
+        if overflow_policy not in AUDIT_OVERFLOW_POLICIES:
+            raise ValueError(f"无效的日志队列溢出策略: {overflow_policy}")
+        
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        
+        # 队列项: (入队时间 monotonic, 操作时间, _build_log_row 参数)
+        self._queue: deque = deque()
+        self._condition = threading.Condition()
+        # 同一时间只有一个线程写入，保证日志按入队顺序落库
+        self._write_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,
+            "sync_writes": 0,
+            "failed": 0,
+            "batches": 0,
+            "max_batch": 0,
+            "max_queue_depth": 0,
+            "last_flush_lag_ms": 0.0,
+            "max_flush_lag_ms": 0.0,
+        }
+    
+    @property
+    def running(self) -> bool:
+        return self._running
+    
+    def start(self):
+        """启动后台写入线程"""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+        self._thread.start()
+        logger.info(f"操作日志异步写入已启动（队列上限 {self.max_size}，溢出策略 {self.overflow_policy}）")
+    
+    def stop(self, timeout: float = 10.0):
+        """
+        停止后台写入线程，并写入队列中剩余的日志
+        
+        Args:
+            timeout: 等待后台线程退出的时间（秒）
+        """
+        if not self._running:
+            return
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        
+        remaining = self.flush()
+        logger.info(f"操作日志异步写入已停止（关闭时写入 {remaining} 条）")
+    
+    def submit(self, args: tuple) -> bool:
+        """
+        提交一条日志
+        
+        Args:
+            args: _build_log_row 的参数（不含 operation_time）
+        
+        Returns:
+            是否已入队或写入（被丢弃时返回 False）
+        """
+        item = (time.monotonic(), get_local_time_str(), args)
+        
+        with self._condition:
+            if len(self._queue) >= self.max_size:
+                if self.overflow_policy == "drop_newest":
+                    self._stats["dropped"] += 1
+                    return False
+                if self.overflow_policy == "drop_oldest":
+                    self._queue.popleft()
+                    self._stats["dropped"] += 1
+                else:
+                    item = None
+            
+            if item is not None:
+                self._queue.append(item)
+                self._stats["enqueued"] += 1
+                depth = len(self._queue)
+                if depth > self._stats["max_queue_depth"]:
+                    self._stats["max_queue_depth"] = depth
+                if depth >= self.batch_size:
+                    self._condition.notify()
+                return True
+        
+        # 队列已满（sync 策略）：在当前线程直接写入
+        with self._condition:
+            self._stats["sync_writes"] += 1
+        return self._write_batch([(time.monotonic(), get_local_time_str(), args)]) > 0
+    
+    def flush(self) -> int:
+        """
+        立即写入队列中的所有日志
+        
+        Returns:
+            写入的条数
+        """
+        written = 0
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return written
+            written += self._write_batch(batch)
+    
+    def get_stats(self) -> dict:
+        """获取写入器统计信息（队列深度、积压时长、丢弃数量等）"""
+        now = time.monotonic()
+        with self._condition:
+            depth = len(self._queue)
+            oldest_ms = (now - self._queue[0][0]) * 1000 if depth else 0.0
+            stats = dict(self._stats)
+        
+        stats.update({
+            "running": self._running,
+            "queue_depth": depth,
+            "queue_max_size": self.max_size,
+            "overflow_policy": self.overflow_policy,
+            "oldest_pending_ms": round(oldest_ms, 1),
+        })
+        return stats
+    
+    def _run(self):
+        """后台线程：按间隔或队列达到批量大小时写入"""
+        while True:
+            with self._condition:
+                if self._running and len(self._queue) < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+                if not self._running:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"后台写入操作日志出错: {e}", exc_info=True)
+                time.sleep(1)
+    
+    def _take_batch(self) -> list:
+        with self._condition:
+            count = min(len(self._queue), self.batch_size)
+            return [self._queue.popleft() for _ in range(count)]
+    
+    def _write_batch(self, batch: list) -> int:
+        """在一个事务中写入一批日志，数据库繁忙时重试"""
+        try:
+            rows = [
+                _build_log_row(*args, operation_time=operation_time)
+                for _, operation_time, args in batch
+            ]
+            fields_list = [_changed_fields(args) for _, _, args in batch]
+        except Exception as e:
+            self._stats["failed"] += len(batch)
+            logger.error(f"编码操作日志失败，丢弃 {len(batch)} 条: {e}", exc_info=True)
+            return 0
+        
+        written = len(rows)
+        with self._write_lock:
+            for attempt in range(_AUDIT_WRITE_RETRIES):
+                try:
+                    with get_pool().get_connection() as conn:
+                        try:
+                            _insert_logs(conn, rows, fields_list)
+                        except sqlite3.IntegrityError:
+                            # 个别日志违反约束时逐条写入，只丢弃出错的日志
+                            conn.rollback()
+                            written = self._write_rows_one_by_one(conn, rows, fields_list)
+                        conn.commit()
+                    break
+                except DatabaseBusyError as e:
+                    if attempt == _AUDIT_WRITE_RETRIES - 1:
+                        self._stats["failed"] += len(batch)
+                        logger.error(f"写入操作日志失败（数据库繁忙），丢弃 {len(batch)} 条: {e}")
+                        return 0
+                    time.sleep(0.1 * (attempt + 1))
+                except Exception as e:
+                    self._stats["failed"] += len(batch)
+                    logger.error(f"写入操作日志失败，丢弃 {len(batch)} 条: {e}", exc_info=True)
+                    return 0
+        
+        lag_ms = (time.monotonic() - batch[0][0]) * 1000
+        with self._condition:
+            self._stats["written"] += written
+            self._stats["failed"] += len(batch) - written
+            self._stats["batches"] += 1
+            self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+            self._stats["last_flush_lag_ms"] = round(lag_ms, 1)
+            self._stats["max_flush_lag_ms"] = round(max(self._stats["max_flush_lag_ms"], lag_ms), 1)
+        return written
+    
+    @staticmethod
+    def _write_rows_one_by_one(conn, rows: list, fields_list: list) -> int:
+        """逐条写入日志，跳过违反约束的行"""
+        written = 0
+        for row, fields in zip(rows, fields_list):
+            try:
+                _insert_logs(conn, [row], [fields])
+                written += 1
+            except sqlite3.IntegrityError as e:
+                logger.error(f"写入操作日志失败，丢弃 1 条 (用户: {row[0]}, 实体: {row[3]}): {e}")
+        return written
+
+
+# 全局日志写入器实例
+_writer: Optional[AuditLogWriter] = None
+
+
+def start_audit_writer(**kwargs) -> AuditLogWriter:
+    """
+    创建并启动全局日志写入器
+    
+    Args:
+        **kwargs: AuditLogWriter 参数
+    
+    Returns:
+        日志写入器实例
+    """
+    global _writer
+    if _writer is None:
+        _writer = AuditLogWriter(**kwargs)
+    _writer.start()
+    return _writer
+
+
+def stop_audit_writer():
+    """停止全局日志写入器并写入剩余日志"""
+    if _writer is not None:
+        _writer.stop()
+
+
+def get_audit_writer() -> Optional[AuditLogWriter]:
+    """
+    获取全局日志写入器实例
+    
+    Returns:
+        日志写入器实例，未启动时返回 None（此时日志同步写入）
+    """
+    return _writer
+
+
+# ==================== 日志保留与归档 ====================
+
+# 每批删除（归档）的 ID 范围大小
+AUDIT_RETENTION_BATCH_SIZE = 1000
+
+# 每批之间让出的时间（秒），让其他写请求拿到写锁
+AUDIT_RETENTION_BATCH_SLEEP = 0.01
+
+# 归档库附加到连接上的库名
+AUDIT_ARCHIVE_SCHEMA = "audit_archive"
+
+_LOG_COLUMNS = (
+    "id, userId, username, operation_type, entity_type, entity_id, entity_name, "
+    "old_data, new_data, changes, ip_address, device_info, operation_time, note"
+)
+
+
+class AuditRetentionBusyError(Exception):
+    """已有日志清理任务正在进行"""
+    pass
+
+
+class AuditLogRetention:
+    """
+    操作日志保留任务
+    
+    按 ID 范围分批删除过期日志，每批一个短事务，批次之间让出写锁；
+    配置了归档库时，过期日志在同一事务中先复制到归档库（ATTACH）再删除，
+    归档库的结构与主库相同，可通过操作日志接口查询（archived=true）
+    """
+    
+    def __init__(
+        self,
+        archive_path: Optional[str] = None,
+        batch_size: int = AUDIT_RETENTION_BATCH_SIZE,
+        batch_sleep: float = AUDIT_RETENTION_BATCH_SLEEP
+    ):
+        """
+        初始化日志保留任务
+        
+        Args:
+            archive_path: 归档库文件路径（为空时过期日志直接删除）
+            batch_size: 每批处理的 ID 范围大小
+            batch_sleep: 每批之间让出的时间（秒）
+        """
+        self.archive_path = archive_path or None
+        self.batch_size = batch_size
+        self.batch_sleep = batch_sleep
+        
+        self._run_lock = threading.Lock()
+        self._stats = {
+            "runs": 0,
+            "deleted": 0,
+            "archived": 0,
+            "last_run": None,
+        }
+    
+    @contextmanager
+    def attach_archive(self, conn):
+        """
+        将归档库附加到连接上（库名 audit_archive），退出时分离
+        
+        归档库不存在时自动创建表结构
+        
+        附加、分离归档库需要在事务之外进行，退出时会回滚连接上的事务，
+        所以不能在只读快照中使用（会结束快照的读事务）
+        
+        Raises:
+            ValueError: 未配置归档库或处于只读快照中
+        """
+        if not self.archive_path:
+            raise ValueError("未配置操作日志归档库")
+        if in_read_snapshot():
+            raise ValueError("只读快照中（如批量请求）不能查询归档日志")
+        
+        conn.execute(f"ATTACH DATABASE ? AS {AUDIT_ARCHIVE_SCHEMA}", (self.archive_path,))
+        try:
+            self._ensure_archive_schema(conn)
+            yield conn
+        finally:
+            conn.rollback()
+            conn.execute(f"DETACH DATABASE {AUDIT_ARCHIVE_SCHEMA}")
+    
+    @staticmethod
+    def _ensure_archive_schema(conn):
+        """创建归档库表结构（与主库相同，不含外键约束）"""
+        schema = AUDIT_ARCHIVE_SCHEMA
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.operation_logs (
+                id INTEGER PRIMARY KEY,
+                userId INTEGER NOT NULL,
+                username TEXT NOT NULL,
+                operation_type TEXT NOT NULL,
+                entity_type TEXT NOT NULL,
+                entity_id INTEGER,
+                entity_name TEXT,
+                old_data TEXT,
+                new_data TEXT,
+                changes TEXT,
+                ip_address TEXT,
+                device_info TEXT,
+                operation_time TEXT,
+                note TEXT
+            )
+        """)
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.operation_log_fields (
+                log_id INTEGER NOT NULL,
+                userId INTEGER NOT NULL,
+                field TEXT NOT NULL,
+                PRIMARY KEY (log_id, field)
+            ) WITHOUT ROWID
+        """)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_logs_userId_time ON operation_logs(userId, operation_time DESC)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_logs_user_entity_time ON operation_logs(userId, entity_type, entity_id, operation_time DESC)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_log_fields_user_field ON operation_log_fields(userId, field, log_id)")
+        conn.commit()
+    
+    def run(self, days: int, archive: Optional[bool] = None) -> Dict[str, Any]:
+        """
+        删除（归档）指定天数之前的日志（同步，应在线程中调用）
+        
+        Args:
+            days: 保留天数
+            archive: 是否归档，为 None 时配置了归档库即归档
+        
+        Returns:
+            本次运行记录（截止时间、删除数、归档数、批次数、最长持锁时间、耗时）
+        
+        Raises:
+            AuditRetentionBusyError: 已有清理任务正在进行
+            ValueError: 要求归档但未配置归档库
+        """
+        if archive is None:
+            archive = self.archive_path is not None
+        if archive and not self.archive_path:
+            raise ValueError("未配置操作日志归档库")
+        if not self._run_lock.acquire(blocking=False):
+            raise AuditRetentionBusyError("已有日志清理任务正在进行")
+        
+        started = time.perf_counter()
+        # operation_time 保存的是本地时间，截止时间也按本地时间计算
+        cutoff = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+        record = {
+            "started_at": datetime.now().isoformat(),
+            "days": days,
+            "cutoff": cutoff,
+            "archive": archive,
+            "deleted": 0,
+            "archived": 0,
+            "batches": 0,
+            "max_lock_ms": 0.0,
+        }
+        
+        try:
+            with get_pool().get_connection() as conn:
+                if archive:
+                    with self.attach_archive(conn):
+                        self._run_batches(conn, cutoff, archive, record)
+                else:
+                    self._run_batches(conn, cutoff, archive, record)
+        finally:
+            record["duration_seconds"] = round(time.perf_counter() - started, 3)
+            self._stats["runs"] += 1
+            self._stats["deleted"] += record["deleted"]
+            self._stats["archived"] += record["archived"]
+            self._stats["last_run"] = record
+            self._run_lock.release()
+        
+        logger.info(
+            f"操作日志清理完成: 截止 {cutoff}, 删除 {record['deleted']} 条, 归档 {record['archived']} 条, "
+            f"批次: {record['batches']}, 最长持锁: {record['max_lock_ms']}ms, 耗时: {record['duration_seconds']}秒"
+        )
+        return record
+    
+    def _run_batches(self, conn, cutoff: str, archive: bool, record: Dict[str, Any]):
+        """按 ID 范围从小到大分批处理，遇到整批都未过期的范围时停止"""
+        low, max_id = conn.execute("SELECT MIN(id) - 1, MAX(id) FROM main.operation_logs").fetchone()
+        if max_id is None:
+            return
+        
+        schema = AUDIT_ARCHIVE_SCHEMA
+        range_condition = "id > ? AND id <= ? AND operation_time < ?"
+        
+        while low < max_id:
+            high = low + self.batch_size
+            params = (low, high, cutoff)
+            
+            lock_started = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if archive:
+                    archived = conn.execute(
+                        f"INSERT OR REPLACE INTO {schema}.operation_logs ({_LOG_COLUMNS}) "
+                        f"SELECT {_LOG_COLUMNS} FROM main.operation_logs WHERE {range_condition}",
+                        params
+                    ).rowcount
+                    conn.execute(
+                        f"INSERT OR IGNORE INTO {schema}.operation_log_fields (log_id, userId, field) "
+                        f"SELECT log_id, userId, field FROM main.operation_log_fields "
+                        f"WHERE log_id IN (SELECT id FROM main.operation_logs WHERE {range_condition})",
+                        params
+                    )
+                    record["archived"] += archived
+                
+                deleted = conn.execute(
+                    f"DELETE FROM main.operation_logs WHERE {range_condition}",
+                    params
+                ).rowcount
+                remaining = conn.execute(
+                    "SELECT COUNT(*) FROM main.operation_logs WHERE id > ? AND id <= ?",
+                    (low, high)
+                ).fetchone()[0]
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            
+            lock_ms = (time.perf_counter() - lock_started) * 1000
+            record["deleted"] += deleted
+            record["batches"] += 1
+            record["max_lock_ms"] = round(max(record["max_lock_ms"], lock_ms), 1)
+            
+            # 日志按时间顺序写入，整批都未过期说明后面的日志也未过期
+            if deleted == 0 and remaining > 0:
+                break
+            low = high
+            time.sleep(self.batch_sleep)
+    
+    async def run_scheduler(self, days: int, interval_seconds: int):
+        """
+        后台调度任务：按间隔执行日志清理
+        
+        Args:
+            days: 保留天数
+            interval_seconds: 清理间隔（秒）
+        """
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await asyncio.to_thread(self.run, days)
+            except AuditRetentionBusyError as e:
+                logger.warning(f"定时日志清理未执行: {e}")
+            except Exception as e:
+                logger.error(f"定时日志清理失败: {e}", exc_info=True)
+    
+    def get_stats(self) -> dict:
+        """获取日志清理统计信息"""
+        return {
+            **self._stats,
+            "running": self._run_lock.locked(),
+            "archive_path": self.archive_path,
+        }
+
+
+# 全局日志保留任务实例
+_retention: Optional[AuditLogRetention] = None
+
+
+def init_audit_retention(**kwargs) -> AuditLogRetention:
+    """
+    初始化全局日志保留任务
+    
+    Args:
+        **kwargs: AuditLogRetention 参数
+    
+    Returns:
+        日志保留任务实例
+    """
+    global _retention
+    if _retention is None:
+        _retention = AuditLogRetention(**kwargs)
+    return _retention
+
+
+def get_audit_retention() -> AuditLogRetention:
+    """
+    获取全局日志保留任务实例（未初始化时使用不归档的默认配置）
+    """
+    return init_audit_retention()
+
+
+@contextmanager
+def _log_tables(conn, archived: bool):
+    """返回 (日志表, 变更字段表) 名称，查询归档时附加归档库"""
+    if not archived:
+        yield "operation_logs", "operation_log_fields"
+        return
+    with get_audit_retention().attach_archive(conn):
+        yield f"{AUDIT_ARCHIVE_SCHEMA}.operation_logs", f"{AUDIT_ARCHIVE_SCHEMA}.operation_log_fields"
+
+
 class AuditLogService:
     """操作日志服务类"""
     
     @staticmethod
+    @traced("audit")
     def log_operation(
         user_id: int,
         username: str,
@@ -128,66 +1051,24 @@ class AuditLogService:
             note: 备注
         
         Returns:
-            日志ID
+            日志ID（异步写入时返回 0）
         """
+        args = (
+            user_id, username, operation_type, entity_type, entity_id, entity_name,
+            old_data, new_data, changes, ip_address, device_info, note
+        )
+        
+        # 后台写入器运行时只入队，由后台线程批量写入
+        writer = get_audit_writer()
+        if writer is not None and writer.running:
+            writer.submit(args)
+            return 0
+        
         pool = get_pool()
         
         try:
             with pool.get_connection() as conn:
-                # 转换时间字段从 UTC 到本地时间
-                old_data_converted = convert_time_fields_in_data(old_data)
-                new_data_converted = convert_time_fields_in_data(new_data)
-                
-                # 如果 changes 中包含时间字段，也需要转换
-                changes_converted = None
-                if changes:
-                    changes_converted = {}
-                    for key, change_info in changes.items():
-                        if isinstance(change_info, dict):
-                            change_info_copy = change_info.copy()
-                            # 转换 old 和 new 值中的时间字段
-                            if 'old' in change_info_copy and isinstance(change_info_copy['old'], str):
-                                if any(time_field in key.lower() for time_field in ['created_at', 'updated_at', 'time', 'date']):
-                                    change_info_copy['old'] = convert_utc_to_local_time_str(change_info_copy['old'])
-                            if 'new' in change_info_copy and isinstance(change_info_copy['new'], str):
-                                if any(time_field in key.lower() for time_field in ['created_at', 'updated_at', 'time', 'date']):
-                                    change_info_copy['new'] = convert_utc_to_local_time_str(change_info_copy['new'])
-                            changes_converted[key] = change_info_copy
-                        else:
-                            changes_converted[key] = change_info
-                
-                # 将字典转换为JSON字符串
-                old_data_json = json.dumps(old_data_converted, ensure_ascii=False) if old_data_converted else None
-                new_data_json = json.dumps(new_data_converted, ensure_ascii=False) if new_data_converted else None
-                changes_json = json.dumps(changes_converted, ensure_ascii=False) if changes_converted else None
-                
-                # 使用本地时间（CST，UTC+8）而不是 SQLite 的 datetime('now')（UTC）
-                local_time = get_local_time_str()
-                
-                cursor = conn.execute(
-                    """
-                    INSERT INTO operation_logs 
-                    (userId, username, operation_type, entity_type, entity_id, entity_name,
-                     old_data, new_data, changes, ip_address, device_info, operation_time, note)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (
-                        user_id,
-                        username,
-                        operation_type,
-                        entity_type,
-                        entity_id,
-                        entity_name,
-                        old_data_json,
-                        new_data_json,
-                        changes_json,
-                        ip_address,
-                        device_info,
-                        local_time,
-                        note
-                    )
-                )
-                log_id = cursor.lastrowid
+                log_id = _insert_logs(conn, [_build_log_row(*args)], [_changed_fields(args)])
                 conn.commit()
                 
                 logger.debug(f"操作日志已记录: ID={log_id}, 用户={username}, 操作={operation_type}, 实体={entity_type}")
@@ -198,6 +1079,58 @@ class AuditLogService:
             return 0
     
     @staticmethod
+    @traced("audit")
+    def log_create_many(
+        user_id: int,
+        username: str,
+        entity_type: str,
+        records: List[Tuple[int, Optional[str], Optional[Dict[str, Any]]]]
+    ) -> int:
+        """
+        批量记录创建操作（未启用后台写入器时在一个事务内 executemany 写入）
+        
+        Args:
+            user_id: 用户ID
+            username: 用户名
+            entity_type: 实体类型
+            records: [(实体ID, 实体名称, 新创建的数据)] 列表
+        
+        Returns:
+            写入的日志条数
+        """
+        if not records:
+            return 0
+        
+        args_list = [
+            (
+                user_id, username, "CREATE", entity_type, entity_id, entity_name,
+                None, new_data, None, None, None, None
+            )
+            for entity_id, entity_name, new_data in records
+        ]
+        
+        # 后台写入器运行时只入队
+        writer = get_audit_writer()
+        if writer is not None and writer.running:
+            return sum(1 for args in args_list if writer.submit(args))
+        
+        pool = get_pool()
+        
+        try:
+            rows = [_build_log_row(*args) for args in args_list]
+            with pool.get_connection() as conn:
+                _insert_logs(conn, rows, [[] for _ in rows])
+                conn.commit()
+            
+            logger.debug(f"批量操作日志已记录: {len(rows)} 条, 用户={username}, 实体={entity_type}")
+            return len(rows)
+        except Exception as e:
+            logger.error(f"批量记录操作日志失败: {e}", exc_info=True)
+            # 日志记录失败不应影响主业务，只记录错误
+            return 0
+    
+    @staticmethod
+    @traced("audit")
     def log_create(
         user_id: int,
         username: str,
@@ -240,6 +1173,7 @@ class AuditLogService:
         )
     
     @staticmethod
+    @traced("audit")
     def log_update(
         user_id: int,
         username: str,
@@ -292,6 +1226,7 @@ class AuditLogService:
         )
     
     @staticmethod
+    @traced("audit")
     def log_delete(
         user_id: int,
         username: str,
@@ -379,11 +1314,19 @@ class AuditLogService:
         entity_type: Optional[str] = None,
         start_time: Optional[str] = None,
         end_time: Optional[str] = None,
-        search: Optional[str] = None
-    ) -> Tuple[List[Dict[str, Any]], int]:
+        search: Optional[str] = None,
+        entity_id: Optional[int] = None,
+        changed_fields: Optional[List[str]] = None,
+        cursor: Optional[str] = None,
+        with_total: bool = True,
+        archived: bool = False
+    ) -> Tuple[List[Dict[str, Any]], Optional[int], Optional[str]]:
         """
         获取操作日志列表
         
+        传入 cursor 时使用键集分页（从游标位置继续向后读取，忽略 page），
+        深翻页不需要扫描并跳过前面的行
+        
         Args:
             user_id: 用户ID
             page: 页码（从1开始）
@@ -393,14 +1336,23 @@ class AuditLogService:
             start_time: 开始时间（ISO8601格式）
             end_time: 结束时间（ISO8601格式）
             search: 搜索关键词（实体名称、备注）
+            entity_id: 实体ID筛选
+            changed_fields: 变更字段筛选（任一字段发生变更的 UPDATE 日志）
+            cursor: 分页游标（上一页返回的 next_cursor）
+            with_total: 是否查询总数
+            archived: 是否查询归档库
         
         Returns:
-            (日志列表, 总数)
+            (日志列表, 总数（with_total 为 False 时为 None）, 下一页游标（没有更多数据时为 None）)
+        
+        Raises:
+            ValueError: 游标无效，或查询归档但未配置归档库
         """
+        position = decode_log_cursor(cursor) if cursor else None
         pool = get_pool()
         
         try:
-            with pool.get_connection() as conn:
+            with pool.get_connection() as conn, _log_tables(conn, archived) as (logs_table, fields_table):
                 # 构建查询条件
                 conditions = ["userId = ?"]
                 params = [user_id]
@@ -426,87 +1378,89 @@ class AuditLogService:
                     search_pattern = f"%{search}%"
                     params.extend([search_pattern, search_pattern])
                 
+                if entity_id is not None:
+                    conditions.append("entity_id = ?")
+                    params.append(entity_id)
+                
+                if changed_fields:
+                    placeholders = ", ".join("?" * len(changed_fields))
+                    conditions.append(
+                        f"id IN (SELECT log_id FROM {fields_table} "
+                        f"WHERE userId = ? AND field IN ({placeholders}))"
+                    )
+                    params.append(user_id)
+                    params.extend(changed_fields)
+                
                 where_clause = " AND ".join(conditions)
                 
                 # 查询总数
-                count_cursor = conn.execute(
-                    f"SELECT COUNT(*) FROM operation_logs WHERE {where_clause}",
-                    params
-                )
-                total = count_cursor.fetchone()[0]
+                total = None
+                if with_total:
+                    count_cursor = conn.execute(
+                        f"SELECT COUNT(*) FROM {logs_table} WHERE {where_clause}",
+                        params
+                    )
+                    total = count_cursor.fetchone()[0]
                 
-                # 查询数据（分页）
-                offset = (page - 1) * page_size
-                cursor = conn.execute(
+                # 查询数据（游标分页或页码分页），多取一条用于判断是否还有下一页
+                page_params = list(params)
+                if position is not None:
+                    where_clause += " AND (operation_time < ? OR (operation_time = ? AND id < ?))"
+                    page_params.extend([position[0], position[0], position[1]])
+                    offset = 0
+                else:
+                    offset = (page - 1) * page_size
+                
+                rows = conn.execute(
                     f"""
-                    SELECT id, userId, username, operation_type, entity_type, entity_id, entity_name,
-                           old_data, new_data, changes, ip_address, device_info, operation_time, note
-                    FROM operation_logs
+                    SELECT {_LOG_COLUMNS}
+                    FROM {logs_table}
                     WHERE {where_clause}
-                    ORDER BY operation_time DESC
+                    ORDER BY operation_time DESC, id DESC
                     LIMIT ? OFFSET ?
                     """,
-                    params + [page_size, offset]
-                )
+                    page_params + [page_size + 1, offset]
+                ).fetchall()
                 
-                rows = cursor.fetchall()
-                logs = []
+                next_cursor = None
+                if len(rows) > page_size:
+                    rows = rows[:page_size]
+                    next_cursor = encode_log_cursor(rows[-1]["operation_time"], rows[-1]["id"])
                 
-                for row in rows:
-                    log_dict = dict(row)
-                    # 解析JSON字段
-                    if log_dict.get('old_data'):
-                        try:
-                            log_dict['old_data'] = json.loads(log_dict['old_data'])
-                        except (json.JSONDecodeError, TypeError):
-                            log_dict['old_data'] = None
-                    else:
-                        log_dict['old_data'] = None
-                    
-                    if log_dict.get('new_data'):
-                        try:
-                            log_dict['new_data'] = json.loads(log_dict['new_data'])
-                        except (json.JSONDecodeError, TypeError):
-                            log_dict['new_data'] = None
-                    else:
-                        log_dict['new_data'] = None
-                    
-                    if log_dict.get('changes'):
-                        try:
-                            log_dict['changes'] = json.loads(log_dict['changes'])
-                        except (json.JSONDecodeError, TypeError):
-                            log_dict['changes'] = None
-                    else:
-                        log_dict['changes'] = None
-                    
-                    logs.append(log_dict)
+                # 解码日志内容（兼容压缩存储和仅保存变更字段的 UPDATE 日志）
+                logs = [decode_log_row(row) for row in rows]
                 
-                return logs, total
+                return logs, total, next_cursor
+        except ValueError:
+            raise
         except Exception as e:
             logger.error(f"查询操作日志失败: {e}", exc_info=True)
             raise
     
     @staticmethod
-    def get_log_detail(log_id: int, user_id: int) -> Optional[Dict[str, Any]]:
+    def get_log_detail(log_id: int, user_id: int, archived: bool = False) -> Optional[Dict[str, Any]]:
         """
         获取操作日志详情
         
         Args:
             log_id: 日志ID
             user_id: 用户ID（用于权限验证）
+            archived: 是否查询归档库
         
         Returns:
             日志详情字典，如果不存在或无权访问则返回None
+        
+        Raises:
+            ValueError: 查询归档但未配置归档库
         """
         pool = get_pool()
         
         try:
-            with pool.get_connection() as conn:
+            with pool.get_connection() as conn, _log_tables(conn, archived) as (logs_table, _):
                 cursor = conn.execute(
-                    """
-                    SELECT id, userId, username, operation_type, entity_type, entity_id, entity_name,
-                           old_data, new_data, changes, ip_address, device_info, operation_time, note
-                    FROM operation_logs
+                    f"""
+                    SELECT {_LOG_COLUMNS}
+                    FROM {logs_table}
                     WHERE id = ? AND userId = ?
                     """,
                     (log_id, user_id)
@@ -516,34 +1470,9 @@ class AuditLogService:
                 if not row:
                     return None
                 
-                log_dict = dict(row)
-                
-                # 解析JSON字段
-                if log_dict.get('old_data'):
-                    try:
-                        log_dict['old_data'] = json.loads(log_dict['old_data'])
-                    except (json.JSONDecodeError, TypeError):
-                        log_dict['old_data'] = None
-                else:
-                    log_dict['old_data'] = None
-                
-                if log_dict.get('new_data'):
-                    try:
-                        log_dict['new_data'] = json.loads(log_dict['new_data'])
-                    except (json.JSONDecodeError, TypeError):
-                        log_dict['new_data'] = None
-                else:
-                    log_dict['new_data'] = None
-                
-                if log_dict.get('changes'):
-                    try:
-                        log_dict['changes'] = json.loads(log_dict['changes'])
-                    except (json.JSONDecodeError, TypeError):
-                        log_dict['changes'] = None
-                else:
-                    log_dict['changes'] = None
-                
-                return log_dict
+                return decode_log_row(row)
+        except ValueError:
+            raise
         except Exception as e:
             logger.error(f"查询操作日志详情失败: {e}", exc_info=True)
             raise
@@ -553,29 +1482,18 @@ class AuditLogService:
         """
         清理指定天数之前的旧日志
         
+        分批删除，配置了归档库时先归档（见 AuditLogRetention）
+        
         Args:
             days: 保留天数（默认730天，即2年）
         
         Returns:
             删除的记录数
         """
-        pool = get_pool()
-        
         try:
-            with pool.get_connection() as conn:
-                cursor = conn.execute(
-                    """
-                    DELETE FROM operation_logs
-                    WHERE operation_time < datetime('now', '-' || ? || ' days')
-                    """,
-                    (days,)
-                )
-                deleted_count = cursor.rowcount
-                conn.commit()
-                
-                logger.info(f"清理了 {deleted_count} 条 {days} 天前的操作日志")
-                return deleted_count
+            return get_audit_retention().run(days)["deleted"]
+        except AuditRetentionBusyError:
+            raise
         except Exception as e:
             logger.error(f"清理旧日志失败: {e}", exc_info=True)
             raise
-
@@ -0,0 +1,396 @@
+"""
+服务器备份服务
+使用 SQLite 在线备份 API（Connection.backup）按页分步复制整个数据库，
+每一步之间让出时间，不会长时间阻塞写入；另外提供按用户的逻辑备份（NDJSON）
+
+备份文件目录结构：
+    <backup_dir>/server/agrisalecl_YYYYmmdd_HHMMSS.db.gz   整库快照
+    <backup_dir>/users/<userId>/user_YYYYmmdd_HHMMSS_xxxxxx.ndjson.gz   用户逻辑备份（xxxxxx 为随机后缀）
+"""
+
+import asyncio
+import gzip
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Optional, Dict, Any, List
+
+from server.services.data_export_service import iter_export_lines, iter_export_chunks
+
+logger = logging.getLogger(__name__)
+
+# 每一步复制的页数（默认页大小 4KB，即每步约 4MB）
+BACKUP_PAGES_PER_STEP = 1024
+
+# 每一步之间让出的时间（秒）
+BACKUP_STEP_SLEEP = 0.005
+
+# 保留的运行记录数量
+BACKUP_HISTORY_SIZE = 20
+
+# 备份文件名（只允许这些格式，防止路径穿越）
+_SERVER_BACKUP_PATTERN = re.compile(r"^agrisalecl_\d{8}_\d{6}\.db(\.gz)?$")
+# 用户备份可能在同一秒内创建多个，文件名带随机后缀（旧文件没有后缀）
+_USER_BACKUP_PATTERN = re.compile(r"^user_\d{8}_\d{6}(_[0-9a-f]{6})?\.ndjson\.gz$")
+
+
+class BackupError(Exception):
+    """备份失败"""
+    pass
+
+
+class BackupInProgressError(BackupError):
+    """已有整库备份正在运行"""
+    pass
+
+
+class BackupManager:
+    """
+    备份管理器
+
+    整库快照由后台调度任务按间隔执行（也可直接调用 run_backup），按数量保留最近的快照；
+    用户逻辑备份由用户请求触发，每个用户单独按数量保留
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        backup_dir: str,
+        keep_count: int = 7,
+        user_keep_count: int = 5,
+        compress: bool = True,
+        pages_per_step: int = BACKUP_PAGES_PER_STEP,
+        step_sleep: float = BACKUP_STEP_SLEEP
+    ):
+        """
+        初始化备份管理器
+
+        Args:
+            db_path: 数据库文件路径
+            backup_dir: 备份目录
+            keep_count: 保留的整库快照数量
+            user_keep_count: 每个用户保留的逻辑备份数量
+            compress: 是否 gzip 压缩整库快照
+            pages_per_step: 每一步复制的页数
+            step_sleep: 每一步之间让出的时间（秒）
+        """
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.keep_count = keep_count
+        self.user_keep_count = user_keep_count
+        self.compress = compress
+        self.pages_per_step = pages_per_step
+        self.step_sleep = step_sleep
+
+        self._server_dir = os.path.join(backup_dir, "server")
+        self._users_dir = os.path.join(backup_dir, "users")
+        os.makedirs(self._server_dir, exist_ok=True)
+        os.makedirs(self._users_dir, exist_ok=True)
+
+        # 同一时间只运行一个整库备份
+        self._backup_lock = threading.Lock()
+        self._history: deque = deque(maxlen=BACKUP_HISTORY_SIZE)
+        self._stats = {
+            "runs": 0,
+            "failures": 0,
+            "user_backups": 0,
+        }
+
+    # ==================== 整库快照 ====================
+
+    def run_backup(self) -> Dict[str, Any]:
+        """
+        执行一次整库快照（同步，应在线程中调用）
+
+        Returns:
+            本次运行记录（文件名、大小、页数、耗时、吞吐量等）
+
+        Raises:
+            BackupInProgressError: 已有备份正在运行
+            BackupError: 备份失败
+        """
+        if not self._backup_lock.acquire(blocking=False):
+            raise BackupInProgressError("已有备份正在进行")
+
+        started = time.perf_counter()
+        started_at = datetime.now()
+        name = f"agrisalecl_{started_at.strftime('%Y%m%d_%H%M%S')}.db"
+        raw_path = os.path.join(self._server_dir, name + ".tmp")
+        compressed_tmp_path = os.path.join(self._server_dir, name + ".gz.tmp")
+        progress = {"steps": 0, "restarts": 0, "total": 0, "remaining": None}
+
+        def on_progress(status, remaining, total):
+            # 源库在复制过程中被其他连接修改时，备份会从头开始（剩余页数变大）
+            if progress["remaining"] is not None and remaining > progress["remaining"]:
+                progress["restarts"] += 1
+            progress["steps"] += 1
+            progress["remaining"] = remaining
+            progress["total"] = total
+
+        try:
+            source = sqlite3.connect(self.db_path, timeout=30)
+            target = sqlite3.connect(raw_path)
+            try:
+                source.backup(
+                    target,
+                    pages=self.pages_per_step,
+                    progress=on_progress,
+                    sleep=self.step_sleep
+                )
+            finally:
+                target.close()
+                source.close()
+            copy_seconds = time.perf_counter() - started
+            raw_size = os.path.getsize(raw_path)
+
+            if self.compress:
+                name += ".gz"
+                final_path = os.path.join(self._server_dir, name)
+                with open(raw_path, "rb") as src, gzip.open(compressed_tmp_path, "wb", compresslevel=6) as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                os.replace(compressed_tmp_path, final_path)
+                os.remove(raw_path)
+            else:
+                final_path = os.path.join(self._server_dir, name)
+                os.replace(raw_path, final_path)
+
+            duration = time.perf_counter() - started
+            record = {
+                "name": name,
+                "status": "completed",
+                "started_at": started_at.isoformat(),
+                "duration_seconds": round(duration, 3),
+                "copy_seconds": round(copy_seconds, 3),
+                "pages": progress["total"],
+                "steps": progress["steps"],
+                "restarts": progress["restarts"],
+                "db_bytes": raw_size,
+                "file_bytes": os.path.getsize(final_path),
+                "throughput_mb_per_second": round(raw_size / 1024 / 1024 / copy_seconds, 2) if copy_seconds > 0 else None,
+            }
+            self._stats["runs"] += 1
+            self._history.append(record)
+            self._apply_retention(self._server_dir, _SERVER_BACKUP_PATTERN, self.keep_count)
+
+            logger.info(
+                f"整库备份完成: {name}, 页数: {record['pages']}, 耗时: {record['duration_seconds']}秒, "
+                f"吞吐量: {record['throughput_mb_per_second']} MB/s"
+            )
+            return record
+
+        except Exception as e:
+            self._stats["failures"] += 1
+            self._history.append({
+                "name": name,
+                "status": "failed",
+                "started_at": started_at.isoformat(),
+                "duration_seconds": round(time.perf_counter() - started, 3),
+                "error": str(e),
+            })
+            for path in (raw_path, compressed_tmp_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            logger.error(f"整库备份失败: {e}", exc_info=True)
+            raise BackupError(f"整库备份失败: {e}")
+        finally:
+            self._backup_lock.release()
+
+    async def run_scheduler(self, interval_seconds: int):
+        """
+        后台调度任务：按间隔执行整库快照
+
+        Args:
+            interval_seconds: 备份间隔（秒）
+        """
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await asyncio.to_thread(self.run_backup)
+            except BackupError as e:
+                logger.warning(f"定时备份未完成: {e}")
+
+    def list_server_backups(self) -> List[Dict[str, Any]]:
+        """获取整库快照列表（按时间倒序）"""
+        return self._list_files(self._server_dir, _SERVER_BACKUP_PATTERN)
+
+    def get_server_backup_path(self, name: str) -> Optional[str]:
+        """
+        获取整库快照文件路径
+
+        Args:
+            name: 快照文件名
+
+        Returns:
+            文件路径，文件名无效或不存在时返回 None
+        """
+        if not _SERVER_BACKUP_PATTERN.match(name):
+            return None
+        path = os.path.join(self._server_dir, name)
+        return path if os.path.isfile(path) else None
+
+    # ==================== 用户逻辑备份 ====================
+
+    def create_user_backup(self, conn, user_id: int, username: str) -> Dict[str, Any]:
+        """
+        导出用户数据为 NDJSON 备份文件（同步，应在线程中调用）
+
+        Args:
+            conn: 数据库连接
+            user_id: 用户ID
+            username: 用户名
+
+        Returns:
+            备份文件信息
+        """
+        started = time.perf_counter()
+        user_dir = self._user_dir(user_id)
+        os.makedirs(user_dir, exist_ok=True)
+
+        name = f"user_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.urandom(3).hex()}.ndjson.gz"
+        path = os.path.join(user_dir, name)
+        counts: Dict[str, int] = {}
+
+        # 每次调用使用独立的临时文件，同一用户的并发备份互不干扰
+        fd, tmp_path = tempfile.mkstemp(dir=user_dir, prefix=".user_", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                lines = iter_export_lines(conn, user_id, username, counts=counts)
+                for block in iter_export_chunks(lines, compress=True):
+                    f.write(block)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self._stats["user_backups"] += 1
+        self._apply_retention(user_dir, _USER_BACKUP_PATTERN, self.user_keep_count)
+
+        return {
+            "name": name,
+            "size": os.path.getsize(path),
+            "rows": sum(counts.values()),
+            "counts": counts,
+            "duration_seconds": round(time.perf_counter() - started, 3),
+        }
+
+    def list_user_backups(self, user_id: int) -> List[Dict[str, Any]]:
+        """获取用户的逻辑备份列表（按时间倒序）"""
+        return self._list_files(self._user_dir(user_id), _USER_BACKUP_PATTERN)
+
+    def get_user_backup_path(self, user_id: int, name: str) -> Optional[str]:
+        """
+        获取用户备份文件路径
+
+        Args:
+            user_id: 用户ID
+            name: 备份文件名
+
+        Returns:
+            文件路径，文件名无效或不存在时返回 None
+        """
+        if not _USER_BACKUP_PATTERN.match(name):
+            return None
+        path = os.path.join(self._user_dir(user_id), name)
+        return path if os.path.isfile(path) else None
+
+    def delete_user_backup(self, user_id: int, name: str) -> bool:
+        """
+        删除用户备份文件
+
+        Returns:
+            是否删除成功
+        """
+        path = self.get_user_backup_path(user_id, name)
+        if path is None:
+            return False
+        os.remove(path)
+        return True
+
+    # ==================== 统计 ====================
+
+    def get_stats(self) -> dict:
+        """获取备份统计信息（含最近的运行记录）"""
+        history = list(self._history)
+        return {
+            **self._stats,
+            "running": self._backup_lock.locked(),
+            "keep_count": self.keep_count,
+            "last_run": history[-1] if history else None,
+            "history": history,
+        }
+
+    # ==================== 内部方法 ====================
+
+    def _user_dir(self, user_id: int) -> str:
+        return os.path.join(self._users_dir, str(int(user_id)))
+
+    @staticmethod
+    def _list_files(directory: str, pattern) -> List[Dict[str, Any]]:
+        if not os.path.isdir(directory):
+            return []
+        files = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and pattern.match(entry.name):
+                stat = entry.stat()
+                files.append({
+                    "name": entry.name,
+                    "size": stat.st_size,
+                    "modified_at": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+                })
+        # 文件名包含时间戳，按名称倒序即按时间倒序
+        files.sort(key=lambda item: item["name"], reverse=True)
+        return files
+
+    @classmethod
+    def _apply_retention(cls, directory: str, pattern, keep_count: int):
+        """只保留最新的 keep_count 个备份文件"""
+        if keep_count <= 0:
+            return
+        for item in cls._list_files(directory, pattern)[keep_count:]:
+            try:
+                os.remove(os.path.join(directory, item["name"]))
+                logger.info(f"已删除过期备份: {item['name']}")
+            except OSError as e:
+                logger.warning(f"删除过期备份失败: {item['name']}, {e}")
+
+
+# 全局备份管理器实例
+_manager: Optional[BackupManager] = None
+
+
+def init_backup_manager(db_path: str, backup_dir: str, **kwargs) -> BackupManager:
+    """
+    初始化全局备份管理器
+
+    Args:
+        db_path: 数据库文件路径
+        backup_dir: 备份目录
+        **kwargs: 其他备份管理器参数
+
+    Returns:
+        备份管理器实例
+    """
+    global _manager
+    if _manager is None:
+        _manager = BackupManager(db_path, backup_dir, **kwargs)
+    return _manager
+
+
+def get_backup_manager() -> BackupManager:
+    """
+    获取全局备份管理器实例
+
+    Raises:
+        RuntimeError: 如果备份管理器未初始化
+    """
+    if _manager is None:
+        raise RuntimeError("备份管理器未初始化，请先调用 init_backup_manager()")
+    return _manager
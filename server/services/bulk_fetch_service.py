@@ -0,0 +1,187 @@
+"""
+按ID批量查询服务
+客户端解析 customerId、supplierId 等引用时，一次请求取回所需的行，
+不再逐个请求详情，也不必为此下载整张表（/all）
+
+ID 列表以 JSON 数组作为唯一的参数传入（id IN (SELECT value FROM json_each(?))），
+按主键逐个查找；语句与 ID 个数无关，可复用语句缓存，也不受 SQLite 参数个数上限的限制
+
+各实体路由通过 register_by_ids 注册 GET/POST /by-ids 接口
+"""
+
+import json
+import logging
+from typing import Iterable, List, Optional, Type
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from pydantic import BaseModel
+
+from server.database import get_pool
+from server.middleware import get_current_user
+from server.models import BaseResponse, BulkIdsRequest
+from server.serialization import JSONBytesResponse, dumps, encode_rows, project_columns
+
+logger = logging.getLogger(__name__)
+
+# 每次最多查询的ID数量
+MAX_BULK_IDS = 1000
+
+
+def parse_ids(ids: str) -> List[int]:
+    """
+    解析逗号分隔的ID列表
+
+    Args:
+        ids: 逗号分隔的ID（如：1,2,3）
+
+    Returns:
+        ID 列表（按出现顺序，已去重）
+
+    Raises:
+        ValueError: 包含非整数或数量超过上限
+    """
+    result = []
+    for part in ids.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            result.append(int(part))
+        except ValueError:
+            raise ValueError(f"无效的ID: {part}")
+    return dedupe_ids(result)
+
+
+def dedupe_ids(ids: Iterable[int]) -> List[int]:
+    """
+    去重并检查数量
+
+    Raises:
+        ValueError: ID 为空或数量超过上限
+    """
+    result = list(dict.fromkeys(ids))
+    if not result:
+        raise ValueError("请提供至少一个ID")
+    if len(result) > MAX_BULK_IDS:
+        raise ValueError(f"一次最多查询 {MAX_BULK_IDS} 个ID")
+    return result
+
+
+def fetch_by_ids_response(
+    table: str,
+    model: Type[BaseModel],
+    user_id: int,
+    ids: List[int],
+    fields: Optional[str] = None,
+    message: str = "操作成功"
+) -> JSONBytesResponse:
+    """
+    按ID批量查询当前用户的记录
+
+    响应 data 为 {"items": [...], "missing": [...]}：items 按请求的ID顺序排列，
+    missing 为不存在或不属于当前用户的ID
+
+    Args:
+        table: 表名（由路由指定的常量，不能来自请求）
+        model: 响应模型（字段与表的列同名）
+        user_id: 用户ID
+        ids: 已去重的ID列表
+        fields: 只返回的字段（逗号分隔，必须包含 id 时才能按顺序排列，未包含时自动加上）
+        message: 响应消息
+
+    Raises:
+        ValueError: fields 包含无效字段
+    """
+    columns = project_columns(fields, model)
+    if "id" not in columns:
+        columns = ("id",) + columns
+
+    with get_pool().get_connection() as conn:
+        cursor = conn.execute(
+            f"""
+            SELECT {', '.join(columns)}
+            FROM {table}
+            WHERE userId = ? AND id IN (SELECT value FROM json_each(?))
+            """,
+            (user_id, json.dumps(ids))
+        )
+        items = encode_rows(cursor, model)
+
+    by_id = {item["id"]: item for item in items}
+    body = {
+        "success": True,
+        "message": message,
+        "data": {
+            "items": [by_id[item_id] for item_id in ids if item_id in by_id],
+            "missing": [item_id for item_id in ids if item_id not in by_id],
+        },
+    }
+    return JSONBytesResponse(dumps(body))
+
+
+def register_by_ids(router: APIRouter, table: str, model: Type[BaseModel], label: str):
+    """
+    在路由上注册按ID批量获取的接口：GET /by-ids?ids=1,2,3 和 POST /by-ids（请求体为 BulkIdsRequest）
+
+    必须在 /{id} 详情接口之前调用，否则 by-ids 会被当作ID匹配到详情接口
+
+    Args:
+        router: 实体的路由
+        table: 表名
+        model: 响应模型
+        label: 实体名称（用于接口说明和消息，如：产品、销售记录）
+    """
+
+    def by_ids_response(ids: List[int], fields: Optional[str], user_id: int):
+        try:
+            return fetch_by_ids_response(table, model, user_id, ids, fields=fields, message=f"批量获取{label}成功")
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
+        except Exception as e:
+            logger.error(f"批量获取{label}失败: {e}", exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"批量获取{label}失败: {str(e)}"
+            )
+
+    def get_by_ids(
+        ids: str = Query(..., description=f"{label}ID，逗号分隔（如：1,2,3，最多 {MAX_BULK_IDS} 个）"),
+        fields: Optional[str] = Query(None, description="只返回指定字段，逗号分隔（如：id,name）"),
+        current_user: dict = Depends(get_current_user)
+    ):
+        try:
+            id_list = parse_ids(ids)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
+        return by_ids_response(id_list, fields, current_user["user_id"])
+
+    def post_by_ids(
+        ids_request: BulkIdsRequest,
+        current_user: dict = Depends(get_current_user)
+    ):
+        return by_ids_response(dedupe_ids(ids_request.ids), ids_request.fields, current_user["user_id"])
+
+    # 接口名（OpenAPI 的 operationId）按表区分
+    get_by_ids.__name__ = f"get_{table}_by_ids"
+    post_by_ids.__name__ = f"post_{table}_by_ids"
+
+    router.add_api_route(
+        "/by-ids",
+        get_by_ids,
+        methods=["GET"],
+        response_model=BaseResponse,
+        description=f"按ID批量获取{label}（一次查询，结果按请求的ID顺序排列），返回 items 和不存在的ID（missing）"
+    )
+    router.add_api_route(
+        "/by-ids",
+        post_by_ids,
+        methods=["POST"],
+        response_model=BaseResponse,
+        description=f"按ID批量获取{label}（ID 较多时使用，请求体为 {{\"ids\": [...], \"fields\": \"...\"}}）"
+    )
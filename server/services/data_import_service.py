@@ -0,0 +1,597 @@
+"""
+数据导入服务
+先把备份数据分块写入附加的临时暂存库（不占用主库写锁），在暂存库中校验，
+最后用一个很短的事务删除旧数据并整体替换，旧ID到新ID的映射在替换时用 SQL 完成
+
+既支持一次性传入完整的 JSON 备份，也支持逐行解析的 NDJSON 流，
+每一行格式为 {"table": "<表名>", "data": {...}}（可选的首行 {"exportInfo": {...}}
+和末行 {"exportEnd": {...}}，与 GET /api/export 的输出一致）
+"""
+
+import json
+import logging
+import threading
+import time
+import zlib
+from typing import Optional, Dict, Any, List, Tuple, Iterable
+
+logger = logging.getLogger(__name__)
+
+# 导入顺序（被引用的表必须先于引用它的表导入）
+IMPORT_TABLES = [
+    "suppliers",
+    "customers",
+    "employees",
+    "products",
+    "purchases",
+    "sales",
+    "returns",
+    "income",
+    "remittance",
+]
+
+# 每次 executemany 写入的行数
+DEFAULT_CHUNK_SIZE = 5000
+
+# 暂存库的 schema 名称（ATTACH DATABASE '' 创建连接私有的临时库）
+STAGING_SCHEMA = "import_staging"
+
+# 需要记录 旧ID -> 新ID 映射的表
+_MAPPED_TABLES = ("suppliers", "customers", "employees", "products")
+
+# 各表导入的业务字段（不含 userId 和时间字段）
+_TABLE_COLUMNS = {
+    "suppliers": ("name", "note"),
+    "customers": ("name", "note"),
+    "employees": ("name", "note"),
+    "products": ("name", "description", "stock", "unit", "supplierId"),
+    "purchases": ("productName", "quantity", "purchaseDate", "supplierId", "totalPurchasePrice", "note"),
+    "sales": ("productName", "quantity", "saleDate", "customerId", "totalSalePrice", "note"),
+    "returns": ("productName", "quantity", "returnDate", "customerId", "totalReturnPrice", "note"),
+    "income": ("incomeDate", "customerId", "amount", "discount", "employeeId", "paymentMethod", "note"),
+    "remittance": ("remittanceDate", "supplierId", "amount", "employeeId", "paymentMethod", "note"),
+}
+
+# 引用字段 -> 被引用的表
+_REFERENCE_COLUMNS = {
+    "supplierId": "suppliers",
+    "customerId": "customers",
+    "employeeId": "employees",
+}
+
+# 有 updated_at 字段的表
+_UPDATED_AT_TABLES = ("suppliers", "customers", "employees", "products")
+
+# 暂存库中的校验（违反时拒绝导入）
+_VALIDATIONS = [
+    ("suppliers", "name IS NULL", "供应商名称不能为空"),
+    ("customers", "name IS NULL", "客户名称不能为空"),
+    ("employees", "name IS NULL", "员工名称不能为空"),
+    ("products", "name IS NULL", "产品名称不能为空"),
+    ("purchases", "productName IS NULL OR quantity IS NULL", "采购记录缺少产品名称或数量"),
+    ("sales", "productName IS NULL OR quantity IS NULL", "销售记录缺少产品名称或数量"),
+    ("returns", "productName IS NULL OR quantity IS NULL", "退货记录缺少产品名称或数量"),
+    ("income", "incomeDate IS NULL OR amount IS NULL", "进账记录缺少日期或金额"),
+    ("income", "paymentMethod NOT IN ('现金', '微信转账', '银行卡')", "进账记录的付款方式无效"),
+    ("remittance", "remittanceDate IS NULL OR amount IS NULL", "汇款记录缺少日期或金额"),
+    ("remittance", "paymentMethod NOT IN ('现金', '微信转账', '银行卡')", "汇款记录的付款方式无效"),
+]
+
+
+class DataImportError(ValueError):
+    """导入数据格式错误"""
+    pass
+
+
+def _mapped_column(column: str) -> str:
+    """
+    生成引用字段的映射表达式（:base_<表名> 为该表新ID的起点）
+
+    映射不到的ID置为 NULL，0 或空值保持原样（与逐行导入的行为一致）；
+    备份中有重复的旧ID时以最后一行为准
+    """
+    table = _REFERENCE_COLUMNS[column]
+    return (
+        f"CASE WHEN s.{column} IS NULL OR s.{column} = 0 THEN s.{column} "
+        f"ELSE (SELECT :base_{table} + MAX(m.sid) FROM {STAGING_SCHEMA}.{table} m "
+        f"WHERE m.orig_id = s.{column}) END"
+    )
+
+
+def _swap_insert_sql(table: str) -> str:
+    """生成把暂存表写入主库的 INSERT ... SELECT 语句"""
+    columns = _TABLE_COLUMNS[table]
+    insert_columns = ["userId", *columns, "created_at"]
+    select_columns = [":user_id"]
+    select_columns += [
+        _mapped_column(column) if column in _REFERENCE_COLUMNS else f"s.{column}"
+        for column in columns
+    ]
+    select_columns.append("datetime('now')")
+
+    if table in _UPDATED_AT_TABLES:
+        insert_columns.append("updated_at")
+        select_columns.append("datetime('now')")
+    if table == "products":
+        insert_columns.append("version")
+        select_columns.append("1")
+    if table in _MAPPED_TABLES:
+        # 新ID = 本表的起点 + 暂存行号，保证与映射表达式一致
+        insert_columns.insert(0, "id")
+        select_columns.insert(0, f":base_{table} + s.sid")
+
+    return (
+        f"INSERT INTO main.{table} ({', '.join(insert_columns)}) "
+        f"SELECT {', '.join(select_columns)} FROM {STAGING_SCHEMA}.{table} s ORDER BY s.sid"
+    )
+
+
+class DataImporter:
+    """
+    分块数据导入器（覆盖模式）
+
+    使用方式：
+        importer = DataImporter(conn, user_id)
+        importer.begin()
+        importer.add("suppliers", {...})
+        ...
+        counts = importer.finish()
+
+    行按表缓存，达到 chunk_size 或切换到下一张表时用 executemany 写入暂存库，
+    这一阶段不持有主库写锁。finish() 校验暂存数据后，在一个 BEGIN IMMEDIATE 事务中
+    删除当前用户的旧数据并用 INSERT ... SELECT 整体写入，持锁时间记录在 lock_hold_ms。
+    表必须按 IMPORT_TABLES 的顺序出现。
+    """
+
+    def __init__(
+        self,
+        conn,
+        user_id: int,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        progress: Optional[Dict[str, Any]] = None
+    ):
+        """
+        初始化导入器
+
+        Args:
+            conn: 数据库连接
+            user_id: 用户ID
+            chunk_size: 每次 executemany 写入的行数
+            progress: 导入进度字典（由 start_import_progress 创建，可选）
+        """
+        self.conn = conn
+        self.user_id = user_id
+        self.chunk_size = chunk_size
+        self.progress = progress
+
+        self.counts: Dict[str, int] = {table: 0 for table in IMPORT_TABLES}
+        self.lock_hold_ms: Optional[float] = None
+        self._table_index = -1
+        self._rows: List[tuple] = []
+        self._attached = False
+
+    # ==================== 事务控制 ====================
+
+    def begin(self):
+        """附加临时暂存库并创建暂存表"""
+        self.conn.commit()
+        self.conn.execute(f"ATTACH DATABASE '' AS {STAGING_SCHEMA}")
+        self._attached = True
+
+        for table in IMPORT_TABLES:
+            columns = list(_TABLE_COLUMNS[table])
+            if table in _MAPPED_TABLES:
+                columns.insert(0, "orig_id")
+            self.conn.execute(
+                f"CREATE TABLE {STAGING_SCHEMA}.{table} (sid INTEGER PRIMARY KEY, {', '.join(columns)})"
+            )
+
+    def finish(self) -> Dict[str, int]:
+        """
+        写入剩余的行，校验暂存数据并替换当前用户的数据
+
+        Returns:
+            各表导入的行数
+
+        Raises:
+            DataImportError: 暂存数据校验失败
+        """
+        try:
+            self._flush()
+            self.conn.commit()
+
+            self._set_status("validating")
+            self._validate()
+
+            self._set_status("swapping")
+            self._swap()
+        finally:
+            self._detach()
+
+        return dict(self.counts)
+
+    def abort(self):
+        """放弃导入（主库数据保持不变）"""
+        try:
+            self.conn.rollback()
+        except Exception as e:
+            logger.warning(f"回滚导入事务失败: {e}")
+        self._detach()
+
+    def _validate(self):
+        """在暂存库中校验数据，避免在持有写锁时才发现错误"""
+        # 建立旧ID索引，供替换时的映射子查询使用
+        for table in _MAPPED_TABLES:
+            self.conn.execute(
+                f"CREATE INDEX {STAGING_SCHEMA}.idx_{table}_orig_id ON {table} (orig_id)"
+            )
+
+        for table in _MAPPED_TABLES:
+            row = self.conn.execute(
+                f"""
+                SELECT name FROM {STAGING_SCHEMA}.{table}
+                GROUP BY name HAVING COUNT(*) > 1 LIMIT 1
+                """
+            ).fetchone()
+            if row is not None:
+                raise DataImportError(f"{table} 中存在重复的名称: {row[0]}")
+
+        for table, condition, message in _VALIDATIONS:
+            row = self.conn.execute(
+                f"SELECT COUNT(*) FROM {STAGING_SCHEMA}.{table} WHERE {condition}"
+            ).fetchone()
+            if row[0]:
+                raise DataImportError(f"{message}（{row[0]} 行）")
+
+        self.conn.commit()
+
+    def _swap(self):
+        """在一个短事务中删除旧数据并从暂存库写入新数据"""
+        self.conn.execute("BEGIN IMMEDIATE")
+        started = time.perf_counter()
+        try:
+            for table in reversed(IMPORT_TABLES):
+                self.conn.execute(f"DELETE FROM main.{table} WHERE userId = ?", (self.user_id,))
+
+            # 每张映射表的新ID从当前最大ID（含已删除的自增序号）之后开始
+            params = {"user_id": self.user_id}
+            for table in _MAPPED_TABLES:
+                row = self.conn.execute(
+                    f"""
+                    SELECT MAX(
+                        (SELECT COALESCE(MAX(id), 0) FROM main.{table}),
+                        COALESCE((SELECT seq FROM main.sqlite_sequence WHERE name = ?), 0)
+                    )
+                    """,
+                    (table,)
+                ).fetchone()
+                params[f"base_{table}"] = row[0]
+
+            for table in IMPORT_TABLES:
+                if self.counts[table]:
+                    self.conn.execute(_swap_insert_sql(table), params)
+
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            self.lock_hold_ms = round((time.perf_counter() - started) * 1000, 1)
+            if self.progress is not None:
+                self.progress["lock_hold_ms"] = self.lock_hold_ms
+
+    def _detach(self):
+        """分离暂存库（临时库随之删除）"""
+        if not self._attached:
+            return
+        try:
+            self.conn.rollback()
+            self.conn.execute(f"DETACH DATABASE {STAGING_SCHEMA}")
+        except Exception as e:
+            logger.warning(f"分离导入暂存库失败: {e}")
+        self._attached = False
+
+    def _set_status(self, status: str):
+        if self.progress is not None:
+            self.progress["status"] = status
+
+    # ==================== 写入 ====================
+
+    def add(self, table: str, record: Dict[str, Any]):
+        """
+        添加一行数据
+
+        Args:
+            table: 表名（必须是 IMPORT_TABLES 之一）
+            record: 备份中的行数据
+
+        Raises:
+            DataImportError: 表名无效、表顺序错误或行数据不是对象
+        """
+        if table not in _TABLE_COLUMNS:
+            raise DataImportError(f"不支持导入的表: {table}")
+        if not isinstance(record, dict):
+            raise DataImportError(f"{table} 的行数据必须是对象")
+
+        table_index = IMPORT_TABLES.index(table)
+        if table_index != self._table_index:
+            if table_index < self._table_index:
+                raise DataImportError(
+                    f"表 {table} 必须在 {IMPORT_TABLES[self._table_index]} 之前导入"
+                )
+            self._flush()
+            self._table_index = table_index
+            if self.progress is not None:
+                self.progress["current_table"] = table
+
+        self._rows.append(self._build_row(table, record))
+
+        if len(self._rows) >= self.chunk_size:
+            self._flush()
+
+    def add_many(self, items: Iterable[Tuple[str, Dict[str, Any]]]):
+        """
+        添加多行数据
+
+        Args:
+            items: (表名, 行数据) 序列
+        """
+        for table, record in items:
+            self.add(table, record)
+
+    def add_export(self, data: Dict[str, List[Any]]):
+        """
+        按导入顺序添加完整备份中的所有表
+
+        Args:
+            data: 备份数据（表名 -> 行列表）
+        """
+        for table in IMPORT_TABLES:
+            for record in data.get(table) or ():
+                self.add(table, record)
+
+    def _flush(self):
+        """将当前表缓存的行写入暂存库"""
+        if not self._rows:
+            return
+
+        table = IMPORT_TABLES[self._table_index]
+        rows = self._rows
+        self._rows = []
+
+        columns = list(_TABLE_COLUMNS[table])
+        if table in _MAPPED_TABLES:
+            columns.insert(0, "orig_id")
+        self.conn.executemany(
+            f"INSERT INTO {STAGING_SCHEMA}.{table} ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' * len(columns))})",
+            rows
+        )
+
+        self.counts[table] += len(rows)
+        if self.progress is not None:
+            self.progress["rows"] += len(rows)
+            self.progress["counts"][table] = self.counts[table]
+
+    @staticmethod
+    def _build_row(table: str, record: Dict[str, Any]) -> tuple:
+        """将备份中的行转换为暂存表的插入参数（引用字段保留旧ID，替换时再映射）"""
+        if table in ("suppliers", "customers", "employees"):
+            return (record.get('id'), record.get('name', ''), record.get('note'))
+
+        if table == "products":
+            # 处理 unit（可能是字符串或已经是正确的值）
+            unit = record.get('unit', '公斤')
+            if isinstance(unit, str) and unit not in ['斤', '公斤', '袋']:
+                unit = '公斤'
+            return (
+                record.get('id'),
+                record.get('name', ''),
+                record.get('description'),
+                record.get('stock', 0),
+                unit,
+                record.get('supplierId')
+            )
+
+        if table == "purchases":
+            # supplierId 为 0 表示未分配供应商
+            supplier_id = record.get('supplierId')
+            if supplier_id == 0:
+                supplier_id = None
+            return (
+                record.get('productName', ''),
+                record.get('quantity', 0),
+                record.get('purchaseDate'),
+                supplier_id,
+                record.get('totalPurchasePrice'),
+                record.get('note')
+            )
+
+        if table in ("sales", "returns"):
+            date_field, price_field = (
+                ("saleDate", "totalSalePrice") if table == "sales"
+                else ("returnDate", "totalReturnPrice")
+            )
+            return (
+                record.get('productName', ''),
+                record.get('quantity', 0),
+                record.get(date_field),
+                record.get('customerId'),
+                record.get(price_field),
+                record.get('note')
+            )
+
+        if table == "income":
+            return (
+                record.get('incomeDate'),
+                record.get('customerId'),
+                record.get('amount', 0),
+                record.get('discount', 0),
+                record.get('employeeId'),
+                record.get('paymentMethod', '现金'),
+                record.get('note')
+            )
+
+        # remittance
+        return (
+            record.get('remittanceDate'),
+            record.get('supplierId'),
+            record.get('amount', 0),
+            record.get('employeeId'),
+            record.get('paymentMethod', '现金'),
+            record.get('note')
+        )
+
+
+# ==================== NDJSON 解析 ====================
+
+class NDJSONParser:
+    """
+    增量 NDJSON 解析器
+
+    按网络分块输入字节，返回其中完整的行，不完整的行留到下一块。
+    支持 gzip 压缩的请求体（Content-Encoding: gzip）
+    """
+
+    def __init__(self, gzip: bool = False):
+        """
+        初始化解析器
+
+        Args:
+            gzip: 请求体是否经过 gzip 压缩
+        """
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzip else None
+        self._buffer = b""
+        self.line_number = 0
+        self.export_info: Optional[Dict[str, Any]] = None
+        self.export_end: Optional[Dict[str, Any]] = None
+
+    def feed(self, chunk: bytes) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        输入一块数据
+
+        Args:
+            chunk: 原始请求体分块
+
+        Returns:
+            解析出的 (表名, 行数据) 列表
+        """
+        if self._decompressor is not None:
+            try:
+                chunk = self._decompressor.decompress(chunk)
+            except zlib.error as e:
+                raise DataImportError(f"解压导入数据失败: {e}")
+
+        data = self._buffer + chunk
+        lines = data.split(b"\n")
+        self._buffer = lines.pop()
+        return self._parse_lines(lines)
+
+    def close(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        结束输入，解析最后一行
+
+        Returns:
+            解析出的 (表名, 行数据) 列表
+        """
+        if self._decompressor is not None:
+            self._buffer += self._decompressor.flush()
+        lines = [self._buffer]
+        self._buffer = b""
+        return self._parse_lines(lines)
+
+    def _parse_lines(self, lines: List[bytes]) -> List[Tuple[str, Dict[str, Any]]]:
+        items = []
+        for line in lines:
+            self.line_number += 1
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                obj = json.loads(line)
+            except ValueError as e:
+                raise DataImportError(f"第 {self.line_number} 行不是有效的 JSON: {e}")
+
+            if not isinstance(obj, dict):
+                raise DataImportError(f"第 {self.line_number} 行必须是 JSON 对象")
+
+            if "table" in obj:
+                items.append((obj["table"], obj.get("data")))
+            elif "exportInfo" in obj:
+                self.export_info = obj["exportInfo"]
+            elif "exportEnd" in obj:
+                self.export_end = obj["exportEnd"]
+            else:
+                raise DataImportError(f"第 {self.line_number} 行缺少 table 字段")
+
+        return items
+
+
+# ==================== 导入进度 ====================
+
+_progress_lock = threading.Lock()
+_import_progress: Dict[int, Dict[str, Any]] = {}
+
+
+def start_import_progress(user_id: int) -> Dict[str, Any]:
+    """
+    创建用户的导入进度记录（覆盖上一次的记录）
+
+    Args:
+        user_id: 用户ID
+
+    Returns:
+        进度字典（由 DataImporter 更新）
+    """
+    progress = {
+        "status": "running",
+        "current_table": None,
+        "rows": 0,
+        "bytes_received": 0,
+        "counts": {table: 0 for table in IMPORT_TABLES},
+        "error": None,
+        "lock_hold_ms": None,
+        "_started": time.perf_counter(),
+        "elapsed_seconds": 0.0,
+    }
+    with _progress_lock:
+        _import_progress[user_id] = progress
+    return progress
+
+
+def finish_import_progress(progress: Dict[str, Any], error: Optional[str] = None):
+    """
+    标记导入结束
+
+    Args:
+        progress: 进度字典
+        error: 错误信息（为 None 表示成功）
+    """
+    progress["status"] = "failed" if error else "completed"
+    progress["error"] = error
+    progress["elapsed_seconds"] = round(time.perf_counter() - progress["_started"], 3)
+
+
+def get_import_progress(user_id: int) -> Optional[Dict[str, Any]]:
+    """
+    获取用户最近一次导入的进度
+
+    Args:
+        user_id: 用户ID
+
+    Returns:
+        进度信息，没有导入记录时返回 None
+    """
+    with _progress_lock:
+        progress = _import_progress.get(user_id)
+        if progress is None:
+            return None
+        result = {key: value for key, value in progress.items() if not key.startswith("_")}
+        result["counts"] = dict(progress["counts"])
+
+    if result["status"] not in ("completed", "failed"):
+        result["elapsed_seconds"] = round(time.perf_counter() - progress["_started"], 3)
+    elapsed = result["elapsed_seconds"]
+    result["rows_per_second"] = round(result["rows"] / elapsed, 1) if elapsed > 0 else 0.0
+    return result
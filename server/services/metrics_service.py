@@ -0,0 +1,257 @@
+"""
+指标服务
+按路由模板统计请求数、状态码分类、耗时和请求/响应大小分布、正在处理的请求数，
+连同连接池统计一起以 Prometheus 文本格式输出（GET /metrics）
+
+采集开销：
+    - 每个路由（模板 + 方法）的计数器在第一次请求时创建并挂在路由对象上，
+      之后的请求不创建字典或字符串，只做整数累加和 bisect
+    - 计数器只在事件循环线程中更新，不需要加锁；
+      各路由正在处理的请求数和连接池统计在输出时才计算
+"""
+
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+from fastapi.routing import APIRoute
+
+# 请求耗时分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 请求/响应大小分桶（字节）
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# 指标名前缀
+METRIC_PREFIX = "agrisale"
+
+# 状态码分类（下标为 status // 100）
+_STATUS_CLASSES = ("other", "1xx", "2xx", "3xx", "4xx", "5xx")
+
+
+class Histogram:
+    """固定分桶的直方图（counts[i] 为落在第 i 个桶的次数，最后一个为 +Inf）"""
+
+    __slots__ = ("bounds", "counts", "total")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+
+class RouteMetrics:
+    """一个路由（模板 + 方法）的指标"""
+
+    __slots__ = ("route", "method", "status_counts", "latency", "request_size", "response_size")
+
+    def __init__(self, route: str, method: str):
+        self.route = route
+        self.method = method
+        self.status_counts = [0] * len(_STATUS_CLASSES)
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.request_size = Histogram(SIZE_BUCKETS)
+        self.response_size = Histogram(SIZE_BUCKETS)
+
+    def record(self, status_code: int, duration: float, request_bytes: int, response_bytes: int):
+        index = status_code // 100
+        self.status_counts[index if 0 < index < len(_STATUS_CLASSES) else 0] += 1
+        self.latency.observe(duration)
+        self.request_size.observe(request_bytes)
+        self.response_size.observe(response_bytes)
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._routes: List[RouteMetrics] = []
+        # 未匹配任何路由的请求（404、被中间件拦截的请求等）按方法汇总，避免按原始路径产生无限多的序列
+        self._unmatched: Dict[str, RouteMetrics] = {}
+        # 正在处理的请求（id(scope) -> scope），输出时按 scope["route"] 统计各路由正在处理的请求数
+        self.active: Dict[int, dict] = {}
+        self.started_at = time.time()
+
+    def for_scope(self, scope: dict) -> RouteMetrics:
+        """获取请求所属路由的指标（路由匹配之后 scope["route"] 为 APIRoute）"""
+        method = scope["method"]
+        route = scope.get("route")
+        if not isinstance(route, APIRoute):
+            return self.unmatched(method)
+        by_method = route.__dict__.get(_ROUTE_ATTR)
+        if by_method is None:
+            by_method = route.__dict__[_ROUTE_ATTR] = {}
+        metrics = by_method.get(method)
+        if metrics is None:
+            metrics = by_method[method] = RouteMetrics(route.path, method)
+            self._routes.append(metrics)
+        return metrics
+
+    def unmatched(self, method: str) -> RouteMetrics:
+        metrics = self._unmatched.get(method)
+        if metrics is None:
+            metrics = self._unmatched[method] = RouteMetrics("<unmatched>", method)
+        return metrics
+
+    def all_routes(self) -> List[RouteMetrics]:
+        return self._routes + list(self._unmatched.values())
+
+    def route_in_flight(self) -> Dict[int, int]:
+        """各路由正在处理的请求数（id(RouteMetrics) -> 数量），尚未匹配路由的请求计入 <unmatched>"""
+        counts: Dict[int, int] = {}
+        for scope in list(self.active.values()):
+            metrics = self.for_scope(scope)
+            counts[id(metrics)] = counts.get(id(metrics), 0) + 1
+        return counts
+
+
+# 路由对象上保存指标的属性名
+_ROUTE_ATTR = "_agrisale_metrics"
+
+# 全局注册表
+_registry = MetricsRegistry()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """获取全局指标注册表"""
+    return _registry
+
+
+class MetricsMiddleware:
+    """
+    指标中间件（ASGI）
+
+    应放在最外层：耗时包含其他中间件，响应大小为实际发送的字节数（压缩后）
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        response = [500, 0]  # 状态码、已发送的响应体字节数
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.body":
+                response[1] += len(message.get("body", b""))
+            elif message["type"] == "http.response.start":
+                response[0] = message["status"]
+            await send(message)
+
+        active = _registry.active
+        active[id(scope)] = scope
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            del active[id(scope)]
+            metrics = _registry.for_scope(scope)
+            metrics.record(response[0], time.perf_counter() - start, _content_length(scope), response[1])
+
+
+def _content_length(scope) -> int:
+    for name, value in scope["headers"]:
+        if name == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return 0
+    return 0
+
+
+# ==================== Prometheus 文本格式 ====================
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_bound(bound: float) -> str:
+    return repr(float(bound))
+
+
+def _histogram_lines(name: str, labels: str, histogram: Histogram, lines: List[str]):
+    cumulative = 0
+    for bound, count in zip(histogram.bounds, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{_format_bound(bound)}"}} {cumulative}')
+    cumulative += histogram.counts[-1]
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.total}")
+    lines.append(f"{name}_count{{{labels}}} {cumulative}")
+
+
+def _header(lines: List[str], name: str, metric_type: str, help_text: str):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {metric_type}")
+
+
+def render_metrics(pool_stats: Optional[dict] = None) -> str:
+    """
+    以 Prometheus 文本格式输出所有指标
+
+    只输出处理过请求（或正有请求在处理）的路由
+
+    Args:
+        pool_stats: 连接池统计（SQLiteConnectionPool.get_stats()）
+    """
+    p = METRIC_PREFIX
+    in_flight = _registry.route_in_flight()
+    routes = [
+        metrics for metrics in _registry.all_routes()
+        if id(metrics) in in_flight or any(metrics.status_counts)
+    ]
+    labels = {
+        id(metrics): f'method="{metrics.method}",route="{_escape(metrics.route)}"'
+        for metrics in routes
+    }
+    lines: List[str] = []
+
+    _header(lines, f"{p}_http_requests_total", "counter", "HTTP 请求数（按路由模板和状态码分类）")
+    for metrics in routes:
+        for status_class, count in zip(_STATUS_CLASSES, metrics.status_counts):
+            if count:
+                lines.append(f'{p}_http_requests_total{{{labels[id(metrics)]},status="{status_class}"}} {count}')
+
+    _header(lines, f"{p}_http_requests_in_flight", "gauge", "正在处理的 HTTP 请求数")
+    lines.append(f"{p}_http_requests_in_flight {len(_registry.active)}")
+
+    _header(lines, f"{p}_http_route_requests_in_flight", "gauge", "各路由正在处理的请求数")
+    for metrics in routes:
+        lines.append(f"{p}_http_route_requests_in_flight{{{labels[id(metrics)]}}} {in_flight.get(id(metrics), 0)}")
+
+    for name, attr, help_text in (
+        ("http_request_duration_seconds", "latency", "HTTP 请求耗时（秒）"),
+        ("http_request_size_bytes", "request_size", "请求体大小（字节，按 Content-Length）"),
+        ("http_response_size_bytes", "response_size", "响应体大小（字节，压缩后）"),
+    ):
+        _header(lines, f"{p}_{name}", "histogram", help_text)
+        for metrics in routes:
+            _histogram_lines(f"{p}_{name}", labels[id(metrics)], getattr(metrics, attr), lines)
+
+    if pool_stats is not None:
+        for name, metric_type, key, help_text in (
+            ("db_pool_connections_active", "gauge", "active_connections", "正在使用的数据库连接数"),
+            ("db_pool_connections_idle", "gauge", "pool_size", "连接池中空闲的连接数"),
+            ("db_pool_connections_max", "gauge", "max_connections", "最大连接数"),
+            ("db_pool_connections_created_total", "counter", "total_connections", "创建的连接数"),
+            ("db_pool_acquire_total", "counter", "acquire_count", "获取连接的次数"),
+            ("db_pool_acquire_wait_seconds_total", "counter", "acquire_wait_seconds", "获取连接的累计等待时间（秒）"),
+            ("db_pool_acquire_wait_max_seconds", "gauge", "acquire_wait_max_seconds", "获取连接的最长等待时间（秒）"),
+            ("db_pool_acquire_timeouts_total", "counter", "acquire_timeouts", "获取连接超时的次数"),
+            ("db_busy_errors_total", "counter", "busy_errors", "数据库锁定（SQLITE_BUSY）错误次数"),
+            ("db_retries_total", "counter", "retry_count", "数据库操作重试次数"),
+        ):
+            _header(lines, f"{p}_{name}", metric_type, help_text)
+            lines.append(f"{p}_{name} {pool_stats.get(key, 0)}")
+
+    _header(lines, f"{p}_process_start_time_seconds", "gauge", "进程启动时间（Unix 时间戳）")
+    lines.append(f"{p}_process_start_time_seconds {_registry.started_at}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,363 @@
+"""
+在线状态服务
+使用进程内存跟踪设备在线状态，心跳不再写入 SQLite
+
+过期由最小堆驱动（按过期时间排序，惰性删除），
+可选地定期将快照写入 online_users 表，便于重启后恢复
+"""
+
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 在线用户超时时间（秒），超过此时间未心跳视为离线
+# 设置为心跳间隔的 3 倍（心跳间隔 10 秒，超时 30 秒），确保有足够的容错时间
+ONLINE_TIMEOUT_SECONDS = 30  # 30 秒（约 3 个心跳周期）
+
+# 与 SQLite datetime('now') 一致的时间格式（UTC）
+_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class PresenceStore:
+    """
+    内存在线状态存储
+
+    数据结构：
+        _devices: {userId: {deviceId: entry}}，按用户索引，查询某账号的设备为 O(设备数)
+        _heap: [(expires_at, userId, deviceId)]，最小堆，过期检查只需查看堆顶
+
+    每次心跳都会向堆中压入新的过期时间，旧的堆项在弹出时与 entry 中的
+    expires_at 比对，不一致即视为已失效直接丢弃（惰性删除）
+    """
+
+    def __init__(self, timeout_seconds: int = ONLINE_TIMEOUT_SECONDS):
+        """
+        初始化在线状态存储
+
+        Args:
+            timeout_seconds: 心跳超时时间（秒）
+        """
+        self.timeout_seconds = timeout_seconds
+        self._devices: Dict[int, Dict[str, Dict[str, Any]]] = {}
+        self._heap: List[Tuple[float, int, str]] = []
+        self._lock = threading.Lock()
+        # 自上次快照以来是否有变化
+        self._dirty = False
+
+    # ==================== 写操作 ====================
+
+    def heartbeat(
+        self,
+        user_id: int,
+        device_id: str,
+        username: str,
+        current_action: Optional[str] = None,
+        platform: Optional[str] = None,
+        device_name: Optional[str] = None
+    ):
+        """
+        记录一次心跳（不存在则新增，存在则整体更新）
+
+        Args:
+            user_id: 用户ID
+            device_id: 设备ID
+            username: 用户名
+            current_action: 当前操作描述
+            platform: 设备平台
+            device_name: 设备名称
+        """
+        with self._lock:
+            entry = {
+                "userId": user_id,
+                "deviceId": device_id,
+                "username": username,
+                "current_action": current_action,
+                "platform": platform,
+                "device_name": device_name,
+            }
+            self._touch(entry)
+            self._devices.setdefault(user_id, {})[device_id] = entry
+            self._dirty = True
+
+    def update_action(self, user_id: int, username: str, current_action: Optional[str]):
+        """
+        更新账号下所有在线设备的当前操作，同时刷新心跳时间
+
+        如果该账号没有在线设备，则以默认设备加入在线列表
+
+        Args:
+            user_id: 用户ID
+            username: 用户名
+            current_action: 当前操作描述（None 表示清除）
+        """
+        with self._lock:
+            devices = self._devices.get(user_id)
+            if devices:
+                for entry in devices.values():
+                    entry["current_action"] = current_action
+                    self._touch(entry)
+                self._dirty = True
+                return
+
+        if username is not None:
+            self.heartbeat(user_id, "default", username, current_action=current_action)
+
+    def remove(self, user_id: int, device_id: Optional[str] = None) -> int:
+        """
+        移除在线记录
+
+        Args:
+            user_id: 用户ID
+            device_id: 设备ID（为 None 时移除该账号的所有设备）
+
+        Returns:
+            移除的记录数
+        """
+        with self._lock:
+            devices = self._devices.get(user_id)
+            if not devices:
+                return 0
+
+            if device_id is None:
+                removed = len(devices)
+                del self._devices[user_id]
+            elif devices.pop(device_id, None) is not None:
+                removed = 1
+                if not devices:
+                    del self._devices[user_id]
+            else:
+                removed = 0
+
+            if removed:
+                self._dirty = True
+            return removed
+
+    def expire(self) -> int:
+        """
+        清理已过期的在线记录
+
+        只弹出堆顶已到期的项，开销与过期项数量成正比
+
+        Returns:
+            清理的记录数
+        """
+        now = time.monotonic()
+        removed = 0
+
+        with self._lock:
+            heap = self._heap
+            while heap and heap[0][0] <= now:
+                expires_at, user_id, device_id = heapq.heappop(heap)
+                devices = self._devices.get(user_id)
+                if not devices:
+                    continue
+                entry = devices.get(device_id)
+                # 堆项已被更新的心跳取代
+                if entry is None or entry["_expires_at"] != expires_at:
+                    continue
+                del devices[device_id]
+                if not devices:
+                    del self._devices[user_id]
+                removed += 1
+
+            if removed:
+                self._dirty = True
+
+        return removed
+
+    # ==================== 读操作 ====================
+
+    def get_user_devices(self, user_id: int) -> List[Dict[str, Any]]:
+        """
+        获取账号下的在线设备（按最后心跳时间倒序）
+
+        Args:
+            user_id: 用户ID
+
+        Returns:
+            设备信息列表（字段与 OnlineUserResponse 一致）
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            devices = self._devices.get(user_id)
+            if not devices:
+                return []
+            alive = [entry for entry in devices.values() if entry["_expires_at"] > now]
+
+        alive.sort(key=lambda entry: entry["_expires_at"], reverse=True)
+        return [self._public(entry) for entry in alive]
+
+    def count(self, user_id: int) -> int:
+        """
+        获取账号下的在线设备数量
+
+        Args:
+            user_id: 用户ID
+
+        Returns:
+            在线设备数量
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            devices = self._devices.get(user_id)
+            if not devices:
+                return 0
+            return sum(1 for entry in devices.values() if entry["_expires_at"] > now)
+
+    def get_stats(self) -> dict:
+        """获取在线状态存储统计信息"""
+        with self._lock:
+            return {
+                "online_users": len(self._devices),
+                "online_devices": sum(len(devices) for devices in self._devices.values()),
+                "heap_size": len(self._heap),
+            }
+
+    # ==================== SQLite 快照 ====================
+
+    def snapshot(self, conn, force: bool = False) -> int:
+        """
+        将当前在线状态写入 online_users 表（整体替换）
+
+        Args:
+            conn: 数据库连接
+            force: 即使没有变化也写入
+
+        Returns:
+            写入的记录数，无变化时返回 -1
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            if not self._dirty and not force:
+                return -1
+            rows = [
+                (
+                    entry["userId"],
+                    entry["deviceId"],
+                    entry["username"],
+                    entry["last_heartbeat"],
+                    entry["current_action"],
+                    entry["platform"],
+                    entry["device_name"],
+                )
+                for devices in self._devices.values()
+                for entry in devices.values()
+                if entry["_expires_at"] > now
+            ]
+            self._dirty = False
+
+        try:
+            conn.execute("DELETE FROM online_users")
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO online_users
+                (userId, deviceId, username, last_heartbeat, current_action, platform, device_name)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows
+            )
+            conn.commit()
+        except Exception:
+            with self._lock:
+                self._dirty = True
+            raise
+
+        return len(rows)
+
+    def load(self, conn) -> int:
+        """
+        从 online_users 表恢复未过期的在线记录（用于服务重启）
+
+        Args:
+            conn: 数据库连接
+
+        Returns:
+            恢复的记录数
+        """
+        cursor = conn.execute(
+            """
+            SELECT userId, deviceId, username, last_heartbeat, current_action, platform, device_name
+            FROM online_users
+            WHERE datetime(last_heartbeat) > datetime('now', '-' || ? || ' seconds')
+            """,
+            (self.timeout_seconds,)
+        )
+        rows = cursor.fetchall()
+
+        utc_now = datetime.utcnow()
+        now = time.monotonic()
+        loaded = 0
+
+        with self._lock:
+            for row in rows:
+                try:
+                    last_heartbeat = datetime.strptime(row[3], _TIME_FORMAT)
+                except (TypeError, ValueError):
+                    continue
+
+                remaining = self.timeout_seconds - (utc_now - last_heartbeat).total_seconds()
+                if remaining <= 0:
+                    continue
+
+                entry = {
+                    "userId": row[0],
+                    "deviceId": row[1],
+                    "username": row[2],
+                    "current_action": row[4],
+                    "platform": row[5],
+                    "device_name": row[6],
+                    "last_heartbeat": row[3],
+                    "_expires_at": now + remaining,
+                }
+                heapq.heappush(self._heap, (entry["_expires_at"], entry["userId"], entry["deviceId"]))
+                self._devices.setdefault(entry["userId"], {})[entry["deviceId"]] = entry
+                loaded += 1
+
+        return loaded
+
+    # ==================== 内部方法 ====================
+
+    def _touch(self, entry: Dict[str, Any]):
+        """刷新心跳时间并压入新的过期堆项（调用方需持有锁）"""
+        expires_at = time.monotonic() + self.timeout_seconds
+        entry["last_heartbeat"] = datetime.utcnow().strftime(_TIME_FORMAT)
+        entry["_expires_at"] = expires_at
+        heapq.heappush(self._heap, (expires_at, entry["userId"], entry["deviceId"]))
+
+    @staticmethod
+    def _public(entry: Dict[str, Any]) -> Dict[str, Any]:
+        """去掉内部字段"""
+        return {
+            "userId": entry["userId"],
+            "deviceId": entry["deviceId"],
+            "username": entry["username"],
+            "last_heartbeat": entry["last_heartbeat"],
+            "current_action": entry["current_action"],
+            "platform": entry["platform"],
+            "device_name": entry["device_name"],
+        }
+
+
+# 全局在线状态存储实例
+_store: Optional[PresenceStore] = None
+
+
+def get_presence_store() -> PresenceStore:
+    """
+    获取全局在线状态存储实例（首次调用时创建）
+
+    Returns:
+        在线状态存储实例
+    """
+    global _store
+    if _store is None:
+        _store = PresenceStore()
+    return _store
@@ -0,0 +1,349 @@
+"""
+速率限制服务（令牌桶）
+每个用户、每个 IP 各有一个令牌桶：桶按固定速率补充令牌，请求按开销扣除令牌，令牌不足时拒绝。
+每次检查只读写一个键，与窗口内的请求数无关；空闲到桶已补满的键没有保存的必要，
+由后台清理任务定期删除，内存占用只与近期活跃的用户和 IP 数有关
+
+请求开销：普通请求（包括心跳）为 1；大分页（page_size 超过 1000）、导出、导入等重请求按 request_cost 计算
+
+后端：
+    - memory：进程内字典，单工作进程时使用
+    - sqlite：共享的 SQLite 文件，多个工作进程共用同一组令牌桶；
+      每次检查是一条 UPSERT ... RETURNING 语句，补充和扣除在同一条语句中原子完成
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+# 大分页的阈值（page_size 超过此值按大分页计算开销）
+LARGE_PAGE_SIZE = 1000
+
+# 各类请求的开销（令牌数）
+DEFAULT_COST = 1
+LARGE_PAGE_COST = 5
+EXPORT_COST = 10
+IMPORT_COST = 20
+
+# 重请求：(方法, 路径) 精确匹配，同一前缀下的轻量接口（如导入进度查询）按普通请求计算
+_HEAVY_ROUTES = {
+    ("POST", "/api/settings/import-data"): IMPORT_COST,
+    ("POST", "/api/settings/import-data/stream"): IMPORT_COST,
+    ("GET", "/api/export"): EXPORT_COST,
+}
+
+
+def request_cost(method: str, path: str, query_string: bytes) -> int:
+    """
+    计算请求的开销（令牌数）
+
+    Args:
+        method: 请求方法
+        path: 请求路径
+        query_string: 原始查询字符串
+    """
+    cost = _HEAVY_ROUTES.get((method, path.rstrip("/")))
+    if cost is not None:
+        return cost
+    if b"page_size" in query_string:
+        values = parse_qs(query_string.decode("latin-1")).get("page_size")
+        try:
+            if values and int(values[0]) > LARGE_PAGE_SIZE:
+                return LARGE_PAGE_COST
+        except ValueError:
+            pass
+    return DEFAULT_COST
+
+
+class RateLimit:
+    """令牌桶参数"""
+
+    __slots__ = ("per_minute", "burst", "rate", "idle_seconds")
+
+    def __init__(self, per_minute: float, burst: int):
+        """
+        Args:
+            per_minute: 每分钟补充的令牌数
+            burst: 桶容量（允许的突发请求开销）
+        """
+        self.per_minute = per_minute
+        self.burst = burst
+        self.rate = per_minute / 60.0
+        # 空闲超过此时间的桶已补满，可以删除
+        self.idle_seconds = burst / self.rate
+
+
+class MemoryRateLimitBackend:
+    """进程内令牌桶（键 -> [令牌数, 更新时间]）"""
+
+    name = "memory"
+    blocking = False
+
+    def __init__(self):
+        self._buckets: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, cost: float, limit: RateLimit, now: float) -> float:
+        """
+        扣除令牌
+
+        Returns:
+            0 表示允许；否则为令牌足够还需等待的秒数
+        """
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = limit.burst
+            else:
+                tokens = min(limit.burst, bucket[0] + (now - bucket[1]) * limit.rate)
+            if tokens >= cost:
+                self._buckets[key] = [tokens - cost, now]
+                return 0.0
+            self._buckets[key] = [tokens, now]
+            return (cost - tokens) / limit.rate
+
+    def refund(self, key: str, cost: float, limit: RateLimit):
+        """退还已扣除的令牌（不超过桶容量）"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket[0] = min(limit.burst, bucket[0] + cost)
+
+    def evict(self, idle_before: Dict[str, float]) -> int:
+        """
+        删除空闲的键
+
+        Args:
+            idle_before: 键前缀 -> 更新时间早于此值的键可以删除
+        """
+        with self._lock:
+            expired = [
+                key for key, (_, updated) in self._buckets.items()
+                if updated < idle_before.get(key.split(":", 1)[0], 0)
+            ]
+            for key in expired:
+                del self._buckets[key]
+            return len(expired)
+
+    def size(self) -> int:
+        return len(self._buckets)
+
+    def close(self):
+        pass
+
+
+class SQLiteRateLimitBackend:
+    """
+    共享 SQLite 文件中的令牌桶（多个工作进程共用）
+
+    时间使用墙钟时间（各进程的单调时钟不可比较）；数据只是限流状态，
+    不需要持久化保证，使用 WAL 和 synchronous=OFF 降低写入开销
+    """
+
+    name = "sqlite"
+    # 每次检查是一次文件写入（可能等待其他进程释放写锁），不应在事件循环中执行
+    blocking = True
+
+    # 补满后再扣除；已有的键令牌不足时 WHERE 不成立，不更新也不返回行
+    _ACQUIRE_SQL = """
+        INSERT INTO rate_limits (key, tokens, updated) VALUES (:key, :burst - :cost, :now)
+        ON CONFLICT(key) DO UPDATE SET
+            tokens = MIN(:burst, tokens + (:now - updated) * :rate) - :cost,
+            updated = :now
+        WHERE MIN(:burst, tokens + (:now - updated) * :rate) >= :cost
+        RETURNING tokens
+    """
+
+    def __init__(self, db_path: str, busy_timeout: int = 1000):
+        """
+        Args:
+            db_path: 共享数据库文件路径
+            busy_timeout: 等待其他进程释放写锁的时间（毫秒）
+        """
+        self.db_path = db_path
+        self._conn = sqlite3.connect(
+            db_path,
+            timeout=busy_timeout / 1000.0,
+            check_same_thread=False,
+            isolation_level=None  # 自动提交：每条语句即一个事务
+        )
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = OFF")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, cost: float, limit: RateLimit, now: float) -> float:
+        """扣除令牌（返回值同 MemoryRateLimitBackend.acquire）"""
+        params = {"key": key, "cost": cost, "burst": limit.burst, "rate": limit.rate, "now": now}
+        with self._lock:
+            if self._conn.execute(self._ACQUIRE_SQL, params).fetchone() is not None:
+                return 0.0
+            row = self._conn.execute(
+                "SELECT MIN(:burst, tokens + (:now - updated) * :rate) FROM rate_limits WHERE key = :key",
+                params
+            ).fetchone()
+        tokens = row[0] if row else 0.0
+        return max((cost - tokens) / limit.rate, 0.001)
+
+    def refund(self, key: str, cost: float, limit: RateLimit):
+        """退还已扣除的令牌（参数同 MemoryRateLimitBackend.refund）"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE rate_limits SET tokens = MIN(?, tokens + ?) WHERE key = ?",
+                (limit.burst, cost, key)
+            )
+
+    def evict(self, idle_before: Dict[str, float]) -> int:
+        """删除空闲的键（参数同 MemoryRateLimitBackend.evict）"""
+        deleted = 0
+        with self._lock:
+            for prefix, before in idle_before.items():
+                deleted += self._conn.execute(
+                    "DELETE FROM rate_limits WHERE key >= ? AND key < ? AND updated < ?",
+                    (f"{prefix}:", f"{prefix};", before)
+                ).rowcount
+        return deleted
+
+    def size(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM rate_limits").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RateLimiter:
+    """按用户和 IP 限流"""
+
+    def __init__(self, backend, user_limit: RateLimit, ip_limit: RateLimit):
+        self.backend = backend
+        # 检查是否会阻塞（为 True 时调用方应在线程池中调用 check）
+        self.blocking = backend.blocking
+        self.limits = {"user": user_limit, "ip": ip_limit}
+        # sqlite 后端在多个进程间共享，使用墙钟时间
+        self._clock = time.time if isinstance(backend, SQLiteRateLimitBackend) else time.monotonic
+        self._stats = {
+            "allowed": 0,
+            "rejected": 0,
+            "evicted": 0,
+        }
+
+    def check(self, user_id: Optional[int], ip: str, cost: float) -> float:
+        """
+        检查并扣除请求开销（先用户后 IP，开销超过桶容量时按桶容量计算）
+
+        被任一个桶拒绝时，已从前面的桶扣除的令牌会退还，被拒绝的请求不消耗任何桶的令牌
+
+        Args:
+            user_id: 用户ID（未认证的请求为 None）
+            ip: 客户端 IP
+            cost: 请求开销
+
+        Returns:
+            0 表示允许；否则为建议的重试等待秒数
+        """
+        now = self._clock()
+        keys = [("ip", ip)] if user_id is None else [("user", user_id), ("ip", ip)]
+        debited = []
+        for kind, identifier in keys:
+            limit = self.limits[kind]
+            key, amount = f"{kind}:{identifier}", min(cost, limit.burst)
+            retry_after = self.backend.acquire(key, amount, limit, now)
+            if retry_after:
+                for debited_key, debited_amount, debited_limit in debited:
+                    self.backend.refund(debited_key, debited_amount, debited_limit)
+                self._stats["rejected"] += 1
+                return retry_after
+            debited.append((key, amount, limit))
+        self._stats["allowed"] += 1
+        return 0.0
+
+    def evict_idle(self) -> int:
+        """删除空闲到令牌已补满的键（由后台清理任务定期调用）"""
+        now = self._clock()
+        evicted = self.backend.evict({kind: now - limit.idle_seconds for kind, limit in self.limits.items()})
+        self._stats["evicted"] += evicted
+        return evicted
+
+    def get_stats(self) -> dict:
+        return {
+            **self._stats,
+            "backend": self.backend.name,
+            "keys": self.backend.size(),
+            "user_limit": {"per_minute": self.limits["user"].per_minute, "burst": self.limits["user"].burst},
+            "ip_limit": {"per_minute": self.limits["ip"].per_minute, "burst": self.limits["ip"].burst},
+        }
+
+    def close(self):
+        self.backend.close()
+
+
+# 全局实例（未启用速率限制时为 None）
+_rate_limiter: Optional[RateLimiter] = None
+
+
+def init_rate_limiter(
+    backend: str = "memory",
+    db_path: Optional[str] = None,
+    per_minute: float = 300,
+    burst: int = 100,
+    ip_per_minute: float = 600,
+    ip_burst: int = 200
+) -> RateLimiter:
+    """
+    初始化全局速率限制器
+
+    Args:
+        backend: memory 或 sqlite
+        db_path: sqlite 后端的共享数据库文件路径
+        per_minute: 每个用户每分钟补充的令牌数
+        burst: 每个用户的桶容量
+        ip_per_minute: 每个 IP 每分钟补充的令牌数
+        ip_burst: 每个 IP 的桶容量
+
+    Raises:
+        ValueError: 后端无效或 sqlite 后端未指定数据库文件
+    """
+    global _rate_limiter
+    if backend == "memory":
+        store = MemoryRateLimitBackend()
+    elif backend == "sqlite":
+        if not db_path:
+            raise ValueError("sqlite 速率限制后端需要指定数据库文件路径")
+        store = SQLiteRateLimitBackend(db_path)
+    else:
+        raise ValueError(f"无效的速率限制后端: {backend}（可选 memory、sqlite）")
+
+    if _rate_limiter is not None:
+        _rate_limiter.close()
+    _rate_limiter = RateLimiter(store, RateLimit(per_minute, burst), RateLimit(ip_per_minute, ip_burst))
+    logger.info(
+        f"速率限制已启用（{store.name}）: 每个用户 {per_minute}/分钟（突发 {burst}），"
+        f"每个 IP {ip_per_minute}/分钟（突发 {ip_burst}）"
+    )
+    return _rate_limiter
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    """获取全局速率限制器（未启用时为 None）"""
+    return _rate_limiter
+
+
+def shutdown_rate_limiter():
+    """关闭全局速率限制器"""
+    global _rate_limiter
+    if _rate_limiter is not None:
+        _rate_limiter.close()
+        _rate_limiter = None
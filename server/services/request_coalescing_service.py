@@ -0,0 +1,147 @@
+"""
+请求合并服务（single-flight）
+同一用户的相同读请求（接口和查询参数相同）同时到达时只执行一次，
+后到的请求等待正在执行的那一次并共享其结果（包括异常）
+
+常见场景：同一账号的手机、平板和电脑在收到变更通知或恢复前台后同时刷新同一列表
+
+被装饰的路由函数应为同步函数（def）：查询在线程池中执行，事件循环在此期间可以接收其他请求，
+相同的请求才有机会等待同一次执行（在事件循环中直接查询数据库的 async 函数会阻塞到执行结束）
+
+合并键包含相关表的数据版本号（见 SQLiteConnectionPool.get_data_versions）：
+写入提交之后到达的请求不会合并到写入之前开始的执行上，不会拿到旧数据
+"""
+
+import asyncio
+import functools
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable
+
+from fastapi.concurrency import run_in_threadpool
+
+from server.database import get_pool, in_read_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    按键合并并发执行
+
+    执行放在独立的任务中：发起执行的请求断开（被取消）时，仍在等待的请求不受影响
+    """
+
+    def __init__(self):
+        self._calls: Dict[tuple, asyncio.Task] = {}
+        self._stats = {
+            "executions": 0,
+            "coalesced": 0,
+        }
+
+    async def do(self, key: tuple, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行 func，若相同键的执行正在进行则等待其结果
+
+        Args:
+            key: 合并键（必须可哈希）
+            func: 无参数的协程函数
+
+        Returns:
+            func 的返回值
+        """
+        task = self._calls.get(key)
+        if task is not None:
+            self._stats["coalesced"] += 1
+        else:
+            self._stats["executions"] += 1
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(functools.partial(self._on_done, key))
+        return await asyncio.shield(task)
+
+    def _on_done(self, key: tuple, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # 所有等待者都已断开时，避免出现 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    def get_stats(self) -> dict:
+        """获取合并统计信息（coalesced 即节省的执行次数）"""
+        lookups = self._stats["executions"] + self._stats["coalesced"]
+        return {
+            **self._stats,
+            "in_flight": len(self._calls),
+            "saved_ratio": round(self._stats["coalesced"] / lookups, 4) if lookups else 0.0,
+        }
+
+
+# 全局实例（只在事件循环线程中使用，不需要加锁）
+_single_flight = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    """获取全局请求合并实例"""
+    return _single_flight
+
+
+def _normalize_param(value: Any) -> Any:
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalize_param(item) for item in value)
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+async def call_endpoint(func: Callable, args: tuple, kwargs: Dict[str, Any]) -> Any:
+    """调用路由函数：协程函数直接等待，同步函数在线程池中执行"""
+    if asyncio.iscoroutinefunction(func):
+        return await func(*args, **kwargs)
+    return await run_in_threadpool(func, *args, **kwargs)
+
+
+def request_key(endpoint: str, kwargs: Dict[str, Any], tables: Iterable[str]) -> tuple:
+    """
+    构建请求键：(用户ID, 接口, 规范化的查询参数, 相关表的数据版本号)
+
+    Args:
+        endpoint: 接口标识
+        kwargs: 路由函数的参数（必须包含 current_user，其余参数必须可哈希）
+        tables: 响应内容依赖的表
+    """
+    params = tuple(sorted(
+        (name, _normalize_param(value))
+        for name, value in kwargs.items()
+        if name != "current_user"
+    ))
+    return (kwargs["current_user"]["user_id"], endpoint, params, get_pool().get_data_versions(tables))
+
+
+def coalesce_requests(*tables: str):
+    """
+    路由装饰器：合并同一用户并发的相同读请求
+
+    只用于读接口，被装饰的函数必须有 current_user 参数；stream=true 的流式响应（响应体只能发送一次）
+    和只读快照中的请求（见 /api/batch）不合并。需放在 @router.get(...) 之下：
+
+        @router.get("", response_model=BaseResponse)
+        @coalesce_requests("operation_logs")
+        def get_audit_logs(..., current_user: dict = Depends(get_current_user)):
+            ...
+
+    Args:
+        tables: 响应内容依赖的表
+    """
+    def decorator(func):
+        endpoint = f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if kwargs.get("stream") or in_read_snapshot():
+                return await call_endpoint(func, args, kwargs)
+            key = request_key(endpoint, kwargs, tables)
+            return await get_single_flight().do(key, lambda: call_endpoint(func, args, kwargs))
+
+        return wrapper
+
+    return decorator
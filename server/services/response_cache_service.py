@@ -0,0 +1,205 @@
+"""
+响应缓存服务
+缓存开销较大的 GET 接口的响应体（已编码的 JSON 字节），两次写入之间的重复请求直接返回缓存
+
+缓存键为 (用户ID, 接口, 规范化的查询参数, 相关表的数据版本号)。
+表被写入并提交后连接池会递增其数据版本号（见 SQLiteConnectionPool.get_data_versions），
+之后的请求使用新的键，旧条目不再命中并按 LRU 淘汰，因此不需要在写接口中手动失效。
+数据版本号只反映本进程内的写入，以多个工作进程运行时应关闭缓存（RESPONSE_CACHE_MAX_ENTRIES=0）。
+"""
+
+import functools
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+
+from server.database import in_read_snapshot
+from server.tracing import span
+
+from server.serialization import JSONBytesResponse, dumps
+from server.services.request_coalescing_service import call_endpoint, get_single_flight, request_key
+
+logger = logging.getLogger(__name__)
+
+# 默认最大条目数
+RESPONSE_CACHE_MAX_ENTRIES = 1000
+
+# 默认最大内存占用（字节）
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# 每个条目除响应体之外的估计开销（键、字典节点等，字节）
+_ENTRY_OVERHEAD = 256
+
+
+class ResponseCache:
+    """
+    LRU 响应缓存（按条目数和响应体总字节数淘汰）
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES
+    ):
+        """
+        初始化响应缓存
+
+        Args:
+            max_entries: 最大条目数（0 表示关闭缓存）
+            max_bytes: 最大内存占用（字节），单个响应超过其 1/4 时不缓存
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, Tuple[bytes, str]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "skipped_too_large": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def get(self, key: tuple) -> Optional[Tuple[bytes, str]]:
+        """
+        查找缓存
+
+        Returns:
+            (响应体, 媒体类型)，未命中时返回 None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry
+
+    def put(self, key: tuple, body: bytes, media_type: str):
+        """写入缓存，超出条目数或内存上限时淘汰最久未使用的条目"""
+        size = len(body) + _ENTRY_OVERHEAD
+        with self._lock:
+            if size > self.max_bytes // 4:
+                self._stats["skipped_too_large"] += 1
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0]) + _ENTRY_OVERHEAD
+            self._entries[key] = (body, media_type)
+            self._bytes += size
+            self._stats["stores"] += 1
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (evicted_body, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted_body) + _ENTRY_OVERHEAD
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> dict:
+        """获取缓存统计信息（命中率、条目数、内存占用）"""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "enabled": self.enabled,
+                "hit_ratio": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+# 全局响应缓存实例
+_cache = ResponseCache()
+
+
+def init_response_cache(**kwargs) -> ResponseCache:
+    """
+    按配置重新创建全局响应缓存
+
+    Args:
+        **kwargs: ResponseCache 参数
+
+    Returns:
+        响应缓存实例
+    """
+    global _cache
+    _cache = ResponseCache(**kwargs)
+    return _cache
+
+
+def get_response_cache() -> ResponseCache:
+    """获取全局响应缓存实例"""
+    return _cache
+
+
+def cached_response(*tables: str):
+    """
+    路由装饰器：按 (用户, 接口, 查询参数, 表的数据版本号) 缓存响应体
+
+    只用于读接口，被装饰的函数必须有 current_user 参数；未命中时同时到达的相同请求只执行一次
+    （见 request_coalescing_service，同步的路由函数在线程池中执行）。
+    stream=true 的流式响应和只读快照中的请求不缓存也不合并。需放在 @router.get(...) 之下：
+
+        @router.get("", response_model=BaseResponse)
+        @cached_response("sales")
+        def get_sales(..., current_user: dict = Depends(get_current_user)):
+            ...
+
+    Args:
+        tables: 响应内容依赖的表
+    """
+    def decorator(func):
+        endpoint = f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            # 只读快照中读到的可能是比当前版本号更早的数据，不能写入或读取缓存
+            if kwargs.get("stream") or in_read_snapshot():
+                return await call_endpoint(func, args, kwargs)
+
+            # 必须在查询之前读取版本号：查询期间发生的写入会使本次结果以旧版本号缓存，不会被之后的请求命中
+            key = request_key(endpoint, kwargs, tables)
+            cache = get_response_cache()
+
+            if cache.enabled:
+                entry = cache.get(key)
+                if entry is not None:
+                    body, media_type = entry
+                    return Response(body, media_type=media_type, headers={"X-Cache": "HIT"})
+
+            async def execute():
+                result = await call_endpoint(func, args, kwargs)
+                if isinstance(result, JSONBytesResponse):
+                    response = result
+                elif isinstance(result, Response):
+                    return result
+                else:
+                    with span("serialize"):
+                        response = JSONBytesResponse(dumps(jsonable_encoder(result)))
+                if cache.enabled and response.status_code == 200:
+                    cache.put(key, bytes(response.body), response.media_type)
+                response.headers["X-Cache"] = "MISS"
+                return response
+
+            # 未命中时合并同一用户并发的相同请求（关闭缓存时同样生效）
+            return await get_single_flight().do(key, execute)
+
+        return wrapper
+
+    return decorator
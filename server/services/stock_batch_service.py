@@ -0,0 +1,224 @@
+"""
+库存单据批量创建服务
+一次请求创建多行销售/采购/退货记录，所有行在同一个事务中校验、插入并更新库存
+"""
+
+import logging
+from typing import Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+# 每种单据的表结构与库存方向
+# stock_sign: 1 表示增加库存（采购、退货），-1 表示减少库存（销售）
+STOCK_RECORD_CONFIGS = {
+    "sale": {
+        "table": "sales",
+        "date_field": "saleDate",
+        "price_field": "totalSalePrice",
+        "party_field": "customerId",
+        "party_table": "customers",
+        "party_error": "客户不存在或无权限访问",
+        "zero_party_is_none": False,
+        "stock_sign": -1,
+    },
+    "purchase": {
+        "table": "purchases",
+        "date_field": "purchaseDate",
+        "price_field": "totalPurchasePrice",
+        "party_field": "supplierId",
+        "party_table": "suppliers",
+        "party_error": "供应商不存在或无权限访问",
+        # 采购的 supplierId 为 0 表示未分配供应商
+        "zero_party_is_none": True,
+        "stock_sign": 1,
+    },
+    "return": {
+        "table": "returns",
+        "date_field": "returnDate",
+        "price_field": "totalReturnPrice",
+        "party_field": "customerId",
+        "party_table": "customers",
+        "party_error": "客户不存在或无权限访问",
+        "zero_party_is_none": False,
+        "stock_sign": 1,
+    },
+}
+
+
+class BatchValidationError(Exception):
+    """批量校验失败（包含每一行的错误信息）"""
+
+    def __init__(self, errors: List[Dict[str, Any]]):
+        super().__init__(f"{len(errors)} 行校验失败")
+        self.errors = errors
+
+
+class BatchConflictError(Exception):
+    """批量写入时库存已被其他操作修改"""
+    pass
+
+
+def _stock_error(entity_type: str, stock: float, quantity: float) -> str:
+    """生成与单条创建接口一致的库存不足提示"""
+    if entity_type == "sale":
+        return f"库存不足，当前库存: {stock}，无法销售 {quantity}"
+    return f"库存不足，当前库存: {stock}，无法退货 {abs(quantity)}"
+
+
+def create_stock_records(
+    conn,
+    user_id: int,
+    entity_type: str,
+    lines: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """
+    批量创建库存单据（全部成功或全部失败）
+
+    使用 BEGIN IMMEDIATE 先取得写锁，再用一次 IN 查询取出所有涉及的产品和往来单位，
+    逐行校验（同一产品多行时按累计库存校验），然后用 executemany 插入记录并更新库存
+
+    Args:
+        conn: 数据库连接
+        user_id: 用户ID
+        entity_type: 单据类型（sale/purchase/return）
+        lines: 单据行（字段与单条创建请求一致）
+
+    Returns:
+        创建的记录列表（按请求顺序）
+
+    Raises:
+        BatchValidationError: 任意一行校验失败
+        BatchConflictError: 库存被并发修改（乐观锁校验失败）
+    """
+    config = STOCK_RECORD_CONFIGS[entity_type]
+    table = config["table"]
+    date_field = config["date_field"]
+    price_field = config["price_field"]
+    party_field = config["party_field"]
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # 1. 一次查询取出所有涉及的产品
+        product_names = sorted({line["productName"] for line in lines})
+        placeholders = ", ".join("?" * len(product_names))
+        cursor = conn.execute(
+            f"SELECT id, name, stock, version FROM products WHERE userId = ? AND name IN ({placeholders})",
+            (user_id, *product_names)
+        )
+        products = {row[1]: row for row in cursor.fetchall()}
+
+        # 2. 一次查询校验所有往来单位（客户/供应商）
+        party_ids = set()
+        for line in lines:
+            party_id = line.get(party_field)
+            if party_id == 0 and config["zero_party_is_none"]:
+                party_id = None
+            if party_id is not None:
+                party_ids.add(party_id)
+
+        valid_party_ids = set()
+        if party_ids:
+            placeholders = ", ".join("?" * len(party_ids))
+            cursor = conn.execute(
+                f"SELECT id FROM {config['party_table']} WHERE userId = ? AND id IN ({placeholders})",
+                (user_id, *party_ids)
+            )
+            valid_party_ids = {row[0] for row in cursor.fetchall()}
+
+        # 3. 逐行校验，按累计库存计算每个产品的最终库存
+        running_stock = {name: row[2] for name, row in products.items()}
+        errors = []
+        insert_rows = []
+
+        for index, line in enumerate(lines):
+            product_name = line["productName"]
+            quantity = line["quantity"]
+
+            if product_name not in products:
+                errors.append({
+                    "index": index,
+                    "productName": product_name,
+                    "error": f"产品 '{product_name}' 不存在"
+                })
+                continue
+
+            party_id = line.get(party_field)
+            if party_id == 0 and config["zero_party_is_none"]:
+                party_id = None
+            if party_id is not None and party_id not in valid_party_ids:
+                errors.append({
+                    "index": index,
+                    "productName": product_name,
+                    "error": config["party_error"]
+                })
+                continue
+
+            new_stock = running_stock[product_name] + config["stock_sign"] * quantity
+            if new_stock < 0:
+                errors.append({
+                    "index": index,
+                    "productName": product_name,
+                    "error": _stock_error(entity_type, running_stock[product_name], quantity)
+                })
+                continue
+
+            running_stock[product_name] = new_stock
+            insert_rows.append((
+                user_id,
+                product_name,
+                quantity,
+                party_id,
+                line.get(date_field),
+                line.get(price_field),
+                line.get("note")
+            ))
+
+        if errors:
+            raise BatchValidationError(errors)
+
+        # 4. 批量插入记录（写锁已持有，新记录的 ID 一定大于当前最大 ID）
+        max_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+        conn.executemany(
+            f"""
+            INSERT INTO {table} (userId, productName, quantity, {party_field}, {date_field}, {price_field}, note, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'))
+            """,
+            insert_rows
+        )
+
+        # 5. 每个产品只更新一次库存（使用乐观锁）
+        stock_rows = [
+            (running_stock[name], products[name][0], user_id, products[name][3])
+            for name in product_names
+            if name in products
+        ]
+        update_cursor = conn.executemany(
+            """
+            UPDATE products
+            SET stock = ?, version = version + 1, updated_at = datetime('now')
+            WHERE id = ? AND userId = ? AND version = ?
+            """,
+            stock_rows
+        )
+        if update_cursor.rowcount != len(stock_rows):
+            raise BatchConflictError("产品库存已被其他操作修改，请刷新后重试")
+
+        cursor = conn.execute(
+            f"""
+            SELECT id, userId, productName, quantity, {party_field}, {date_field},
+                   {price_field}, note, created_at
+            FROM {table}
+            WHERE userId = ? AND id > ?
+            ORDER BY id
+            """,
+            (user_id, max_id)
+        )
+        created = [dict(row) for row in cursor.fetchall()]
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    logger.info(f"批量创建{table}记录成功: {len(created)} 行, 涉及 {len(stock_rows)} 个产品 (用户: {user_id})")
+    return created
@@ -0,0 +1,289 @@
+"""
+慢查询日志
+连接池中的每条语句都计时（执行和读取结果的耗时之和），超过阈值的语句记录到日志：
+规范化的 SQL、参数类型、返回（或影响）的行数和 EXPLAIN QUERY PLAN 的输出，
+并按语句指纹（规范化 SQL 的哈希）汇总次数与耗时，供 /stats/slow-queries 查看
+
+列表接口的 SQL 由筛选条件动态拼接，同一接口会产生多种语句；
+按指纹汇总后可以看出具体是哪种条件组合变慢、查询计划是否用上了索引
+
+查询计划在独立的只读连接上获取（与请求的连接和事务无关，可以在任意线程中执行）；
+同一指纹的查询计划缓存一段时间，不会在每次慢查询时重复获取。
+引用 ATTACH 库（导入暂存库、日志归档库）的语句在独立连接上无法解析，记录错误信息代替查询计划
+"""
+
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 默认慢查询阈值（毫秒）
+SLOW_QUERY_THRESHOLD_MS = 100
+
+# 最多汇总的语句指纹数（超出时淘汰累计耗时最少的指纹）
+SLOW_QUERY_MAX_FINGERPRINTS = 500
+
+# 查询计划的缓存时间（秒）
+PLAN_REFRESH_SECONDS = 300
+
+# 可以获取查询计划的语句
+_EXPLAINABLE_PATTERN = re.compile(r"^\s*(?:SELECT|WITH|INSERT|REPLACE|UPDATE|DELETE)\b", re.IGNORECASE)
+
+# SQL 规范化：字符串和数字字面量替换为 ?，IN 列表折叠，空白压缩
+_STRING_LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL_PATTERN = re.compile(r"(?<![\w.])\d+(?:\.\d+)?\b")
+_IN_LIST_PATTERN = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)", re.IGNORECASE)
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql: str) -> str:
+    """
+    规范化 SQL（用于汇总和日志）
+
+    字面量替换为 ?，IN (?, ?, ...) 折叠为 IN (?...)，空白压缩为一个空格
+    """
+    sql = _STRING_LITERAL_PATTERN.sub("?", sql)
+    sql = _NUMBER_LITERAL_PATTERN.sub("?", sql)
+    sql = _IN_LIST_PATTERN.sub("IN (?...)", sql)
+    return _WHITESPACE_PATTERN.sub(" ", sql).strip()
+
+
+def sql_fingerprint(normalized_sql: str) -> str:
+    """语句指纹（规范化 SQL 的 SHA-1 前 12 位）"""
+    return hashlib.sha1(normalized_sql.encode("utf-8")).hexdigest()[:12]
+
+
+def _value_shape(value: Any) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, str):
+        return f"str[{len(value)}]"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"bytes[{len(value)}]"
+    return type(value).__name__
+
+
+def param_shape(parameters: Any) -> str:
+    """
+    参数的类型和长度（不记录参数值，日志中不出现用户数据）
+
+    如 (int, str[12], null)；命名参数为 {name: str[3]}；未知（executemany）时为 -
+    """
+    if parameters is None:
+        return "-"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{name}: {_value_shape(value)}" for name, value in parameters.items()) + "}"
+    try:
+        return "(" + ", ".join(_value_shape(value) for value in parameters) + ")"
+    except TypeError:
+        return _value_shape(parameters)
+
+
+def format_plan(rows: List[tuple]) -> List[str]:
+    """把 EXPLAIN QUERY PLAN 的结果（id, parent, notused, detail）按层级缩进"""
+    depth: Dict[int, int] = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return lines
+
+
+class SlowQueryLog:
+    """慢查询记录与按指纹汇总"""
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        threshold_ms: float = SLOW_QUERY_THRESHOLD_MS,
+        max_fingerprints: int = SLOW_QUERY_MAX_FINGERPRINTS
+    ):
+        """
+        Args:
+            db_path: 数据库文件路径（用于获取查询计划，为 None 时不获取）
+            threshold_ms: 慢查询阈值（毫秒，0 表示关闭）
+            max_fingerprints: 最多汇总的语句指纹数
+        """
+        self.db_path = db_path
+        self.threshold_ms = threshold_ms
+        self.threshold = threshold_ms / 1000.0
+        self.enabled = threshold_ms > 0
+        self.max_fingerprints = max_fingerprints
+        self._entries: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._explain_conn: Optional[sqlite3.Connection] = None
+        self._explain_lock = threading.Lock()
+        self._stats = {
+            "slow_statements": 0,
+            "plans_captured": 0,
+            "plan_errors": 0,
+        }
+
+    def observe(self, sql: str, parameters: Any, seconds: float, rows: Optional[int]):
+        """
+        记录一条语句的耗时（未超过阈值时直接返回）
+
+        Args:
+            sql: 原始 SQL
+            parameters: 绑定参数（executemany 的多组参数不记录，为 None）
+            seconds: 执行和读取结果的耗时
+            rows: 返回的行数（查询）或影响的行数（写语句），未知时为 None
+        """
+        if seconds < self.threshold:
+            return
+
+        normalized = normalize_sql(sql)
+        fingerprint = sql_fingerprint(normalized)
+        shape = param_shape(parameters)
+        now = time.time()
+
+        with self._lock:
+            self._stats["slow_statements"] += 1
+            entry = self._entries.get(fingerprint)
+            if entry is None:
+                entry = self._new_entry(fingerprint, normalized)
+            entry["count"] += 1
+            entry["total_seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            entry["last_seconds"] = seconds
+            entry["last_rows"] = rows
+            if rows is not None:
+                entry["max_rows"] = max(entry["max_rows"] or 0, rows)
+            entry["last_param_shape"] = shape
+            entry["last_seen"] = now
+            refresh_plan = now - entry["plan_captured_at"] >= PLAN_REFRESH_SECONDS
+
+        if refresh_plan:
+            plan = self._explain(sql, parameters)
+            with self._lock:
+                entry["plan"] = plan
+                entry["plan_captured_at"] = now
+        else:
+            plan = entry["plan"]
+
+        logger.warning(
+            f"慢查询 {seconds * 1000:.1f}ms [{fingerprint}]，行数: {rows if rows is not None else '-'}，"
+            f"参数: {shape}\n  SQL: {normalized}"
+            + ("\n  查询计划:\n    " + "\n    ".join(plan) if plan else "")
+        )
+
+    def _new_entry(self, fingerprint: str, normalized: str) -> dict:
+        """创建指纹的汇总记录（调用方持有锁），超出上限时淘汰累计耗时最少的指纹"""
+        if len(self._entries) >= self.max_fingerprints:
+            evicted = min(self._entries.values(), key=lambda item: item["total_seconds"])
+            del self._entries[evicted["fingerprint"]]
+        entry = self._entries[fingerprint] = {
+            "fingerprint": fingerprint,
+            "sql": normalized,
+            "count": 0,
+            "total_seconds": 0.0,
+            "max_seconds": 0.0,
+            "last_seconds": 0.0,
+            "last_rows": None,
+            "max_rows": None,
+            "last_param_shape": None,
+            "first_seen": time.time(),
+            "last_seen": 0.0,
+            "plan": None,
+            "plan_captured_at": 0.0,
+        }
+        return entry
+
+    def _explain(self, sql: str, parameters: Any) -> Optional[List[str]]:
+        """在独立的只读连接上获取查询计划"""
+        if not self.db_path or parameters is None or not _EXPLAINABLE_PATTERN.match(sql):
+            return None
+        with self._explain_lock:
+            try:
+                if self._explain_conn is None:
+                    self._explain_conn = sqlite3.connect(
+                        Path(self.db_path).resolve().as_uri() + "?mode=ro",
+                        uri=True,
+                        check_same_thread=False
+                    )
+                rows = self._explain_conn.execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+                self._stats["plans_captured"] += 1
+                return format_plan(rows)
+            except sqlite3.Error as e:
+                self._stats["plan_errors"] += 1
+                return [f"（无法获取查询计划: {e}）"]
+
+    def get_top(self, limit: int = 20, order_by: str = "total") -> List[dict]:
+        """
+        获取慢语句指纹排行
+
+        Args:
+            limit: 返回条数
+            order_by: 排序依据（total 累计耗时、max 最长耗时、count 次数）
+
+        Raises:
+            ValueError: 排序依据无效
+        """
+        keys = {"total": "total_seconds", "max": "max_seconds", "count": "count"}
+        if order_by not in keys:
+            raise ValueError(f"无效的排序依据: {order_by}（可选 total、max、count）")
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda item: item[keys[order_by]], reverse=True)[:limit]
+            return [
+                {
+                    "fingerprint": entry["fingerprint"],
+                    "sql": entry["sql"],
+                    "count": entry["count"],
+                    "total_ms": round(entry["total_seconds"] * 1000, 3),
+                    "avg_ms": round(entry["total_seconds"] * 1000 / entry["count"], 3),
+                    "max_ms": round(entry["max_seconds"] * 1000, 3),
+                    "last_ms": round(entry["last_seconds"] * 1000, 3),
+                    "last_rows": entry["last_rows"],
+                    "max_rows": entry["max_rows"],
+                    "last_param_shape": entry["last_param_shape"],
+                    "first_seen": datetime.fromtimestamp(entry["first_seen"]).isoformat(timespec="seconds"),
+                    "last_seen": datetime.fromtimestamp(entry["last_seen"]).isoformat(timespec="seconds"),
+                    "plan": entry["plan"],
+                }
+                for entry in entries
+            ]
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "threshold_ms": self.threshold_ms,
+                "fingerprints": len(self._entries),
+            }
+
+    def reset(self):
+        """清空汇总记录"""
+        with self._lock:
+            self._entries.clear()
+
+    def close(self):
+        with self._explain_lock:
+            if self._explain_conn is not None:
+                self._explain_conn.close()
+                self._explain_conn = None
+
+
+# 全局实例
+_slow_query_log = SlowQueryLog()
+
+
+def init_slow_query_log(**kwargs) -> SlowQueryLog:
+    """按配置重新创建全局慢查询日志"""
+    global _slow_query_log
+    _slow_query_log.close()
+    _slow_query_log = SlowQueryLog(**kwargs)
+    return _slow_query_log
+
+
+def get_slow_query_log() -> SlowQueryLog:
+    """获取全局慢查询日志"""
+    return _slow_query_log
@@ -0,0 +1,266 @@
+"""
+请求耗时分解
+记录每个请求在认证、获取连接、SQL 执行、序列化、操作日志和压缩上花费的时间，
+以 Server-Timing 响应头返回（浏览器开发者工具可直接显示），
+并按采样率把完整记录（含每条 SQL 的耗时）保存到环形缓冲区，供 /stats/traces 查看
+
+当前请求的记录保存在上下文变量中，线程池中执行的同步函数也能记录；
+不在请求中（后台任务等）时记录函数直接返回，没有额外开销
+"""
+
+import functools
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from starlette.middleware.gzip import GZipMiddleware
+
+# 默认采样率（保存到环形缓冲区的请求比例）
+TRACE_SAMPLE_RATE = 0.01
+
+# 环形缓冲区大小
+TRACE_BUFFER_SIZE = 200
+
+# 每个采样记录最多保存的 SQL 条数
+TRACE_MAX_STATEMENTS = 50
+
+# 采样记录中 SQL 的最大长度
+_SQL_PREVIEW_LENGTH = 200
+
+# Server-Timing 中各阶段的顺序
+_SPAN_ORDER = ("auth", "db-acquire", "sql", "serialize", "audit", "gzip")
+
+
+class RequestTrace:
+    """一个请求的耗时记录"""
+
+    __slots__ = ("start", "sampled", "spans", "statements", "_open")
+
+    def __init__(self, sampled: bool):
+        self.start = time.perf_counter()
+        self.sampled = sampled
+        # 阶段名 -> [累计秒数, 次数]
+        self.spans: Dict[str, list] = {}
+        # 采样时保存每条 SQL：(SQL, 秒数)
+        self.statements: List[tuple] = []
+        self._open: set = set()
+
+    def add(self, name: str, seconds: float):
+        span = self.spans.get(name)
+        if span is None:
+            self.spans[name] = [seconds, 1]
+        else:
+            span[0] += seconds
+            span[1] += 1
+
+    def add_statement(self, sql: str, seconds: float):
+        self.add("sql", seconds)
+        if self.sampled and len(self.statements) < TRACE_MAX_STATEMENTS:
+            self.statements.append((sql, seconds))
+
+    def server_timing(self) -> str:
+        """Server-Timing 响应头的值（毫秒）"""
+        parts = []
+        for name in _SPAN_ORDER:
+            span = self.spans.get(name)
+            if span is not None:
+                parts.append(f'{name};dur={span[0] * 1000:.2f};desc="{span[1]}x"')
+        parts.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.2f}")
+        return ", ".join(parts)
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    """当前请求的耗时记录（不在请求中时为 None）"""
+    return _current_trace.get()
+
+
+def record_span(name: str, seconds: float):
+    """记录一段已测得的耗时"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+@contextmanager
+def span(name: str):
+    """
+    记录代码块的耗时（同名阶段嵌套时只记录最外层）
+
+    Usage:
+        with span("serialize"):
+            body = dumps(data)
+    """
+    trace = _current_trace.get()
+    if trace is None or name in trace._open:
+        yield
+        return
+    trace._open.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace._open.discard(name)
+        trace.add(name, time.perf_counter() - start)
+
+
+def traced(name: str):
+    """函数装饰器：记录函数的耗时（见 span）"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TraceBuffer:
+    """采样记录的环形缓冲区"""
+
+    def __init__(self, sample_rate: float = TRACE_SAMPLE_RATE, size: int = TRACE_BUFFER_SIZE):
+        self.sample_rate = sample_rate
+        self._records: deque = deque(maxlen=size)
+        self._stats = {
+            "traced": 0,
+            "sampled": 0,
+        }
+
+    def should_sample(self) -> bool:
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def record_traced(self):
+        """记录一个已完成的请求（无论是否被采样）"""
+        self._stats["traced"] += 1
+
+    def add(self, scope: dict, status_code: int, trace: RequestTrace):
+        route = scope.get("route")
+        self._records.append({
+            "time": datetime.now().isoformat(timespec="milliseconds"),
+            "method": scope["method"],
+            "path": scope["path"],
+            "route": getattr(route, "path", None),
+            "status": status_code,
+            "duration_ms": round((time.perf_counter() - trace.start) * 1000, 3),
+            "spans": {
+                name: {"ms": round(total * 1000, 3), "count": count}
+                for name, (total, count) in trace.spans.items()
+            },
+            "statements": [
+                {"sql": " ".join(sql.split())[:_SQL_PREVIEW_LENGTH], "ms": round(seconds * 1000, 3)}
+                for sql, seconds in trace.statements
+            ],
+        })
+        self._stats["sampled"] += 1
+
+    def get_records(self, limit: Optional[int] = None) -> List[dict]:
+        """获取采样记录（最新的在前）"""
+        records = list(self._records)
+        records.reverse()
+        return records[:limit] if limit else records
+
+    def get_stats(self) -> dict:
+        return {
+            **self._stats,
+            "sample_rate": self.sample_rate,
+            "buffered": len(self._records),
+        }
+
+
+# 全局缓冲区
+_buffer = TraceBuffer()
+
+
+def init_trace_buffer(**kwargs) -> TraceBuffer:
+    """按配置重新创建全局采样缓冲区"""
+    global _buffer
+    _buffer = TraceBuffer(**kwargs)
+    return _buffer
+
+
+def get_trace_buffer() -> TraceBuffer:
+    """获取全局采样缓冲区"""
+    return _buffer
+
+
+class ServerTimingMiddleware:
+    """
+    请求耗时记录中间件（ASGI）
+
+    为每个请求创建耗时记录，在响应开始时加上 Server-Timing 头（流式响应只包含响应开始前的耗时）；
+    需放在 GZip 中间件外层，压缩耗时才能计入
+    """
+
+    def __init__(self, app, enabled: bool = True):
+        self.app = app
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        buffer = _buffer
+        trace = RequestTrace(buffer.should_sample())
+        token = _current_trace.set(trace)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (b"server-timing", trace.server_timing().encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_trace.reset(token)
+            buffer.record_traced()
+            if trace.sampled:
+                buffer.add(scope, status[0], trace)
+
+
+class TimedGZipMiddleware(GZipMiddleware):
+    """
+    记录压缩耗时的 GZip 中间件
+
+    内层应用发出的每个响应消息打上时间戳，压缩后的消息发出时累计两者之差（即压缩耗时）
+    """
+
+    def __init__(self, app, **kwargs):
+        super().__init__(self._inner, **kwargs)
+        self._wrapped_app = app
+
+    async def _inner(self, scope, receive, send):
+        if _current_trace.get() is None:
+            await self._wrapped_app(scope, receive, send)
+            return
+
+        async def marked_send(message):
+            scope["agrisale.gzip_mark"] = time.perf_counter()
+            await send(message)
+
+        await self._wrapped_app(scope, receive, marked_send)
+
+    async def __call__(self, scope, receive, send):
+        trace = _current_trace.get()
+        if trace is None or scope["type"] != "http":
+            await super().__call__(scope, receive, send)
+            return
+
+        async def timed_send(message):
+            mark = scope.pop("agrisale.gzip_mark", None)
+            if mark is not None:
+                trace.add("gzip", time.perf_counter() - mark)
+            await send(message)
+
+        await super().__call__(scope, receive, timed_send)